@@ -9,10 +9,8 @@ from globaleaks.handlers.admin.user import db_get_users
 from globaleaks.orm import transact
 from globaleaks.rest.cache import Cache
 from globaleaks.state import State
-from globaleaks.transactions import db_schedule_email
 from globaleaks.utils.fs import get_disk_space
 from globaleaks.utils.log import log
-from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now, datetime_null, is_expired
 
 ANOMALY_MAP = {
@@ -68,9 +66,7 @@ def generate_admin_alert_mail(session, tid, alert):
             'user': user_desc,
         }
 
-        subject, body = Templating().get_mail_subject_and_body(data)
-
-        db_schedule_email(session, tid, user_desc['mail_address'], subject, body)
+        State.format_and_send_mail(session, tid, user_desc['mail_address'], data)
 
 
 class Alarm(object):
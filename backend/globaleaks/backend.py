@@ -67,6 +67,9 @@ class Service(service.Service):
 
             self._shutdown = True
             self.state.orm_tp.stop()
+            self.state.orm_ro_tp.stop()
+            self.state.delivery_tp.stop()
+            self.state.download_tp.stop()
             d.callback(None)
 
         reactor.callLater(30, _shutdown, None)
@@ -117,6 +120,9 @@ class Service(service.Service):
         sync_initialize_snimap()
 
         self.state.orm_tp.start()
+        self.state.orm_ro_tp.start()
+        self.state.delivery_tp.start()
+        self.state.download_tp.start()
 
         reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
 
@@ -9,13 +9,15 @@ from sqlalchemy.exc import SAWarning
 from globaleaks import models, DATABASE_VERSION
 from globaleaks.handlers.admin.https import db_load_tls_configs
 from globaleaks.models import Base, Config
+from globaleaks.models.config import config_cache
 from globaleaks.models.config_desc import ConfigFilters
-from globaleaks.orm import get_engine, get_session, make_db_uri, transact, transact_sync
+from globaleaks.orm import checkpoint, get_engine, get_session, make_db_uri, transact, transact_sync
 from globaleaks.settings import Settings
 from globaleaks.state import State, TenantState
 from globaleaks.utils import fs
 from globaleaks.utils.log import log
 from globaleaks.utils.objectdict import ObjectDict
+from globaleaks.utils.pgp import get_pgp_copy_name
 
 
 def get_db_file(db_path):
@@ -60,6 +62,9 @@ def compact_db():
     engine = get_engine(orm_lockdown=False)
     engine.execute('VACUUM')
 
+    # The VACUUM rewrites the whole database through the write-ahead log
+    checkpoint()
+
 
 @transact_sync
 def init_db(session):
@@ -125,7 +130,14 @@ def db_get_tracked_attachments(session):
     wbfiles = session.query(models.WhistleblowerFile.id).all()
     rfiles = session.query(models.ReceiverFile.id).all()
 
-    return [x[0] for x in ifiles + wbfiles + rfiles]
+    # The copies encrypted with the PGP key of a recipient are tracked while
+    # the key is unchanged
+    pgp_copies = session.query(models.WhistleblowerFile.id, models.User.pgp_key_fingerprint) \
+                        .filter(models.WhistleblowerFile.receivertip_id == models.ReceiverTip.id,
+                                models.ReceiverTip.receiver_id == models.User.id,
+                                models.User.pgp_key_fingerprint != '')
+
+    return [x[0] for x in ifiles + wbfiles + rfiles] + [get_pgp_copy_name(*x) for x in pgp_copies]
 
 
 @transact_sync
@@ -155,46 +167,21 @@ def sync_initialize_snimap(session):
         State.snimap.load(cfg['tid'], cfg)
 
 
-def db_refresh_tenant_cache(session, to_refresh=None):
-    active_tids = set([tid[0] for tid in session.query(models.Tenant.id).filter(models.Tenant.active.is_(True))])
-
-    cached_tids = set(State.tenants.keys())
-
-    disabled_tids = cached_tids - active_tids
-
-    # Remove tenants that have been disabled
-    for tid in disabled_tids:
-        if tid in State.tenants:
-            tenant_cache = State.tenants[tid].cache
-
-            State.tenant_uuid_id_map.pop(tenant_cache.uuid, None)
-            State.tenant_subdomain_id_map.pop(tenant_cache.subdomain, None)
-
-            for h in tenant_cache.hostnames + tenant_cache.onionnames:
-                State.tenant_hostname_id_map.pop(h, None)
-
-            State.snimap.unload(tid)
-
-            if State.tor:
-                State.tor.unload_onion_service(tid)
-
-            del State.tenants[tid]
-
-    if to_refresh is None or to_refresh == 1:
-        tids = active_tids
-    else:
-        tids = [to_refresh] if to_refresh in active_tids else []
+def db_load_tenant_caches(session, tids):
+    """
+    Transaction for loading the caches of the specified tenants
 
-    if not tids:
-        return
+    The caches are built on copies of the current ones so that the
+    variables not loaded from the database are preserved.
 
-    tids = sorted(tids)
+    :param session: An ORM session
+    :param tids: The IDs of the tenants
+    :return: A dictionary of the caches indexed by tenant ID
+    """
+    caches = {}
 
     for tid in tids:
-        if tid not in State.tenants:
-            State.tenants[tid] = TenantState()
-
-        tenant_cache = State.tenants[tid].cache
+        tenant_cache = ObjectDict(State.tenants[tid].cache) if tid in State.tenants else ObjectDict()
 
         tenant_cache['redirects'] = {}
         tenant_cache['custodian'] = False
@@ -204,64 +191,189 @@ def db_refresh_tenant_cache(session, to_refresh=None):
         tenant_cache['onionnames'] = []
         tenant_cache['languages_enabled'] = []
 
-    root_tenant_cache = State.tenants[1].cache
+        caches[tid] = tenant_cache
 
     for tid, lang in session.query(models.EnabledLanguage.tid, models.EnabledLanguage.name)\
                             .filter(models.EnabledLanguage.tid.in_(tids)):
-        State.tenants[tid].cache['languages_enabled'].append(lang)
+        caches[tid]['languages_enabled'].append(lang)
+
+    # The variables of the tenants with an available config store are not reloaded
+    values = {}
+    for tid in tids:
+        store = config_cache.get_values(session, tid, load=False)
+        if store is not None:
+            values[tid] = store.items()
+
+    missing = [tid for tid in tids if tid not in values]
+    if missing:
+        for tid in missing:
+            values[tid] = []
 
-    for cfg in session.query(Config).filter(Config.tid.in_(tids)):
-        tenant_cache = State.tenants[cfg.tid].cache
+        for cfg in session.query(Config.tid, Config.var_name, Config.value).filter(Config.tid.in_(missing)):
+            values[cfg.tid].append((cfg.var_name, cfg.value))
 
-        if cfg.var_name in ['https_cert', 'tor_onion_key']:
-            tenant_cache[cfg.var_name] = cfg.value
-        elif cfg.var_name in ConfigFilters['node']:
-            tenant_cache[cfg.var_name] = cfg.value
-        elif cfg.var_name in ConfigFilters['notification']:
-            tenant_cache['notification'][cfg.var_name] = cfg.value
+    for tid in tids:
+        tenant_cache = caches[tid]
+
+        for var_name, value in values[tid]:
+            if var_name in ['https_cert', 'tor_onion_key']:
+                tenant_cache[var_name] = value
+            elif var_name in ConfigFilters['node']:
+                tenant_cache[var_name] = value
+            elif var_name in ConfigFilters['notification']:
+                tenant_cache['notification'][var_name] = value
 
     for tid, mail, pub_key in session.query(models.User.tid, models.User.mail_address, models.User.pgp_key_public) \
                                      .filter(models.User.role == 'admin',
                                              models.User.enabled.is_(True),
                                              models.User.notification.is_(True),
                                              models.User.tid.in_(tids)):
-        State.tenants[tid].cache.notification.admin_list.extend([(mail, pub_key)])
+        caches[tid].notification.admin_list.extend([(mail, pub_key)])
 
-    for custodian in session.query(models.User) \
-                            .filter(models.User.role == 'custodian',
-                                    models.User.enabled.is_(True),
-                                    models.User.tid.in_(tids)):
-        State.tenants[custodian.tid].cache['custodian'] = True
+    for tid, in session.query(models.User.tid) \
+                       .filter(models.User.role == 'custodian',
+                               models.User.enabled.is_(True),
+                               models.User.tid.in_(tids)):
+        caches[tid]['custodian'] = True
 
     for redirect in session.query(models.Redirect).filter(models.Redirect.tid.in_(tids)):
-        State.tenants[redirect.tid].cache['redirects'][redirect.path1] = redirect.path2
+        caches[redirect.tid]['redirects'][redirect.path1] = redirect.path2
 
-    for tid in tids:
-        tenant_cache = State.tenants[tid].cache
+    return caches
+
+
+def set_tenant_routes(tenant_cache, root_tenant_cache):
+    """
+    Compute the hostnames and the onion names through which a tenant is reachable
+
+    :param tenant_cache: The cache of the tenant
+    :param root_tenant_cache: The cache of the root tenant
+    """
+    if tenant_cache.hostname and tenant_cache.reachable_via_web:
+        tenant_cache.hostnames.append(tenant_cache.hostname.encode())
+
+    if tenant_cache.onionservice:
+        tenant_cache.onionnames.append(tenant_cache.onionservice.encode())
+
+    if not tenant_cache.onionservice and root_tenant_cache.onionservice:
+        tenant_cache.onionservice = tenant_cache.subdomain + '.' + root_tenant_cache.onionservice
+
+    if tenant_cache.subdomain:
+        if root_tenant_cache.rootdomain and tenant_cache.reachable_via_web:
+            tenant_cache.hostnames.append('{}.{}'.format(tenant_cache.subdomain, root_tenant_cache.rootdomain).encode())
+
+        if root_tenant_cache.onionservice:
+            tenant_cache.onionnames.append('{}.{}'.format(tenant_cache.subdomain, root_tenant_cache.onionservice).encode())
 
-        State.tenant_uuid_id_map[tenant_cache.uuid] = tid
 
-        if tenant_cache.hostname and tenant_cache.reachable_via_web:
-            tenant_cache.hostnames.append(tenant_cache.hostname.encode())
+def unload_tenant_routes(tid, tenant_cache):
+    """
+    Remove from the routing maps the entries of a tenant
+
+    :param tid: A tenant ID
+    :param tenant_cache: The cache of the tenant
+    """
+    for m, keys in [(State.tenant_uuid_id_map, [tenant_cache.get('uuid')]),
+                    (State.tenant_subdomain_id_map, [tenant_cache.get('subdomain')]),
+                    (State.tenant_hostname_id_map, tenant_cache.get('hostnames', []) + tenant_cache.get('onionnames', []))]:
+        for key in keys:
+            if m.get(key) == tid:
+                del m[key]
+
+
+def load_tenant_routes(tid, tenant_cache):
+    """
+    Add to the routing maps the entries of a tenant
+
+    :param tid: A tenant ID
+    :param tenant_cache: The cache of the tenant
+    """
+    State.tenant_uuid_id_map[tenant_cache.uuid] = tid
+
+    if tenant_cache.subdomain:
+        State.tenant_subdomain_id_map[tenant_cache.subdomain] = tid
+
+    State.tenant_hostname_id_map.update({h: tid for h in tenant_cache.hostnames + tenant_cache.onionnames})
+
+
+def db_refresh_tenant_cache(session, to_refresh=None):
+    """
+    Transaction for refreshing the cache of the tenants
+
+    The caches are rebuilt off-line and swapped with the current ones so
+    that the requests never read partially updated caches. The routing
+    maps are updated only for the entries of the refreshed tenants.
+
+    Together with the requested tenants are refreshed the ones whose
+    configuration has been written since their last refresh.
+
+    :param session: An ORM session
+    :param to_refresh: A tenant ID or a collection of tenant IDs; None refreshes all the tenants
+    """
+    active_tids = set([tid[0] for tid in session.query(models.Tenant.id).filter(models.Tenant.active.is_(True))])
+
+    cached_tids = set(State.tenants.keys())
+
+    disabled_tids = cached_tids - active_tids
+
+    # Remove tenants that have been disabled
+    for tid in disabled_tids:
+        if tid in State.tenants:
+            unload_tenant_routes(tid, State.tenants[tid].cache)
+
+            State.snimap.unload(tid)
+
+            if State.tor:
+                State.tor.unload_onion_service(tid)
 
-        if tenant_cache.onionservice:
-            tenant_cache.onionnames.append(tenant_cache.onionservice.encode())
+            del State.tenants[tid]
 
-        if not tenant_cache.onionservice and root_tenant_cache.onionservice:
-            tenant_cache.onionservice = tenant_cache.subdomain + '.' + root_tenant_cache.onionservice
+    epoch, versions = config_cache.snapshot()
 
-        if tenant_cache.subdomain:
-            State.tenant_subdomain_id_map[tenant_cache.subdomain] = tid
+    if to_refresh is None:
+        tids = set(active_tids)
+    elif isinstance(to_refresh, int):
+        tids = active_tids.intersection([to_refresh])
+    else:
+        tids = active_tids.intersection(to_refresh)
 
-            if root_tenant_cache.rootdomain and tenant_cache.reachable_via_web:
-                tenant_cache.hostnames.append('{}.{}'.format(tenant_cache.subdomain, root_tenant_cache.rootdomain).encode())
+    # The tenants whose configuration has been written since their last refresh
+    # are refreshed together with the requested ones
+    tids.update(tid for tid in active_tids
+                if tid not in State.tenants or State.tenants[tid].config_version != (epoch, versions.get(tid, 0)))
+
+    if not tids:
+        return
+
+    caches = db_load_tenant_caches(session, sorted(tids))
+
+    root_tenant_cache = caches[1] if 1 in caches else State.tenants[1].cache
+
+    # The routes of all the tenants depend on the domains of the root tenant
+    if 1 in caches and 1 in State.tenants and tids != active_tids:
+        old_root_tenant_cache = State.tenants[1].cache
+        if root_tenant_cache.rootdomain != old_root_tenant_cache.get('rootdomain') or \
+           root_tenant_cache.onionservice != old_root_tenant_cache.get('onionservice'):
+            tids = active_tids
+            caches.update(db_load_tenant_caches(session, sorted(tids - set(caches))))
+
+    for tid in sorted(tids):
+        tenant_cache = caches[tid]
+
+        set_tenant_routes(tenant_cache, root_tenant_cache)
+
+        if tid not in State.tenants:
+            State.tenants[tid] = TenantState()
+        else:
+            unload_tenant_routes(tid, State.tenants[tid].cache)
 
-            if root_tenant_cache.onionservice:
-                tenant_cache.onionnames.append('{}.{}'.format(tenant_cache.subdomain, root_tenant_cache.onionservice).encode())
+        State.tenants[tid].cache = tenant_cache
+        State.tenants[tid].config_version = (epoch, versions.get(tid, 0))
 
-        State.tenant_hostname_id_map.update({h: tid for h in tenant_cache.hostnames + tenant_cache.onionnames})
+        load_tenant_routes(tid, tenant_cache)
 
-    if getattr(State, 'tor'):
+    if getattr(State, 'tor') and \
+       any(State.tenants[tid].cache.tor_onion_key and not hasattr(State.tenants[tid], 'ephs') for tid in tids):
         State.tor.load_all_onion_services()
 
     if 1 in tids:
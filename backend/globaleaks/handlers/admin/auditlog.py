@@ -6,8 +6,10 @@ from sqlalchemy.sql.expression import distinct, func
 
 from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.orm import transact
+from globaleaks.orm import get_query_stats, transact_ro
+from globaleaks.sessions import Sessions
 from globaleaks.state import State
+from globaleaks.utils.crypto import argon2_pool
 
 
 def serialize_log(log):
@@ -21,14 +23,14 @@ def serialize_log(log):
     }
 
 
-@transact
+@transact_ro
 def get_audit_log(session, tid):
     logs = session.query(models.AuditLog).filter(models.AuditLog.tid == tid)
 
     return [serialize_log(log) for log in logs]
 
 
-@transact
+@transact_ro
 def get_tips(session, tid):
     tips = []
 
@@ -107,12 +109,39 @@ class JobsTiming(BaseHandler):
         for job in State.jobs:
             response.append({
                 'name': job.name,
-                'timings': job.last_executions
+                'timings': job.last_executions,
+                'stats': job.get_stats()
             })
 
         return response
 
 
+class Stats(BaseHandler):
+    """
+    This handler return the counters of the shared resources of the backend
+    """
+    check_roles = 'admin'
+    root_tenant_only = True
+
+    def get(self):
+        return {
+            'argon2': argon2_pool.get_stats(),
+            'tip_keys': Sessions.get_tip_keys_stats()
+        }
+
+
+class QueriesProfile(BaseHandler):
+    """
+    This handler return the statements, the rows and the time of the
+    transactions of every handler and job and the likely N+1 queries
+    """
+    check_roles = 'admin'
+    root_tenant_only = True
+
+    def get(self):
+        return get_query_stats()
+
+
 class AuditLog(BaseHandler):
     """
     Handler that provide access to the access.log file
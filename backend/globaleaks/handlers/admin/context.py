@@ -3,7 +3,7 @@ from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.operation import OperationHandler
 from globaleaks.models import fill_localized_keys, get_localized_values
-from globaleaks.orm import db_add, db_del, db_get, transact, tw
+from globaleaks.orm import db_add, db_del, db_get, transact, transact_ro, tw
 from globaleaks.rest import requests, errors
 
 
@@ -47,7 +47,7 @@ def admin_serialize_context(session, context, language):
     return get_localized_values(ret, context, context.localized_keys, language)
 
 
-@transact
+@transact_ro
 def get_contexts(session, tid, language):
     """
     Returns the context list.
@@ -88,7 +88,7 @@ def db_associate_context_receivers(session, context, receiver_ids):
                                             'order': i}))
 
 
-@transact
+@transact_ro
 def get_context(session, tid, context_id, language):
     """
     Transaction for retrieving a context serialized in the specified language
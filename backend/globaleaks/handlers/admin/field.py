@@ -5,7 +5,7 @@ from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.public import serialize_field, trigger_map
 from globaleaks.models import fill_localized_keys
-from globaleaks.orm import db_add, db_get, db_del, transact, tw
+from globaleaks.orm import db_add, db_get, db_del, transact, transact_ro, tr
 from globaleaks.rest import errors, requests
 from globaleaks.settings import Settings
 from globaleaks.utils.fs import read_json_file
@@ -373,7 +373,7 @@ def delete_field(session, tid, field_id):
     session.delete(field)
 
 
-@transact
+@transact_ro
 def get_fieldtemplate_list(session, tid, language):
     """
     Transaction to retrieve the list of the field templates defined on a tenant
@@ -428,7 +428,7 @@ class FieldTemplateInstance(BaseHandler):
         """
         Export field template
         """
-        return tw(db_get_field, self.request.tid, field_id, None)
+        return tr(db_get_field, self.request.tid, field_id, None)
 
     def put(self, field_id):
         """
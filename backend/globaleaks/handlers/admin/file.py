@@ -8,7 +8,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 
 from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.orm import transact, tw
+from globaleaks.orm import transact, transact_ro, tw
 from globaleaks.rest import errors, requests
 from globaleaks.state import State
 from globaleaks.utils.fs import directory_traversal_check
@@ -18,7 +18,7 @@ from globaleaks.utils.utility import uuid4
 special_files = ['css', 'favicon', 'logo', 'script']
 
 
-@transact
+@transact_ro
 def get_files(session, tid):
     """
     Transaction to retrieve the list of files configured on a tenant
@@ -64,7 +64,7 @@ def db_get_file_by_id_or_name(session, tid, id_or_name):
                               models.File.name == id_or_name)).one_or_none()
 
 
-@transact
+@transact_ro
 def get_file_id_by_name(session, tid, name):
     """
     Transaction returning a file ID given the file name
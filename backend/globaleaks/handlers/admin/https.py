@@ -8,7 +8,7 @@ from twisted.internet.defer import inlineCallbacks
 from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.models.config import ConfigFactory
-from globaleaks.orm import transact, tw
+from globaleaks.orm import transact, tw, tr
 from globaleaks.rest import errors, requests
 from globaleaks.settings import Settings
 from globaleaks.state import State
@@ -340,7 +340,7 @@ class ConfigHandler(BaseHandler):
     root_tenant_or_management_only = True
 
     def get(self):
-        return tw(db_serialize_https_config_summary, self.request.tid)
+        return tr(db_serialize_https_config_summary, self.request.tid)
 
     def post(self):
         tw(db_try_to_enable_https, self.request.tid)
@@ -3,7 +3,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.models.config import ConfigFactory
-from globaleaks.orm import tw
+from globaleaks.orm import tw, tr
 from globaleaks.rest import errors, requests
 from globaleaks.utils.ip import parse_csv_ip_ranges_to_ip_networks
 
@@ -48,7 +48,7 @@ class NetworkInstance(BaseHandler):
         """
         Get the network infos.
         """
-        return tw(db_admin_serialize_network,
+        return tr(db_admin_serialize_network,
                   self.request.tid)
 
     @inlineCallbacks
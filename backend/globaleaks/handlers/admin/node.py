@@ -5,12 +5,11 @@ from globaleaks import models, LANGUAGES_SUPPORTED_CODES, LANGUAGES_SUPPORTED
 from globaleaks.db.appdata import load_appdata
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.public import db_get_languages
-from globaleaks.models.config import ConfigFactory, ConfigL10NFactory
-from globaleaks.orm import db_del, tw
+from globaleaks.models.config import config_cache, ConfigFactory, ConfigL10NFactory
+from globaleaks.orm import db_del, tw, tr
 from globaleaks.rest import errors, requests
 from globaleaks.state import State
 from globaleaks.utils.crypto import Base64Encoder, GCE
-from globaleaks.utils.fs import read_file
 from globaleaks.utils.log import log
 
 
@@ -57,6 +56,11 @@ def db_admin_serialize_node(session, tid, language, config_desc='node'):
     :param config_desc: The set of variables to be serialized
     :return: Return the serialized configuration for the specified tenant
     """
+    return config_cache.get(session, tid, config_desc, language,
+                            lambda: _db_admin_serialize_node(session, tid, language, config_desc))
+
+
+def _db_admin_serialize_node(session, tid, language, config_desc):
     config = ConfigFactory(session, tid)
     root_config = ConfigFactory(session, tid)
 
@@ -65,8 +69,8 @@ def db_admin_serialize_node(session, tid, language, config_desc='node'):
     logo = session.query(models.File.id).filter(models.File.tid == tid, models.File.name == 'logo').one_or_none()
 
     ret.update({
-        'changelog': read_file('/usr/share/globaleaks/CHANGELOG'),
-        'license': read_file('/usr/share/globaleaks/LICENSE'),
+        'changelog': State.changelog,
+        'license': State.license,
         'languages_supported': LANGUAGES_SUPPORTED,
         'languages_enabled': db_get_languages(session, tid),
         'root_tenant': tid == 1,
@@ -137,7 +141,7 @@ class NodeInstance(BaseHandler):
         """
         config = yield self.determine_allow_config_filter()
 
-        ret = yield tw(db_admin_serialize_node,
+        ret = yield tr(db_admin_serialize_node,
                        self.request.tid,
                        self.request.language,
                        config_desc=config[0])
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.models.config import ConfigFactory, ConfigL10NFactory
+from globaleaks.models.config import config_cache, ConfigFactory, ConfigL10NFactory
 from globaleaks.models.config_desc import ConfigL10NFilters
-from globaleaks.orm import transact, tw
+from globaleaks.orm import transact, tr
 from globaleaks.rest import requests
 
 
@@ -15,6 +15,11 @@ def db_get_notification(session, tid, language):
     :param language: The language to be used in the serialization
     :return: the serialization of notification settings for the specified tenant
     """
+    return config_cache.get(session, tid, 'notification', language,
+                            lambda: _db_get_notification(session, tid, language))
+
+
+def _db_get_notification(session, tid, language):
     ret = ConfigFactory(session, tid).serialize('notification')
 
     ret.update(ConfigL10NFactory(session, tid).serialize('notification', language))
@@ -40,7 +45,7 @@ class NotificationInstance(BaseHandler):
     invalidate_cache = True
 
     def get(self):
-        return tw(db_get_notification, self.request.tid, self.request.language)
+        return tr(db_get_notification, self.request.tid, self.request.language)
 
     def put(self):
         """
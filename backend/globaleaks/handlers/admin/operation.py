@@ -1,6 +1,7 @@
 # -*- coding: utf-8
 import os
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
 
 from globaleaks import models
 from globaleaks.db.appdata import load_appdata
@@ -9,13 +10,13 @@ from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.operation import OperationHandler
 from globaleaks.handlers.user.reset_password import db_generate_password_reset_token
 from globaleaks.handlers.user import get_user
-from globaleaks.handlers.user.operation import disable_2fa
+from globaleaks.handlers.user.operation import disable_2fa, generate_password_credentials, get_user_credentials
 from globaleaks.models import Config, InternalTip, User
 from globaleaks.models.config import db_set_config_variable, ConfigFactory, ConfigL10NFactory
 from globaleaks.orm import db_del, db_get, db_log, transact, tw
 from globaleaks.rest import errors
 from globaleaks.state import State
-from globaleaks.transactions import db_get_user
+from globaleaks.transactions import db_get_user, encrypt_mail_body
 from globaleaks.utils.crypto import Base64Encoder, GCE
 from globaleaks.utils.onion import generate_onion_service_v3
 from globaleaks.utils.templating import Templating
@@ -192,12 +193,13 @@ def reset_templates(session, tid):
     ConfigL10NFactory(session, tid).reset('notification', load_appdata())
 
 
-def db_set_user_password(session, tid, user_session, user_id, password):
+def db_set_user_password(session, tid, user_session, user_id, credentials):
     user = db_get_user(session, tid, user_id)
 
-    if password and (not user.crypto_pub_key or user_session.ek):
+    if credentials and (not user.crypto_pub_key or user_session.ek):
+        user.salt, user.hash, enc_key = credentials
+
         if user.crypto_pub_key and user_session.ek:
-            enc_key = GCE.derive_key(password.encode(), user.salt)
             crypto_escrow_prv_key = GCE.asymmetric_decrypt(user_session.cc, Base64Encoder.decode(user_session.ek))
 
             if user_session.user_tid == 1:
@@ -207,19 +209,24 @@ def db_set_user_password(session, tid, user_session, user_id, password):
 
             user.crypto_prv_key = Base64Encoder.encode(GCE.symmetric_encrypt(enc_key, user_cc))
 
-        if len(user.hash) != 44:
-            user.salt = GCE.generate_salt()
-
-        user.hash = GCE.hash_password(password, user.salt)
         user.password_change_date = datetime_now()
         user.password_change_needed = True
 
         db_log(session, tid=tid, type='change_password', user_id=user_session.user_id, object_id=user_id)
 
 
-@transact
-def set_user_password(session, tid, user_session, user_id, password):
-  return db_set_user_password(session, tid, user_session, user_id, password)
+@inlineCallbacks
+def set_user_password(tid, user_session, user_id, password):
+    credentials = None
+
+    if password:
+        salt, hash, _ = yield get_user_credentials(tid, user_id)
+
+        # Regenerate the password hash only if different from the best choice on the platform
+        credentials = yield deferToThread(generate_password_credentials,
+                                          password, salt if len(hash) == 44 else None)
+
+    yield tw(db_set_user_password, tid, user_session, user_id, credentials)
 
 
 def set_tmp_key(user_session, user, token):
@@ -341,6 +348,9 @@ class AdminOperationHandler(OperationHandler):
 
         subject, body = Templating().get_mail_subject_and_body(data)
 
+        if user['pgp_key_public']:
+            body = yield deferToThread(encrypt_mail_body, user['pgp_key_public'], body)
+
         yield self.state.sendmail(tid, user['mail_address'], subject, body)
 
     def toggle_escrow(self, req_args, *args, **kwargs):
@@ -4,7 +4,7 @@ from globaleaks.handlers.admin.step import db_create_step
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.public import serialize_questionnaire
 from globaleaks.models import fill_localized_keys
-from globaleaks.orm import db_add, db_del, db_get, transact, tw
+from globaleaks.orm import db_add, db_del, db_get, transact, tw, tr
 from globaleaks.rest import requests
 from globaleaks.utils.utility import uuid4
 
@@ -181,7 +181,7 @@ class QuestionnairesCollection(BaseHandler):
         """
         Return all the questionnaires.
         """
-        return tw(db_get_questionnaires, self.request.tid, self.request.language)
+        return tr(db_get_questionnaires, self.request.tid, self.request.language)
 
     def post(self):
         """
@@ -207,7 +207,7 @@ class QuestionnaireInstance(BaseHandler):
         """
         Export questionnaire JSON
         """
-        return tw(db_get_questionnaire, self.request.tid, questionnaire_id, None)
+        return tr(db_get_questionnaire, self.request.tid, questionnaire_id, None)
 
     def put(self, questionnaire_id):
         """
@@ -8,7 +8,7 @@ from globaleaks.handlers.public import db_get_submission_status, \
     db_get_submission_statuses, serialize_submission_status, \
     serialize_submission_substatus
 from globaleaks.models import fill_localized_keys
-from globaleaks.orm import db_del, db_get, transact, tw
+from globaleaks.orm import db_del, db_get, transact, tw, tr
 from globaleaks.rest import requests
 
 
@@ -154,7 +154,7 @@ class SubmissionStatusCollection(OperationHandler):
     invalidate_cache = True
 
     def get(self):
-        return tw(db_get_submission_statuses, self.request.tid, self.request.language)
+        return tr(db_get_submission_statuses, self.request.tid, self.request.language)
 
     def post(self):
         request = self.validate_request(self.request.content.read(),
@@ -192,7 +192,7 @@ class SubmissionSubStatusCollection(OperationHandler):
 
     @inlineCallbacks
     def get(self, status_id):
-        submission_status = yield tw(db_get_submission_status,
+        submission_status = yield tr(db_get_submission_status,
                                      self.request.tid,
                                      status_id,
                                      self.request.language)
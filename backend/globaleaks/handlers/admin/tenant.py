@@ -6,7 +6,7 @@ from globaleaks.handlers.wizard import db_wizard
 from globaleaks.models import serializers
 from globaleaks.models.config import db_get_config_variable, \
     db_set_config_variable
-from globaleaks.orm import db_del, db_get, transact, tw
+from globaleaks.orm import db_del, db_get, transact, transact_ro, tw
 from globaleaks.rest import requests
 from globaleaks.utils.tls import gen_selfsigned_certificate
 
@@ -79,7 +79,7 @@ def create_and_initialize(session, desc, *args, **kwargs):
         'enable_developers_exception_notification': True
     }
 
-    db_wizard(session, t.id, '', wizard)
+    db_wizard(session, t.id, '', wizard, {})
 
     return serializers.serialize_tenant(session, t)
 
@@ -96,12 +96,12 @@ def db_get_tenant_list(session):
     return ret
 
 
-@transact
+@transact_ro
 def get_tenant_list(session):
     return db_get_tenant_list(session)
 
 
-@transact
+@transact_ro
 def get(session, tid):
     return serializers.serialize_tenant(session, db_get(session, models.Tenant, models.Tenant.id == tid))
 
@@ -1,13 +1,16 @@
 # -*- coding: utf-8
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
 
 from globaleaks import models
 from globaleaks.handlers.admin.operation import generate_password_reset_token
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.handlers.user import parse_pgp_options, \
+from globaleaks.handlers.user import load_pgp_key, \
+                                     parse_pgp_options, \
                                      user_serialize_user
+from globaleaks.handlers.user.operation import generate_password_credentials
 from globaleaks.models import fill_localized_keys
-from globaleaks.orm import db_del, db_get, db_log, transact, tw
+from globaleaks.orm import db_del, db_get, db_log, tw, tr
 from globaleaks.rest import errors, requests
 from globaleaks.state import State
 from globaleaks.transactions import db_get_user
@@ -15,16 +18,15 @@ from globaleaks.utils.crypto import GCE, Base64Encoder, generateRandomPassword
 from globaleaks.utils.utility import datetime_now, datetime_null, uuid4
 
 
-def db_set_user_password(session, tid, user, password):
+def db_set_user_password(session, tid, user, credentials):
     config = models.config.ConfigFactory(session, tid)
 
-    user.hash = GCE.hash_password(password, user.salt)
+    user.salt, user.hash, enc_key = credentials
     user.password_change_date = datetime_now()
 
     if config.get_val('encryption'):
         root_config = models.config.ConfigFactory(session, 1)
 
-        enc_key = GCE.derive_key(password.encode(), user.salt)
         cc, user.crypto_pub_key = GCE.generate_keypair()
         user.crypto_prv_key = Base64Encoder.encode(GCE.symmetric_encrypt(enc_key, cc))
         user.crypto_bkp_key, user.crypto_rec_key = GCE.generate_recovery_key(cc)
@@ -40,7 +42,7 @@ def db_set_user_password(session, tid, user, password):
 
 
 
-def db_create_user(session, tid, user_session, request, language):
+def db_create_user(session, tid, user_session, request, language, credentials=None, pgpctx=None):
     """
     Transaction for creating a new user
 
@@ -49,6 +51,8 @@ def db_create_user(session, tid, user_session, request, language):
     :param user_session: The session of the user performing the operation
     :param request: The request data
     :param language: The language of the request
+    :param credentials: The salt, the hash and the key of an initial password
+    :param pgpctx: The context of the PGP key of the request
     :return: The serialized descriptor of the created object
     """
     request['tid'] = tid
@@ -68,10 +72,10 @@ def db_create_user(session, tid, user_session, request, language):
     user.language = request['language']
 
     # The various options related in manage PGP keys are used here.
-    parse_pgp_options(user, request)
+    parse_pgp_options(user, request, pgpctx)
 
-    if user_session and user_session.ek:
-        db_set_user_password(session, tid, user, generateRandomPassword(16))
+    if credentials:
+        db_set_user_password(session, tid, user, credentials)
 
     session.add(user)
 
@@ -98,21 +102,39 @@ def db_delete_user(session, tid, user_session, user_id):
     db_log(session, tid=tid, type='delete_user', user_id=user_session.user_id, object_id=user_id)
 
 
-@transact
-def create_user(session, tid, user_session, request, language):
+def db_create_and_serialize_user(session, tid, user_session, request, language, credentials, pgpctx):
+    user = db_create_user(session, tid, user_session, request, language, credentials, pgpctx)
+
+    return user_serialize_user(session, user, language)
+
+
+@inlineCallbacks
+def create_user(tid, user_session, request, language):
     """
-    Transaction for creating a new user
+    Procedure for creating a new user
+
+    The users created by sessions owning an escrow key are initialized with
+    a random password whose Argon2 computation is performed out of the
+    transaction, as well as the loading of the PGP key.
 
-    :param session: An ORM session
     :param tid: A tenant ID
+    :param user_session: The session of the user performing the operation
     :param request: The request data
     :param language: The language of the request
     :return: The serialized descriptor of the created object
     """
-    return user_serialize_user(session, db_create_user(session, tid, user_session, request, language), language)
+    credentials = None
+    if user_session and user_session.ek:
+        credentials = yield deferToThread(generate_password_credentials, generateRandomPassword(16))
+
+    pgpctx = yield deferToThread(load_pgp_key, request)
+
+    user = yield tw(db_create_and_serialize_user, tid, user_session, request, language, credentials, pgpctx)
+
+    returnValue(user)
 
 
-def db_admin_update_user(session, tid, user_session, user_id, request, language):
+def db_admin_update_user(session, tid, user_session, user_id, request, language, pgpctx=None):
     """
     Transaction for updating an existing user
 
@@ -122,6 +144,7 @@ def db_admin_update_user(session, tid, user_session, user_id, request, language)
     :param user_id: The ID of the user to update
     :param request: The request data
     :param language: The language of the request
+    :param pgpctx: The context of the PGP key of the request
     :return: The serialized descriptor of the updated object
     """
     fill_localized_keys(request, models.User.localized_keys, language)
@@ -138,7 +161,7 @@ def db_admin_update_user(session, tid, user_session, user_id, request, language)
         request['password_change_needed'] = True
 
     # The various options related in manage PGP keys are used here.
-    parse_pgp_options(user, request)
+    parse_pgp_options(user, request, pgpctx)
 
     user.update(request)
 
@@ -174,7 +197,7 @@ class UsersCollection(BaseHandler):
         """
         Return all the users.
         """
-        return tw(db_get_users, self.request.tid, None, self.request.language)
+        return tr(db_get_users, self.request.tid, None, self.request.language)
 
     @inlineCallbacks
     def post(self):
@@ -193,18 +216,24 @@ class UserInstance(BaseHandler):
     check_roles = 'admin'
     invalidate_cache = True
 
+    @inlineCallbacks
     def put(self, user_id):
         """
         Update the specified user.
         """
         request = self.validate_request(self.request.content.read(), requests.AdminUserDesc)
 
-        return tw(db_admin_update_user,
-                  self.request.tid,
-                  self.session,
-                  user_id,
-                  request,
-                  self.request.language)
+        pgpctx = yield deferToThread(load_pgp_key, request)
+
+        user = yield tw(db_admin_update_user,
+                        self.request.tid,
+                        self.session,
+                        user_id,
+                        request,
+                        self.request.language,
+                        pgpctx)
+
+        return user
 
     def delete(self, user_id):
         """
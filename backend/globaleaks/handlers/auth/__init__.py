@@ -5,12 +5,13 @@ from datetime import timedelta
 from random import SystemRandom
 from sqlalchemy import or_
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
 
 import globaleaks.handlers.auth.token
 
 from globaleaks.handlers.base import connection_check, BaseHandler
 from globaleaks.models import InternalTip, User
-from globaleaks.orm import db_log, transact, tw
+from globaleaks.orm import db_log, transact_ro, tw
 from globaleaks.rest import errors, requests
 from globaleaks.sessions import initialize_submission_session, Sessions
 from globaleaks.settings import Settings
@@ -55,23 +56,63 @@ def login_delay(tid):
     return deferred_sleep(SystemRandom().randint(min_sleep, max_sleep))
 
 
-@transact
-def login_whistleblower(session, tid, receipt, client_using_tor):
+def db_has_legacy_receipt_hashes(session, tid):
+    """
+    Check if the tenant still has reports whose receipt hash has been
+    computed with the legacy scheme
+
+    The result is kept in the state of the tenant as no new legacy hash
+    is ever created.
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :return: A boolean
+    """
+    tenant = State.tenants[tid]
+
+    if tenant.legacy_receipt_hashes is None:
+        tenant.legacy_receipt_hashes = any(GCE.is_legacy_hash(x[0]) for x in
+                                           session.query(InternalTip.receipt_hash)
+                                                  .filter(InternalTip.tid == tid))
+
+    return tenant.legacy_receipt_hashes
+
+
+def db_login_whistleblower(session, tid, receipt_hash, legacy_receipt_hash, user_key, client_using_tor):
     """
     Login transaction for whistleblowers' access
 
+    Reports whose receipt hash has been computed with the legacy scheme are
+    matched only when the legacy hash is provided and get their receipt hash
+    upgraded. In case of no match without the legacy hash the transaction
+    returns None to request its computation, but only while the tenant still
+    has legacy hashes.
+
     :param session: An ORM session
     :param tid: A tenant ID
-    :param receipt: A provided receipt
+    :param receipt_hash: The hash of the provided receipt
+    :param legacy_receipt_hash: The legacy hash of the provided receipt or None
+    :param user_key: The key derived from the provided receipt
+    :param client_using_tor: A boolean signaling Tor usage
     :return: Returns a user session in case of success
     """
-    hash = GCE.hash_password(receipt, State.tenants[tid].cache.receipt_salt)
-
     itip = session.query(InternalTip) \
                   .filter(InternalTip.tid == tid,
-                          InternalTip.receipt_hash == hash).one_or_none()
+                          InternalTip.receipt_hash == receipt_hash).one_or_none()
+
+    if itip is None and legacy_receipt_hash is not None:
+        itip = session.query(InternalTip) \
+                      .filter(InternalTip.tid == tid,
+                              InternalTip.receipt_hash == legacy_receipt_hash).one_or_none()
+
+        if itip is not None:
+            itip.receipt_hash = receipt_hash
+            State.tenants[tid].legacy_receipt_hashes = None
 
     if itip is None:
+        if legacy_receipt_hash is None and db_has_legacy_receipt_hashes(session, tid):
+            return
+
         db_login_failure(session, tid, 1)
 
     itip.wb_last_access = datetime_now()
@@ -79,7 +120,6 @@ def login_whistleblower(session, tid, receipt, client_using_tor):
 
     crypto_prv_key = ''
     if itip.crypto_pub_key:
-        user_key = GCE.derive_key(receipt.encode(), State.tenants[tid].cache.receipt_salt)
         crypto_prv_key = GCE.symmetric_decrypt(user_key, Base64Encoder.decode(itip.crypto_prv_key))
 
     db_log(session, tid=tid,  type='whistleblower_login')
@@ -87,33 +127,98 @@ def login_whistleblower(session, tid, receipt, client_using_tor):
     return Sessions.new(tid, itip.id, tid, 'whistleblower', crypto_prv_key)
 
 
-@transact
-def login(session, tid, username, password, authcode, client_using_tor, client_ip):
+@inlineCallbacks
+def login_whistleblower(tid, receipt, client_using_tor):
     """
-    Login transaction for users' access
+    Login procedure for whistleblowers' access
+
+    The memory hard receipt hashing is performed before starting the
+    transaction so that no database lock is held during its execution.
 
-    :param session: An ORM session
     :param tid: A tenant ID
-    :param username: A provided username
-    :param password: A provided password
-    :param authcode: A provided authcode
+    :param receipt: A provided receipt
     :param client_using_tor: A boolean signaling Tor usage
-    :param client_ip:  The client IP
     :return: Returns a user session in case of success
     """
+    receipt_salt = State.tenants[tid].cache.receipt_salt
+
+    receipt_hash, user_key = yield deferToThread(GCE.calculate_hash_and_key, receipt, receipt_salt)
+
+    session = yield tw(db_login_whistleblower, tid, receipt_hash, None, user_key, client_using_tor)
+
+    if session is None:
+        legacy_receipt_hash = yield deferToThread(GCE.legacy_hash_password, receipt, receipt_salt)
+
+        session = yield tw(db_login_whistleblower, tid, receipt_hash, legacy_receipt_hash, user_key, client_using_tor)
+
+    returnValue(session)
+
+
+def db_get_login_user(session, tid, username):
+    """
+    Fetch the enabled user matching the username provided at login
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param username: A provided username
+    :return: The user or None if no enabled user is matched
+    """
     if tid in State.tenants and State.tenants[tid].cache.simplified_login:
-        user = session.query(User).filter(or_(User.id == username,
+        return session.query(User).filter(or_(User.id == username,
                                               User.username == username),
                                           User.enabled.is_(True),
                                           User.tid == tid).one_or_none()
-    else:
-        user = session.query(User).filter(User.username == username,
-                                          User.enabled.is_(True),
-                                          User.tid == tid).one_or_none()
 
-    if not user or not GCE.check_password(password, user.salt, user.hash):
+    return session.query(User).filter(User.username == username,
+                                      User.enabled.is_(True),
+                                      User.tid == tid).one_or_none()
+
+
+@transact_ro
+def get_login_credentials(session, tid, username):
+    """
+    Transaction for fetching the credentials of the user requesting to login
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param username: A provided username
+    :return: A tuple containing the user ID, the salt and the hash or None
+    """
+    user = db_get_login_user(session, tid, username)
+    if user is None:
+        return
+
+    return user.id, user.salt, user.hash
+
+
+def db_login(session, tid, user_id, hash, new_hash, valid, user_key, authcode, client_using_tor, client_ip):
+    """
+    Login transaction for users' access
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param user_id: The ID of the user requesting to login
+    :param hash: The password hash against which the password has been verified
+    :param new_hash: The password hash computed with the current scheme
+    :param valid: The result of the password verification
+    :param user_key: The key derived from the provided password
+    :param authcode: A provided authcode
+    :param client_using_tor: A boolean signaling Tor usage
+    :param client_ip:  The client IP
+    :return: Returns a user session in case of success
+    """
+    user = session.query(User).filter(User.id == user_id,
+                                      User.enabled.is_(True),
+                                      User.tid == tid).one_or_none()
+
+    # The check on the hash prevents the login in case of a password
+    # change happened after the verification of the password
+    if not valid or user is None or user.hash != hash:
         db_login_failure(session, tid, 0)
 
+    # Upgrade the hashes computed with the legacy scheme
+    user.hash = new_hash
+
     connection_check(tid, user.role, client_ip, client_using_tor)
 
     if user.two_factor_secret:
@@ -124,7 +229,6 @@ def login(session, tid, username, password, authcode, client_using_tor, client_i
 
     crypto_prv_key = ''
     if user.crypto_prv_key:
-        user_key = GCE.derive_key(password.encode(), user.salt)
         crypto_prv_key = GCE.symmetric_decrypt(user_key, Base64Encoder.decode(user.crypto_prv_key))
     elif State.tenants[tid].cache.encryption:
         # Force the password change on which the user key will be created
@@ -147,6 +251,39 @@ def login(session, tid, username, password, authcode, client_using_tor, client_i
     return session
 
 
+@inlineCallbacks
+def login(tid, username, password, authcode, client_using_tor, client_ip):
+    """
+    Login procedure for users' access
+
+    The procedure is split in a first transaction fetching the user
+    credentials, the memory hard password verification and key derivation
+    performed out of any transaction and a final transaction persisting
+    the login.
+
+    :param tid: A tenant ID
+    :param username: A provided username
+    :param password: A provided password
+    :param authcode: A provided authcode
+    :param client_using_tor: A boolean signaling Tor usage
+    :param client_ip:  The client IP
+    :return: Returns a user session in case of success
+    """
+    credentials = yield get_login_credentials(tid, username)
+    if credentials is None:
+        yield tw(db_login_failure, tid, 0)
+
+    user_id, salt, hash = credentials
+
+    valid, user_key, new_hash = yield deferToThread(GCE.check_password_and_derive_key,
+                                                    password, salt, hash)
+
+    session = yield tw(db_login, tid, user_id, hash, new_hash, valid, user_key,
+                       authcode, client_using_tor, client_ip)
+
+    returnValue(session)
+
+
 class AuthenticationHandler(BaseHandler):
     """
     Login handler for internal users
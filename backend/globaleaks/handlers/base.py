@@ -7,13 +7,12 @@ import re
 
 from datetime import datetime
 
-from tempfile import NamedTemporaryFile
-
-from twisted.internet import abstract
-from twisted.protocols.basic import FileSender
+from twisted.internet import abstract, reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread, deferToThreadPool
 
 from globaleaks.event import track_handler
-from globaleaks.orm import transact_sync
+from globaleaks.orm import transact_ro
 from globaleaks.rest import errors
 from globaleaks.sessions import Sessions
 from globaleaks.settings import Settings
@@ -22,7 +21,8 @@ from globaleaks.transactions import db_get_user
 from globaleaks.utils.crypto import GCE
 from globaleaks.utils.ip import check_ip
 from globaleaks.utils.log import log
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.pgp import get_pgp_context
+from globaleaks.utils.producer import get_thread_pool, ThreadedFileProducer
 from globaleaks.utils.securetempfile import SecureTemporaryFile
 from globaleaks.utils.utility import datetime_now
 
@@ -40,25 +40,23 @@ def decodeString(string):
 
 
 def serve_file(request, fo):
-    filesender = FileSender()
-
-    def on_success(byte):
-        fo.close()
-
-    def on_error(error):
-        filesender.consumer.unregisterProducer()
-        fo.close()
+    def close(result):
+        # The file is closed in a worker thread as closing may block
+        # waiting for the termination of the process encrypting it
+        return deferToThreadPool(reactor, get_thread_pool(), fo.close)
 
     if request.finished:
         return
 
-    d = filesender.beginFileTransfer(fo, request)
-    d.addCallback(on_success)
-    d.addErrback(on_error)
+    d = ThreadedFileProducer(fo).beginFileTransfer(request)
+    d.addBoth(close)
 
     return d
 
 
+def pgp_encrypt_stream(pgp_key, input_file):
+    return get_pgp_context(pgp_key).encrypt_stream(input_file)
+
 
 def connection_check(tid, role, client_ip, client_using_tor):
     """
@@ -80,19 +78,23 @@ def connection_check(tid, role, client_ip, client_using_tor):
         raise errors.TorNetworkRequired
 
 
-def db_confirmation_check(session, tid, user_id, secret):
+@transact_ro
+def get_confirmation_credentials(session, tid, user_id):
     user = db_get_user(session, tid, user_id)
 
-    if user.two_factor_secret:
-        State.totp_verify(user.two_factor_secret, secret)
-    else:
-        if not GCE.check_password(secret, user.salt, user.hash):
-            raise errors.InvalidAuthentication
+    return user.two_factor_secret, user.salt, user.hash
 
 
-@transact_sync
-def sync_confirmation_check(session, tid, user_id, secret):
-    return db_confirmation_check(session, tid, user_id, secret)
+@inlineCallbacks
+def confirmation_check(tid, user_id, secret):
+    two_factor_secret, salt, hash = yield get_confirmation_credentials(tid, user_id)
+
+    if two_factor_secret:
+        State.totp_verify(two_factor_secret, secret)
+    else:
+        valid = yield deferToThread(GCE.check_password, secret, salt, hash)
+        if not valid:
+            raise errors.InvalidAuthentication
 
 
 class BaseHandler(object):
@@ -300,7 +302,7 @@ class BaseHandler(object):
 
         secret = decodeString(self.request.headers.get(b'x-confirmation', b''))
 
-        sync_confirmation_check(self.session.user_tid, user_id, secret)
+        return confirmation_check(self.session.user_tid, user_id, secret)
 
     def open_file(self, filepath):
         self.check_file_presence(filepath)
@@ -320,21 +322,20 @@ class BaseHandler(object):
 
         return serve_file(self.request, fp)
 
+    @inlineCallbacks
     def write_file_as_download(self, filename, fp, pgp_key=''):
         if isinstance(fp, str):
             fp = self.open_file(fp)
 
         if pgp_key:
             filename += '.pgp'
-            _fp = fp
-            fp = NamedTemporaryFile()
-            PGPContext(pgp_key).encrypt_file(_fp, fp.name)
+            fp = yield deferToThreadPool(reactor, get_thread_pool(), pgp_encrypt_stream, pgp_key, fp)
 
         self.request.setHeader(b'Content-Type', 'application/octet-stream')
         self.request.setHeader(b'Content-Disposition',
                                'attachment; filename="%s"' % filename)
 
-        return serve_file(self.request, fp)
+        yield serve_file(self.request, fp)
 
     def process_file_upload(self):
         if b'flowFilename' not in self.request.args:
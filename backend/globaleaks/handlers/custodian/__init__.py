@@ -10,14 +10,14 @@ from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.models import serializers
-from globaleaks.orm import transact
+from globaleaks.orm import transact, transact_ro
 from globaleaks.rest import requests
+from globaleaks.state import State
 from globaleaks.utils.crypto import GCE
-from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now
 
 
-@transact
+@transact_ro
 def get_identityaccessrequest_list(session, tid, user_id, user_key):
     ret = []
 
@@ -33,10 +33,10 @@ def get_identityaccessrequest_list(session, tid, user_id, user_key):
             crypto_tip_prv_key = GCE.asymmetric_decrypt(user_key, base64.b64decode(iarc.crypto_tip_prv_key))
 
             if elem['request_motivation']:
-                elem['request_motivation'] = GCE.asymmetric_decrypt(crypto_tip_prv_key, base64.b64decode(elem['request_motivation'])).decode()
+                elem['request_motivation'] = GCE.tip_content_decrypt(crypto_tip_prv_key, elem['request_motivation']).decode()
 
             if elem['reply_motivation']:
-                elem['reply_motivation'] = GCE.asymmetric_decrypt(crypto_tip_prv_key, base64.b64decode(elem['reply_motivation'])).decode()
+                elem['reply_motivation'] = GCE.tip_content_decrypt(crypto_tip_prv_key, elem['reply_motivation']).decode()
 
         ret.append(elem)
 
@@ -72,18 +72,11 @@ def db_create_identity_access_reply_notifications(session, itip, iar):
         else:
             data['notification'] = db_get_notification(session, 1, user.language)
 
-        subject, body = Templating().get_mail_subject_and_body(data)
-
-        session.add(models.Mail({
-            'address': data['user']['mail_address'],
-            'subject': subject,
-            'body': body,
-            'tid': user.tid
-        }))
+        State.format_and_send_mail(session, user.tid, data['user']['mail_address'], data)
 
 
 @transact
-def update_identityaccessrequest(session, tid, user_id, identityaccessrequest_id, request):
+def update_identityaccessrequest(session, tid, user_id, user_cc, identityaccessrequest_id, request):
     iar, iarc, itip = session.query(models.IdentityAccessRequest, models.IdentityAccessRequestCustodian, models.InternalTip) \
                              .filter(models.IdentityAccessRequest.id == identityaccessrequest_id,
                                      models.IdentityAccessRequestCustodian.identityaccessrequest_id == models.IdentityAccessRequest.id,
@@ -91,7 +84,8 @@ def update_identityaccessrequest(session, tid, user_id, identityaccessrequest_id
                                      models.InternalTip.id == models.IdentityAccessRequest.internaltip_id).one()
 
     if request['reply_motivation'] and itip.crypto_tip_pub_key:
-        request['reply_motivation'] = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, request['reply_motivation']))
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(iarc.crypto_tip_prv_key))
+        request['reply_motivation'] = GCE.tip_content_encrypt(crypto_tip_prv_key, request['reply_motivation'])
 
     if iar.reply == 'pending':
         iar.reply_date = datetime_now()
@@ -114,6 +108,7 @@ class IdentityAccessRequestInstance(BaseHandler):
         request = self.validate_request(self.request.content.read(), requests.CustodianIdentityAccessRequestDesc)
         return update_identityaccessrequest(self.request.tid,
                                             self.session.user_id,
+                                            self.session.cc,
                                             identityaccessrequest_id,
                                             request)
 
@@ -6,7 +6,7 @@ import os
 from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.models.config import ConfigFactory
-from globaleaks.orm import transact
+from globaleaks.orm import transact_ro
 from globaleaks.settings import Settings
 from globaleaks.utils.fs import directory_traversal_check, read_json_file
 
@@ -21,7 +21,7 @@ def langfile_path(lang):
     return os.path.abspath(os.path.join(Settings.client_path, 'data', 'l10n', '%s.json' % lang))
 
 
-@transact
+@transact_ro
 def get_l10n(session, tid, lang):
     """
     Transaction for retrieving the custom texts configured for a specific language
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from twisted.internet.defer import inlineCallbacks, returnValue
+
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.rest import errors, requests
 
@@ -12,14 +14,17 @@ class OperationHandler(BaseHandler):
     def operation_descriptors(self):
         raise NotImplementedError
 
+    @inlineCallbacks
     def put(self, *args, **kwargs):
         request = self.validate_request(self.request.content.read(), requests.OpsDesc)
 
         if request['operation'] in self.require_confirmation:
-            self.check_confirmation()
+            yield self.check_confirmation()
 
         func = self.operation_descriptors().get(request['operation'], None)
         if func is None:
             raise errors.InputValidationError('Invalid command')
 
-        return func(self, request['args'], *args, **kwargs)
+        ret = yield func(self, request['args'], *args, **kwargs)
+
+        returnValue(ret)
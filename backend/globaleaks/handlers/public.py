@@ -10,7 +10,7 @@ from globaleaks import models, LANGUAGES_SUPPORTED, LANGUAGES_SUPPORTED_CODES
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.models import get_localized_values
 from globaleaks.models.config import ConfigFactory, ConfigL10NFactory
-from globaleaks.orm import db_get, db_query, transact
+from globaleaks.orm import db_get, db_query, transact_ro
 from globaleaks.state import State
 
 default_questionnaires = ['default']
@@ -569,7 +569,7 @@ def db_get_receivers(session, tid, language):
     return [serialize_receiver(session, receiver, language, data) for receiver in receivers]
 
 
-@transact
+@transact_ro
 def get_public_resources(session, tid, language):
     """
     Transaction that compose the public API
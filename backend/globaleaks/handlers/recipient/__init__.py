@@ -12,22 +12,22 @@ from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.recipient.rtip import db_grant_tip_access, db_revoke_tip_access
 from globaleaks.models import serializers
-from globaleaks.orm import db_get, db_del, db_log, transact
+from globaleaks.orm import db_get, db_del, db_log, transact, transact_ro
 from globaleaks.rest import requests, errors
 from globaleaks.utils.crypto import GCE
 
 import globaleaks.handlers.recipient.export
 
 
-@transact
-def get_receivertips(session, tid, receiver_id, user_key, language, args={}):
+@transact_ro
+def get_receivertips(session, tid, receiver_id, user_session, language, args={}):
     """
     Return list of submissions received by the specified receiver
 
     :param session: An ORM session
     :param tid: The tenant ID
     :param receiver_id: The receiver ID
-    :param user_key: The user key to be used for decrypting data
+    :param user_session: The session of the user to be used for decrypting data
     :param language: The language to be used during data serialization
     :return: A list of submissions descriptors
     """
@@ -76,12 +76,12 @@ def get_receivertips(session, tid, receiver_id, user_key, language, args={}):
         answers = answers.answers
         label = itip.label
         if itip.crypto_tip_pub_key:
-            tip_key = GCE.asymmetric_decrypt(user_key, base64.b64decode(rtip.crypto_tip_prv_key))
+            tip_key = user_session.get_tip_key(itip.id, base64.b64decode(rtip.crypto_tip_prv_key))
 
             if label:
-                label = GCE.asymmetric_decrypt(tip_key, base64.b64decode(label.encode())).decode()
+                label = GCE.tip_content_decrypt(tip_key, label).decode()
 
-            answers = json.loads(GCE.asymmetric_decrypt(tip_key, base64.b64decode(answers.encode())).decode())
+            answers = json.loads(GCE.tip_content_decrypt(tip_key, answers).decode())
 
         if data is None:
             subscription = 0
@@ -160,7 +160,7 @@ class TipsCollection(BaseHandler):
     def get(self):
         return get_receivertips(self.request.tid,
                                 self.session.user_id,
-                                self.session.cc,
+                                self.session,
                                 self.request.language,
                                 self.request.args)
 
@@ -3,8 +3,7 @@
 # API handling export of submissions
 import os
 from io import BytesIO
-from twisted.internet.defer import inlineCallbacks
-from twisted.internet.threads import deferToThread
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from globaleaks import models
 from globaleaks.handlers.admin.context import admin_serialize_context
@@ -13,74 +12,163 @@ from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.public import db_get_submission_statuses
 from globaleaks.handlers.recipient.rtip import db_update_submission_status
-from globaleaks.handlers.whistleblower.submission import decrypt_tip
+from globaleaks.handlers.whistleblower.submission import open_tip
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.models import serializers
-from globaleaks.orm import transact
-from globaleaks.rest import errors
+from globaleaks.orm import tr, tw
+from globaleaks.rest import errors, requests
 from globaleaks.settings import Settings
 from globaleaks.utils.crypto import Base64Encoder, GCE
 from globaleaks.utils.fs import directory_traversal_check
-from globaleaks.utils.securetempfile import SecureTemporaryFile
 from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now, datetime_null, msdos_encode
 from globaleaks.utils.zipstream import ZipStream
 
 
-def serialize_rtip_export(session, user, itip, rtip, context, language):
-    rtip_dict = serializers.serialize_rtip(session, itip, rtip, language)
+def db_serialize_export_shared_data(session, user, language):
+    """
+    Serialize the data shared by the exports of all the tips of a user
 
+    :param session: An ORM session
+    :param user: The user performing the export
+    :param language: The language to be used during data serialization
+    :return: A dictionary of serialized data
+    """
     return {
-        'type': 'export_template',
         'node': db_admin_serialize_node(session, user.tid, language),
         'notification': db_get_notification(session, user.tid, language),
+        'user': user_serialize_user(session, user, language),
+        'submission_statuses': db_get_submission_statuses(session, user.tid, language),
+        'contexts': {}
+    }
+
+
+def serialize_rtip_export(session, user, itip, rtip, context, language, shared_data=None):
+    if shared_data is None:
+        shared_data = db_serialize_export_shared_data(session, user, language)
+
+    if context.id not in shared_data['contexts']:
+        shared_data['contexts'][context.id] = admin_serialize_context(session, context, language)
+
+    rtip_dict = serializers.serialize_rtip(session, itip, rtip, language)
+
+    return {
+        'type': 'export_template',
+        'node': shared_data['node'],
+        'notification': shared_data['notification'],
         'tip': rtip_dict,
         'crypto_tip_prv_key': Base64Encoder.decode(rtip.crypto_tip_prv_key),
         'deprecated_crypto_files_prv_key': Base64Encoder.decode(rtip.deprecated_crypto_files_prv_key),
-        'user': user_serialize_user(session, user, language),
-        'context': admin_serialize_context(session, context, language),
-        'submission_statuses': db_get_submission_statuses(session, user.tid, language)
+        'user': shared_data['user'],
+        'context': shared_data['contexts'][context.id],
+        'submission_statuses': shared_data['submission_statuses']
     }
 
 
-@transact
-def get_tip_export(session, tid, user_id, itip_id, language):
-    user, context, itip, rtip = session.query(models.User, models.Context, models.InternalTip, models.ReceiverTip) \
-                                       .filter(models.User.id == user_id,
-                                               models.User.tid == tid,
-                                               models.ReceiverTip.receiver_id == models.User.id,
-                                               models.InternalTip.id == models.ReceiverTip.internaltip_id,
-                                               models.InternalTip.id == itip_id,
-                                               models.Context.id == models.InternalTip.context_id).one_or_none()
+def db_access_tips(session, tid, user_id, itip_ids):
+    """
+    Transaction for registering the access of a user to a set of tips
+
+    :param session: An ORM session
+    :param tid: The tenant ID
+    :param user_id: The user ID
+    :param itip_ids: The list of IDs of the tips accessed
+    """
+    now = datetime_now()
+    accessed = False
+
+    for itip, rtip in session.query(models.InternalTip, models.ReceiverTip) \
+                             .filter(models.ReceiverTip.receiver_id == user_id,
+                                     models.InternalTip.id == models.ReceiverTip.internaltip_id,
+                                     models.InternalTip.id.in_(itip_ids),
+                                     models.InternalTip.tid == tid):
+        accessed = True
 
-    if not user:
+        rtip.last_access = now
+        if rtip.access_date == datetime_null():
+            rtip.access_date = now
+
+        if itip.status == 'new':
+            db_update_submission_status(session, tid, user_id, itip, 'opened', None)
+
+    if not accessed:
         raise errors.ResourceNotFound
 
-    rtip.last_access = datetime_now()
-    if rtip.access_date == datetime_null():
-        rtip.access_date = rtip.last_access
 
-    if itip.status == 'new':
-        db_update_submission_status(session, tid, user_id, itip, 'opened', None)
+def db_get_tips_export(session, tid, user_id, itip_ids, language):
+    """
+    Transaction for serializing the exports of a set of tips of a user
+
+    :param session: An ORM session
+    :param tid: The tenant ID
+    :param user_id: The user ID
+    :param itip_ids: The list of IDs of the tips to be exported
+    :param language: The language to be used during data serialization
+    :return: The PGP key of the user and the list of the exports of the tips
+    """
+    shared_data = None
+    tip_exports = []
+    pgp_key = ''
+
+    for user, context, itip, rtip in session.query(models.User, models.Context, models.InternalTip, models.ReceiverTip) \
+                                            .filter(models.User.id == user_id,
+                                                    models.User.tid == tid,
+                                                    models.ReceiverTip.receiver_id == models.User.id,
+                                                    models.InternalTip.id == models.ReceiverTip.internaltip_id,
+                                                    models.InternalTip.id.in_(itip_ids),
+                                                    models.Context.id == models.InternalTip.context_id) \
+                                            .order_by(models.InternalTip.progressive):
+        if shared_data is None:
+            pgp_key = user.pgp_key_public
+            shared_data = db_serialize_export_shared_data(session, user, language)
+
+        tip_exports.append(serialize_rtip_export(session, user, itip, rtip, context, language, shared_data))
+
+    if not tip_exports:
+        raise errors.ResourceNotFound
+
+    return pgp_key, tip_exports
+
+
+@inlineCallbacks
+def get_tips_export(tid, user_id, itip_ids, language):
+    """
+    Register the access to a set of tips and serialize their exports
+
+    The access is registered by a short write transaction while the
+    serialization is performed by a read-only transaction.
+    """
+    yield tw(db_access_tips, tid, user_id, itip_ids)
+
+    ret = yield tr(db_get_tips_export, tid, user_id, itip_ids, language)
+
+    returnValue(ret)
+
 
-    return user.pgp_key_public, serialize_rtip_export(session, user, itip, rtip, context, language)
+@inlineCallbacks
+def get_tip_export(tid, user_id, itip_id, language):
+    pgp_key, tip_exports = yield get_tips_export(tid, user_id, [itip_id], language)
+
+    returnValue((pgp_key, tip_exports[0]))
 
 
 @inlineCallbacks
-def prepare_tip_export(cc, tip_export):
+def prepare_tip_export(user_session, tip_export):
     files = tip_export['tip']['wbfiles'] + tip_export['tip']['rfiles']
 
     if tip_export['crypto_tip_prv_key']:
-        tip_export['tip'] = yield deferToThread(decrypt_tip, cc, tip_export['crypto_tip_prv_key'], tip_export['tip'])
+        tip_export['tip'] = yield open_tip(user_session, tip_export['crypto_tip_prv_key'], tip_export['tip'])
+
+        tip_prv_key = user_session.get_tip_key(tip_export['tip']['id'], tip_export['crypto_tip_prv_key'])
 
         for file_dict in tip_export['tip']['wbfiles']:
             if file_dict.get('status', '') == 'encrypted':
                 continue
 
             if tip_export['deprecated_crypto_files_prv_key']:
-                files_prv_key = GCE.asymmetric_decrypt(cc, tip_export['deprecated_crypto_files_prv_key'])
+                files_prv_key = GCE.asymmetric_decrypt(user_session.cc, tip_export['deprecated_crypto_files_prv_key'])
             else:
-                files_prv_key = GCE.asymmetric_decrypt(cc, tip_export['crypto_tip_prv_key'])
+                files_prv_key = tip_prv_key
 
             filelocation = os.path.join(Settings.attachments_path, file_dict['id'])
             if not os.path.exists(filelocation):
@@ -95,7 +183,6 @@ def prepare_tip_export(cc, tip_export):
             if file_dict.get('status', '') == 'encrypted':
                 continue
 
-            tip_prv_key = GCE.asymmetric_decrypt(cc, tip_export['crypto_tip_prv_key'])
             filelocation = os.path.join(Settings.attachments_path, file_dict['name'])
             directory_traversal_check(Settings.attachments_path, filelocation)
             file_dict['key'] = tip_prv_key
@@ -120,6 +207,20 @@ def prepare_tip_export(cc, tip_export):
     return files
 
 
+@inlineCallbacks
+def prepare_tips_export(user_session, tip_exports):
+    files = []
+
+    for tip_export in tip_exports:
+        path = "report-" + str(tip_export["tip"]["progressive"]) + "/"
+
+        for file_dict in (yield prepare_tip_export(user_session, tip_export)):
+            file_dict['name'] = path + file_dict['name']
+            files.append(file_dict)
+
+    return files
+
+
 class ExportHandler(BaseHandler):
     check_roles = 'receiver'
     handler_exec_time_threshold = 3600
@@ -133,16 +234,39 @@ class ExportHandler(BaseHandler):
 
         filename = "report-" + str(tip_export["tip"]["progressive"]) + ".zip"
 
-        files = yield prepare_tip_export(self.session.cc, tip_export)
+        files = yield prepare_tip_export(self.session, tip_export)
+
+        zipstream = ZipStream(files, compression_level=self.state.settings.export_compression_level)
+
+        yield self.write_file_as_download(filename, zipstream, pgp_key)
+
+
+class BulkExportHandler(BaseHandler):
+    """
+    Handler enabling to export a set of submissions in a single archive
+    """
+    check_roles = 'receiver'
+    handler_exec_time_threshold = 3600
+
+    # Maximum number of tips exported by a single request
+    max_tips = 100
+
+    @inlineCallbacks
+    def post(self):
+        request = self.validate_request(self.request.content.read(), requests.TipsExportDesc)
+
+        if len(request['rtips']) > self.max_tips:
+            raise errors.InputValidationError("The export is limited to %d reports" % self.max_tips)
 
-        zipstream = ZipStream(files)
+        pgp_key, tip_exports = yield get_tips_export(self.request.tid,
+                                                     self.session.user_id,
+                                                     request['rtips'],
+                                                     self.request.language)
 
-        stf = SecureTemporaryFile(self.state.settings.tmp_path)
+        files = yield prepare_tips_export(self.session, tip_exports)
 
-        with stf.open('w') as f:
-            for x in zipstream:
-                f.write(x)
-            f.finalize_write()
+        zipstream = ZipStream(files,
+                              self.state.settings.export_decryption_threads,
+                              self.state.settings.export_compression_level)
 
-        with stf.open('r') as f:
-            yield self.write_file_as_download(filename, f, pgp_key)
+        yield self.write_file_as_download("reports.zip", zipstream, pgp_key)
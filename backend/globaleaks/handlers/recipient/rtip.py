@@ -2,6 +2,7 @@
 #
 # Handlers dealing with tip interface for receivers (rtip)
 import base64
+import glob
 import os
 import time
 
@@ -16,16 +17,17 @@ from globaleaks.handlers.admin.node import db_admin_serialize_node
 from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.handlers.operation import OperationHandler
-from globaleaks.handlers.whistleblower.submission import db_create_receivertip, decrypt_tip
+from globaleaks.handlers.whistleblower.submission import db_create_receivertip, open_tip
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.models import serializers, Context
 from globaleaks.orm import db_get, db_del, db_log, transact, tw
 from globaleaks.rest import errors, requests
+from globaleaks.sessions import Sessions
 from globaleaks.state import State
 from globaleaks.utils.crypto import GCE
 from globaleaks.utils.fs import directory_traversal_check
 from globaleaks.utils.log import log
-from globaleaks.utils.templating import Templating
+from globaleaks.utils.pgp import get_pgp_copy_name
 from globaleaks.utils.utility import get_expiration, datetime_now, datetime_null, datetime_never
 
 
@@ -47,14 +49,7 @@ def db_tip_grant_notification(session, user):
     else:
         data['notification'] = db_get_notification(session, 1, user.language)
 
-    subject, body = Templating().get_mail_subject_and_body(data)
-
-    session.add(models.Mail({
-        'address': data['user']['mail_address'],
-        'subject': subject,
-        'body': body,
-        'tid': user.tid
-    }))
+    State.format_and_send_mail(session, user.tid, data['user']['mail_address'], data)
 
 
 def db_grant_tip_access(session, tid, user_id, user_cc, itip, rtip, receiver_id):
@@ -126,6 +121,8 @@ def db_revoke_tip_access(session, tid, user_id, itip, receiver_id):
 
     session.delete(rtip)
 
+    Sessions.revoke_tip_key(receiver_id, itip.id)
+
     return True
 
 
@@ -257,12 +254,14 @@ def db_access_rfile(session, tid, user_id, rfile_id):
 
 
 @transact
-def register_rfile_on_db(session, tid, user_id, itip_id, uploaded_file):
+def register_rfile_on_db(session, tid, user_id, user_cc, itip_id, uploaded_file):
     """
     Register a file on the database
 
     :param session: An ORM session
     :param tid: A tenant id
+    :param user_id: The user ID of the user uploading the file
+    :param user_cc: The private key of the user uploading the file
     :param itip_id: A id of the rtip on which attaching the file
     :param uploaded_file: A file to be attached
     :return: A descriptor of the file
@@ -277,10 +276,11 @@ def register_rfile_on_db(session, tid, user_id, itip_id, uploaded_file):
     itip.update_date = rtip.last_access = datetime_now()
 
     if itip.crypto_tip_pub_key:
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(rtip.crypto_tip_prv_key))
         for k in ['name', 'description', 'type', 'size']:
             if k == 'size':
                 uploaded_file[k] = str(uploaded_file[k])
-            uploaded_file[k] = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, uploaded_file[k]))
+            uploaded_file[k] = GCE.tip_content_encrypt(crypto_tip_prv_key, uploaded_file[k])
 
     new_file = models.ReceiverFile()
     new_file.id = uploaded_file['filename']
@@ -346,6 +346,8 @@ def db_delete_itip(session, itip_id):
     """
     db_del(session, models.InternalTip, models.InternalTip.id == itip_id)
 
+    Sessions.revoke_tip_keys([itip_id])
+
 
 def db_postpone_expiration(session, itip, expiration_date):
     """
@@ -441,21 +443,23 @@ def set_reminder(session, tid, user_id, itip_id, reminder_date):
 
 
 @transact
-def set_internaltip_variable(session, tid, user_id, itip_id, key, value):
+def set_internaltip_variable(session, tid, user_id, user_cc, itip_id, key, value):
     """
     Transaction for setting properties of a submission
 
     :param session: An ORM session
     :param tid: A tenant ID of the user performing the operation
     :param user_id: A user ID of the user performing the operation
+    :param user_cc: A private key of the user performing the operation
     :param itip_id: An itip ID of the submission object of the operation
     :param key: A key of the property to be set
     :param value: A value to be assigned to the property
     """
-    _, _, itip = db_access_rtip(session, tid, user_id, itip_id)
+    _, rtip, itip = db_access_rtip(session, tid, user_id, itip_id)
 
     if itip.crypto_tip_pub_key and value and key in ['label']:
-        value = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, value))
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(rtip.crypto_tip_prv_key))
+        value = GCE.tip_content_encrypt(crypto_tip_prv_key, value)
 
     setattr(itip, key, value)
 
@@ -504,14 +508,7 @@ def db_create_identityaccessrequest_notifications(session, itip, rtip, iar):
         else:
             data['notification'] = db_get_notification(session, 1, user.language)
 
-        subject, body = Templating().get_mail_subject_and_body(data)
-
-        session.add(models.Mail({
-            'address': data['user']['mail_address'],
-            'subject': subject,
-            'body': body,
-            'tid': itip.tid
-        }))
+        State.format_and_send_mail(session, itip.tid, data['user']['mail_address'], data)
 
 
 @transact
@@ -531,7 +528,7 @@ def create_identityaccessrequest(session, tid, user_id, user_cc, itip_id, reques
     iar = models.IdentityAccessRequest()
     iar.internaltip_id = itip.id
     iar.request_user_id = user.id
-    iar.request_motivation = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, request['request_motivation']))
+    iar.request_motivation = GCE.tip_content_encrypt(crypto_tip_prv_key, request['request_motivation'])
     session.add(iar)
     session.flush()
 
@@ -555,12 +552,13 @@ def create_identityaccessrequest(session, tid, user_id, user_cc, itip_id, reques
 
 
 @transact
-def create_comment(session, tid, user_id, itip_id, content, visibility=0):
+def create_comment(session, tid, user_id, user_cc, itip_id, content, visibility=0):
     """
     Transaction for registering a new comment
     :param session: An ORM session
     :param tid: A tenant ID
     :param user_id: The user id of the user creating the comment
+    :param user_cc: The private key of the user creating the comment
     :param itip_id: The rtip associated to the comment to be created
     :param content: The content of the comment
     :param visibility: The visibility type of the comment
@@ -572,7 +570,8 @@ def create_comment(session, tid, user_id, itip_id, content, visibility=0):
 
     _content = content
     if itip.crypto_tip_pub_key:
-        _content = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, content)).decode()
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(rtip.crypto_tip_prv_key))
+        _content = GCE.tip_content_encrypt(crypto_tip_prv_key, content)
 
     comment = models.Comment()
     comment.internaltip_id = itip.id
@@ -613,7 +612,7 @@ class RTipInstance(OperationHandler):
         tip, crypto_tip_prv_key = yield get_rtip(self.request.tid, self.session.user_id, tip_id, self.request.language)
 
         if State.tenants[self.request.tid].cache.encryption and crypto_tip_prv_key:
-            tip = yield deferToThread(decrypt_tip, self.session.cc, crypto_tip_prv_key, tip)
+            tip = yield open_tip(self.session, crypto_tip_prv_key, tip)
 
         returnValue(tip)
 
@@ -636,7 +635,7 @@ class RTipInstance(OperationHandler):
         if key == 'enable_notifications':
             return set_receivertip_variable(self.request.tid, self.session.user_id, itip_id, key, value)
 
-        return set_internaltip_variable(self.request.tid, self.session.user_id, itip_id, key, value)
+        return set_internaltip_variable(self.request.tid, self.session.user_id, self.session.cc, itip_id, key, value)
 
     def grant_tip_access(self, req_args, itip_id, *args, **kwargs):
         return grant_tip_access(self.request.tid, self.session.user_id, self.session.cc, itip_id, req_args['receiver'])
@@ -672,7 +671,7 @@ class RTipCommentCollection(BaseHandler):
 
     def post(self, itip_id):
         request = self.validate_request(self.request.content.read(), requests.CommentDesc)
-        return create_comment(self.request.tid, self.session.user_id, itip_id, request['content'], request['visibility'])
+        return create_comment(self.request.tid, self.session.user_id, self.session.cc, itip_id, request['content'], request['visibility'])
 
 
 class WhistleblowerFileDownload(BaseHandler):
@@ -684,16 +683,16 @@ class WhistleblowerFileDownload(BaseHandler):
 
     @transact
     def download_wbfile(self, session, tid, user_id, file_id):
-        ifile, wbfile, rtip, pgp_key = db_get(session,
-                                             (models.InternalFile,
-                                              models.WhistleblowerFile,
-                                              models.ReceiverTip,
-                                              models.User.pgp_key_public),
-                                             (models.ReceiverTip.receiver_id == models.User.id,
-                                              models.ReceiverTip.id == models.WhistleblowerFile.receivertip_id,
-                                              models.InternalFile.id == models.WhistleblowerFile.internalfile_id,
-                                              models.WhistleblowerFile.id == file_id,
-                                              models.User.id == user_id))
+        ifile, wbfile, rtip, user = db_get(session,
+                                          (models.InternalFile,
+                                           models.WhistleblowerFile,
+                                           models.ReceiverTip,
+                                           models.User),
+                                          (models.ReceiverTip.receiver_id == models.User.id,
+                                           models.ReceiverTip.id == models.WhistleblowerFile.receivertip_id,
+                                           models.InternalFile.id == models.WhistleblowerFile.internalfile_id,
+                                           models.WhistleblowerFile.id == file_id,
+                                           models.User.id == user_id))
 
         if wbfile.access_date == datetime_null():
             wbfile.access_date = datetime_now()
@@ -701,33 +700,49 @@ class WhistleblowerFileDownload(BaseHandler):
         log.debug("Download of file %s by receiver %s" %
                   (wbfile.internalfile_id, rtip.receiver_id))
 
-        return ifile.name, ifile.id, wbfile.id, rtip.crypto_tip_prv_key, rtip.deprecated_crypto_files_prv_key, pgp_key
+        return ifile.name, ifile.id, wbfile.id, rtip.internaltip_id, rtip.crypto_tip_prv_key, rtip.deprecated_crypto_files_prv_key, user.pgp_key_public, user.pgp_key_fingerprint
 
     @inlineCallbacks
     def get(self, wbfile_id):
-        name, ifile_id, wbfile_id, tip_prv_key, tip_prv_key2, pgp_key = yield self.download_wbfile(self.request.tid, self.session.user_id, wbfile_id)
+        name, ifile_id, wbfile_id, itip_id, tip_prv_key, tip_prv_key2, pgp_key, pgp_key_fingerprint = yield self.download_wbfile(self.request.tid, self.session.user_id, wbfile_id)
 
         filelocation = os.path.join(self.state.settings.attachments_path, wbfile_id)
         if not os.path.exists(filelocation):
             filelocation = os.path.join(self.state.settings.attachments_path, ifile_id)
 
+        pgp_copy = None
+        if pgp_key and not tip_prv_key:
+            pgp_copy = os.path.join(self.state.settings.attachments_path, get_pgp_copy_name(wbfile_id, pgp_key_fingerprint))
+            if not os.path.exists(pgp_copy) and not os.path.exists(filelocation):
+                # The PGP key of the user changed after the delivery and no plaintext
+                # copy is available to encrypt the file with the new key; the copy
+                # encrypted with the key in use at the time of the delivery is served
+                pgp_copy = next(iter(glob.glob(os.path.join(self.state.settings.attachments_path,
+                                                            get_pgp_copy_name(wbfile_id, '*')))), None)
+
+        if pgp_copy and os.path.exists(pgp_copy):
+            # The copy of the file has been encrypted with the PGP key of the user on delivery
+            filelocation = pgp_copy
+            name += '.pgp'
+            pgp_key = ''
+
         directory_traversal_check(self.state.settings.attachments_path, filelocation)
         self.check_file_presence(filelocation)
 
         if tip_prv_key:
-            tip_prv_key = GCE.asymmetric_decrypt(self.session.cc, base64.b64decode(tip_prv_key))
-            name = GCE.asymmetric_decrypt(tip_prv_key, base64.b64decode(name.encode())).decode()
+            tip_prv_key = self.session.get_tip_key(itip_id, base64.b64decode(tip_prv_key))
+            name = GCE.tip_content_decrypt(tip_prv_key, name).decode()
 
             try:
                 # First attempt
-                filelocation = GCE.streaming_encryption_open('DECRYPT', tip_prv_key, filelocation)
+                filelocation = yield deferToThread(GCE.streaming_encryption_open, 'DECRYPT', tip_prv_key, filelocation)
             except:
                 # Second attempt
                 if not tip_prv_key2:
                     raise
 
                 files_prv_key2 = GCE.asymmetric_decrypt(self.session.cc, base64.b64decode(tip_prv_key2))
-                filelocation = GCE.streaming_encryption_open('DECRYPT', files_prv_key2, filelocation)
+                filelocation = yield deferToThread(GCE.streaming_encryption_open, 'DECRYPT', files_prv_key2, filelocation)
 
         yield self.write_file_as_download(name, filelocation, pgp_key)
 
@@ -740,7 +755,7 @@ class ReceiverFileUpload(BaseHandler):
     upload_handler = True
 
     def post(self, itip_id):
-        return register_rfile_on_db(self.request.tid, self.session.user_id, itip_id, self.uploaded_file)
+        return register_rfile_on_db(self.request.tid, self.session.user_id, self.session.cc, itip_id, self.uploaded_file)
 
 
 class ReceiverFileDownload(BaseHandler):
@@ -765,11 +780,11 @@ class ReceiverFileDownload(BaseHandler):
         except:
             raise errors.ResourceNotFound
         else:
-            return rfile.name, rfile.id, base64.b64decode(rtip.crypto_tip_prv_key), pgp_key
+            return rfile.name, rfile.id, rtip.internaltip_id, base64.b64decode(rtip.crypto_tip_prv_key), pgp_key
 
     @inlineCallbacks
     def get(self, rfile_id):
-        name, filename, tip_prv_key, pgp_key = yield self.download_rfile(self.request.tid, self.session.user_id, rfile_id)
+        name, filename, itip_id, tip_prv_key, pgp_key = yield self.download_rfile(self.request.tid, self.session.user_id, rfile_id)
 
         filelocation = os.path.join(self.state.settings.attachments_path, filename)
         if not os.path.exists(filelocation):
@@ -780,9 +795,9 @@ class ReceiverFileDownload(BaseHandler):
         self.check_file_presence(filelocation)
 
         if tip_prv_key:
-            tip_prv_key = GCE.asymmetric_decrypt(self.session.cc, tip_prv_key)
-            name = GCE.asymmetric_decrypt(tip_prv_key, base64.b64decode(name.encode())).decode()
-            filelocation = GCE.streaming_encryption_open('DECRYPT', tip_prv_key, filelocation)
+            tip_prv_key = self.session.get_tip_key(itip_id, tip_prv_key)
+            name = GCE.tip_content_decrypt(tip_prv_key, name).decode()
+            filelocation = yield deferToThread(GCE.streaming_encryption_open, 'DECRYPT', tip_prv_key, filelocation)
 
         yield self.write_file_as_download(name, filelocation, pgp_key)
 
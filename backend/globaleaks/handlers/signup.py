@@ -2,6 +2,7 @@
 #
 # Handlers implementing platform signup
 from sqlalchemy import not_
+from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.threads import deferToThread
 from globaleaks import models
 from globaleaks.db import sync_refresh_tenant_cache
@@ -10,10 +11,10 @@ from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.admin.tenant import db_create as db_create_tenant
 from globaleaks.handlers.admin.user import db_get_users
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.handlers.wizard import db_wizard
+from globaleaks.handlers.wizard import db_wizard, generate_wizard_credentials
 from globaleaks.models import serializers
 from globaleaks.models.config import ConfigFactory
-from globaleaks.orm import db_del, transact
+from globaleaks.orm import db_del, transact, transact_ro, tw
 from globaleaks.rest import requests, errors
 from globaleaks.state import State
 from globaleaks.utils.crypto import generateRandomKey, generateRandomPassword
@@ -91,8 +92,23 @@ def signup(session, request, language):
         State.format_and_send_mail(session, 1, user_desc['mail_address'], template_vars)
 
 
-@transact
-def signup_activation(session, token, hostname, language):
+@transact_ro
+def check_activation_token(session, token):
+    """
+    Transaction checking the existence of a signup activation token
+
+    :param session: An ORM session
+    :param token: A activation token
+    :return: A boolean signaling the existence of the token
+    """
+    if not ConfigFactory(session, 1).get_val('enable_signup'):
+        raise errors.ForbiddenOperation
+
+    return session.query(models.Subscriber.tid) \
+                  .filter(models.Subscriber.activation_token == token).one_or_none() is not None
+
+
+def db_signup_activation(session, token, hostname, language, passwords, credentials):
     """
     Transaction registering the activation of a platform registered via signup
 
@@ -100,6 +116,8 @@ def signup_activation(session, token, hostname, language):
     :param token: A activation token
     :param hostname: The choosen hostname
     :param language: A language of the request
+    :param passwords: The passwords of the accounts to be created
+    :param credentials: The credentials of the accounts to be created
     """
     config = ConfigFactory(session, 1)
 
@@ -119,9 +137,6 @@ def signup_activation(session, token, hostname, language):
 
     signup.activation_token = None
 
-    password_admin = generateRandomPassword(16)
-    password_receiver = generateRandomPassword(16)
-
     node_name = signup.organization_name if signup.organization_name else signup.subdomain
 
     wizard = {
@@ -129,12 +144,12 @@ def signup_activation(session, token, hostname, language):
         'node_name': node_name,
         'admin_username': 'admin',
         'admin_name': signup.name + ' ' + signup.surname,
-        'admin_password': password_admin,
+        'admin_password': passwords['admin_password'],
         'admin_mail_address': signup.email,
         'admin_escrow': config.get_val('escrow'),
         'receiver_username': 'recipient',
         'receiver_name': signup.name + ' ' + signup.surname,
-        'receiver_password': password_receiver,
+        'receiver_password': passwords['receiver_password'],
         'receiver_mail_address': signup.email,
         'profile': 'default',
         'skip_admin_account_creation': False,
@@ -142,7 +157,7 @@ def signup_activation(session, token, hostname, language):
         'enable_developers_exception_notification': True
     }
 
-    db_wizard(session, signup.tid, hostname, wizard)
+    db_wizard(session, signup.tid, hostname, wizard, credentials)
 
     template_vars = {
         'type': 'activation',
@@ -155,7 +170,38 @@ def signup_activation(session, token, hostname, language):
 
     State.format_and_send_mail(session, 1, signup.email, template_vars)
 
-    deferToThread(sync_refresh_tenant_cache, tenant)
+    deferToThread(sync_refresh_tenant_cache, tenant.id)
+
+
+@inlineCallbacks
+def signup_activation(token, hostname, language):
+    """
+    Procedure registering the activation of a platform registered via signup
+
+    The Argon2 computations of the passwords of the accounts created
+    are performed out of the transaction.
+
+    :param token: A activation token
+    :param hostname: The choosen hostname
+    :param language: A language of the request
+    """
+    # Avoid the computation of the credentials for invalid tokens
+    valid = yield check_activation_token(token)
+    if not valid:
+        returnValue({})
+
+    passwords = {
+        'admin_password': generateRandomPassword(16),
+        'receiver_password': generateRandomPassword(16),
+        'skip_admin_account_creation': False,
+        'skip_recipient_account_creation': False
+    }
+
+    credentials = yield deferToThread(generate_wizard_credentials, passwords)
+
+    ret = yield tw(db_signup_activation, token, hostname, language, passwords, credentials)
+
+    returnValue(ret)
 
 
 class Signup(BaseHandler):
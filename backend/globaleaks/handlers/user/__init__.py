@@ -1,39 +1,51 @@
 # -*- coding: utf-8
 #
 # Handlers dealing with user preferences
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
+
 from globaleaks import models
 from globaleaks.handlers.base import BaseHandler
 from globaleaks.models import get_localized_values
-from globaleaks.orm import db_get, db_log, transact
+from globaleaks.orm import db_get, db_log, transact, transact_ro, tw
 from globaleaks.rest import errors, requests
 from globaleaks.state import State
 from globaleaks.transactions import db_get_user
 from globaleaks.utils.crypto import generateRandomKey
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.pgp import get_pgp_context
 from globaleaks.utils.utility import datetime_now, datetime_null
 
 import globaleaks.handlers.user.validate_email
 
 
-def parse_pgp_options(user, request):
+def load_pgp_key(request):
+    """
+    Load the PGP key of a request; the function is intended to be
+    executed out of any transaction as it may run gpg.
+
+    :param request: A request to be parsed
+    :return: The context of the PGP key or None if no key is set
+    """
+    if not request['pgp_key_remove'] and request['pgp_key_public']:
+        return get_pgp_context(request['pgp_key_public'])
+
+
+def parse_pgp_options(user, request, pgpctx=None):
     """
     Used for parsing PGP key infos and fill related user configurations.
 
     :param user: A user model
     :param request: A request to be parsed
+    :param pgpctx: The context of the PGP key of the request as returned by load_pgp_key
     """
-    pgp_key_public = request['pgp_key_public']
-    remove_key = request['pgp_key_remove']
-
-    if not remove_key and pgp_key_public:
-        pgpctx = PGPContext(pgp_key_public)
-        user.pgp_key_public = pgp_key_public
-        user.pgp_key_fingerprint = pgpctx.fingerprint
-        user.pgp_key_expiration = pgpctx.expiration
-    else:
+    if request['pgp_key_remove'] or not request['pgp_key_public']:
         user.pgp_key_public = ''
         user.pgp_key_fingerprint = ''
         user.pgp_key_expiration = datetime_null()
+    elif pgpctx is not None:
+        user.pgp_key_public = request['pgp_key_public']
+        user.pgp_key_fingerprint = pgpctx.fingerprint
+        user.pgp_key_expiration = pgpctx.expiration
 
 
 def user_serialize_user(session, user, language):
@@ -95,7 +107,7 @@ def user_serialize_user(session, user, language):
     return get_localized_values(ret, user, user.localized_keys, language)
 
 
-@transact
+@transact_ro
 def get_user(session, tid, user_id, language):
     """
     Transaction for retrieving a user model given an id
@@ -111,7 +123,7 @@ def get_user(session, tid, user_id, language):
     return user_serialize_user(session, user, language)
 
 
-def db_user_update_user(session, tid, user_session, request):
+def db_user_update_user(session, tid, user_session, request, pgpctx=None):
     """
     Transaction for updating an existing user
 
@@ -119,6 +131,7 @@ def db_user_update_user(session, tid, user_session, request):
     :param tid: A tenant ID
     :param user_session: A session of the user invoking the transaction
     :param request: A user request data
+    :param pgpctx: The context of the PGP key of the request
     :return: A user model
     """
     from globaleaks.handlers.admin.notification import db_get_notification
@@ -154,26 +167,35 @@ def db_user_update_user(session, tid, user_session, request):
 
         State.format_and_send_mail(session, tid, user_desc['mail_address'], template_vars)
 
-    parse_pgp_options(user, request)
+    parse_pgp_options(user, request, pgpctx)
 
     return user
 
 
-@transact
-def update_user_settings(session, tid, user_session, request, language):
+def db_update_user_settings(session, tid, user_session, request, language, pgpctx):
+    user = db_user_update_user(session, tid, user_session, request, pgpctx)
+
+    return user_serialize_user(session, user, language)
+
+
+@inlineCallbacks
+def update_user_settings(tid, user_session, request, language):
     """
-    Transaction for updating an existing user
+    Procedure for updating an existing user
+
+    The PGP key of the request is loaded out of the transaction.
 
-    :param session: An ORM session
     :param tid: A tenant ID
     :param user_session: A session of the user invoking the transaction
     :param request: A user request data
     :param language: A language to be used when serializing the user
     :return: A serialization of user model
     """
-    user = db_user_update_user(session, tid, user_session, request)
+    pgpctx = yield deferToThread(load_pgp_key, request)
 
-    return user_serialize_user(session, user, language)
+    user = yield tw(db_update_user_settings, tid, user_session, request, language, pgpctx)
+
+    returnValue(user)
 
 
 class UserInstance(BaseHandler):
@@ -3,10 +3,12 @@
 # Handlers dealing with user operations
 import os
 from nacl.encoding import Base32Encoder, Base64Encoder
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread
 
 from globaleaks import models
 from globaleaks.handlers.operation import OperationHandler
-from globaleaks.orm import db_log, transact
+from globaleaks.orm import db_log, transact, transact_ro, tw
 from globaleaks.rest import errors
 from globaleaks.state import State
 from globaleaks.transactions import db_get_user
@@ -23,37 +25,94 @@ def check_password_strength(password):
            any(not char.isalnum() for char in password)
 
 
-@transact
-def change_password(session, tid, user_session, password, old_password):
-    user = db_get_user(session, tid, user_session.user_id)
+def generate_password_credentials(password, salt=None):
+    """
+    Compute the hash and the key of a password
 
-    if not user.password_change_needed:
-        if not GCE.check_password(old_password,
-                                  user.salt,
-                                  user.hash):
-           raise errors.InvalidOldPassword
+    The function performs the memory hard password hashing and
+    it is intended to be executed out of any transaction.
 
-    config = models.config.ConfigFactory(session, tid)
+    :param password: A password
+    :param salt: The salt to be used or None to generate a new one
+    :return: A tuple containing the salt, the hash and the key
+    """
+    if salt is None:
+        salt = GCE.generate_salt()
 
-    # Regenerate the password hash only if different from the best choice on the platform
-    if len(user.hash) != 44:
-        user.salt = GCE.generate_salt()
+    hash, key = GCE.calculate_hash_and_key(password, salt)
+
+    return salt, hash, key
+
+
+@transact_ro
+def get_user_credentials(session, tid, user_id):
+    """
+    Transaction for fetching the credentials of a user
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param user_id: A user ID
+    :return: A tuple containing the salt, the hash and the password change status
+    """
+    user = db_get_user(session, tid, user_id)
+
+    return user.salt, user.hash, user.password_change_needed
+
+
+def check_password_change(password, old_password, salt, hash, password_change_needed):
+    """
+    Verify a password change and compute the credentials of the new password
+
+    :param password: The new password
+    :param old_password: The current password
+    :param salt: The salt of the current password
+    :param hash: The hash of the current password
+    :param password_change_needed: The password change status of the user
+    :return: A tuple containing the salt, the hash and the key of the new password
+    """
+    if not password_change_needed:
+        if not GCE.check_password(old_password, salt, hash):
+            raise errors.InvalidOldPassword
 
     if not check_password_strength(password):
         raise errors.InputValidationError("The password is too weak")
 
+    # Regenerate the password hash only if different from the best choice on the platform
+    credentials = generate_password_credentials(password, salt if len(hash) == 44 else None)
+
     # Check that the new password is different form the current password
-    password_hash = GCE.hash_password(password, user.salt)
-    if user.hash == password_hash:
+    if hash == credentials[1] or \
+       (GCE.is_legacy_hash(hash) and GCE.check_password(password, salt, hash)):
         raise errors.PasswordReuseError
 
-    user.hash = password_hash
+    return credentials
+
+
+def db_change_password(session, tid, user_session, hash, credentials):
+    """
+    Transaction for persisting a password change
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param user_session: The session of the user
+    :param hash: The password hash against which the change has been verified
+    :param credentials: The salt, the hash and the key of the new password
+    """
+    user = db_get_user(session, tid, user_session.user_id)
+
+    # The check on the hash prevents the change in case of another
+    # password change happened after the verification of the password
+    if user.hash != hash:
+        raise errors.InvalidOldPassword
+
+    user.salt, user.hash, enc_key = credentials
     user.password_change_date = datetime_now()
     user.password_change_needed = False
 
+    config = models.config.ConfigFactory(session, tid)
+
     cc = ''
     if config.get_val('encryption'):
-        enc_key = GCE.derive_key(password.encode(), user.salt)
         cc = user_session.cc
         if not cc:
             # The first password change triggers the generation
@@ -83,7 +142,29 @@ def change_password(session, tid, user_session, password, old_password):
     user_session.cc = cc
 
 
-@transact
+@inlineCallbacks
+def change_password(tid, user_session, password, old_password):
+    """
+    Password change procedure
+
+    The Argon2 computations are performed out of the transactions
+    in order to not stall the writer thread.
+
+    :param tid: A tenant ID
+    :param user_session: The session of the user
+    :param password: The new password
+    :param old_password: The current password
+    """
+    salt, hash, password_change_needed = yield get_user_credentials(tid, user_session.user_id)
+
+    credentials = yield deferToThread(check_password_change,
+                                      password, old_password,
+                                      salt, hash, password_change_needed)
+
+    yield tw(db_change_password, tid, user_session, hash, credentials)
+
+
+@transact_ro
 def get_users_names(session, tid, user_id):
     ret = {}
 
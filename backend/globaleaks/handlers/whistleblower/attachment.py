@@ -12,13 +12,14 @@ from globaleaks.utils.utility import datetime_now
 
 
 @transact
-def register_ifile_on_db(session, tid, internaltip_id, uploaded_file):
+def register_ifile_on_db(session, tid, internaltip_id, user_cc, uploaded_file):
     """
     Register a file on the database
 
     :param session: An ORM session
     :param tid: A tenant id
     :param internaltip_id: A id of the submission on which attaching the file
+    :param user_cc: The private key of the whistleblower
     :param uploaded_file: A file to be attached
     :return: A descriptor of the file
     """
@@ -34,8 +35,9 @@ def register_ifile_on_db(session, tid, internaltip_id, uploaded_file):
     itip.last_access = now
 
     if itip.crypto_tip_pub_key:
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(itip.crypto_tip_prv_key))
         for k in ['name', 'type', 'size']:
-            uploaded_file[k] = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, str(uploaded_file[k])))
+            uploaded_file[k] = GCE.tip_content_encrypt(crypto_tip_prv_key, str(uploaded_file[k]))
 
     new_file = models.InternalFile()
     new_file.id = uploaded_file['filename']
@@ -75,4 +77,4 @@ class PostSubmissionAttachment(SubmissionAttachment):
     def post(self):
         self.uploaded_file['submission'] = False
 
-        return register_ifile_on_db(self.request.tid, self.session.user_id, self.uploaded_file)
+        return register_ifile_on_db(self.request.tid, self.session.user_id, self.session.cc, self.uploaded_file)
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 #
 # Handlerse dealing with submission interface
-import base64
 import json
 
+from nacl.exceptions import CryptoError
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
+
 from globaleaks import models
 from globaleaks.handlers.admin.questionnaire import db_get_questionnaire
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.orm import db_get, db_log, transact
+from globaleaks.orm import db_get, db_log, tw
 from globaleaks.rest import errors, requests
 from globaleaks.state import State
 from globaleaks.utils.crypto import sha256, Base64Encoder, GCE
@@ -15,18 +18,66 @@ from globaleaks.utils.json import JSONEncoder
 from globaleaks.utils.utility import get_expiration, datetime_null
 
 
-def decrypt_tip(user_key, tip_prv_key, tip):
-    tip_key = GCE.asymmetric_decrypt(user_key, tip_prv_key)
+def upgrade_tip_content(obj, attr, tip_key):
+    value = getattr(obj, attr)
+
+    if isinstance(value, bytes):
+        value = value.decode()
+
+    if not value or not isinstance(value, str) or not GCE.is_legacy_tip_content(value):
+        return
+
+    try:
+        value = GCE.tip_content_decrypt(tip_key, value)
+    except (CryptoError, ValueError):
+        # Contents that could not be decrypted are left untouched
+        return
+
+    setattr(obj, attr, GCE.tip_content_encrypt(tip_key, value))
+
+
+def db_upgrade_tip_encryption(session, itip_id, tip_key):
+    """
+    Transaction for re-encrypting with the symmetric format the contents
+    of a tip encrypted with the legacy format
+
+    :param session: An ORM session
+    :param itip_id: The ID of the tip to be re-encrypted
+    :param tip_key: The decrypted key of the tip
+    """
+    for model, attrs in [(models.InternalTipAnswers, ['answers']),
+                         (models.InternalTipData, ['value']),
+                         (models.Comment, ['content']),
+                         (models.IdentityAccessRequest, ['request_motivation', 'reply_motivation']),
+                         (models.InternalFile, ['name', 'content_type', 'size']),
+                         (models.ReceiverFile, ['name', 'description', 'content_type', 'size'])]:
+        for obj in session.query(model).filter(model.internaltip_id == itip_id):
+            for attr in attrs:
+                upgrade_tip_content(obj, attr, tip_key)
+
+    itip = session.query(models.InternalTip).filter(models.InternalTip.id == itip_id).one_or_none()
+    if itip is not None:
+        upgrade_tip_content(itip, 'label', tip_key)
+
+
+def decrypt_tip(user_session, tip_prv_key, tip):
+    tip_key = user_session.get_tip_key(tip['id'], tip_prv_key)
+    legacy = False
+
+    def decrypt(data):
+        nonlocal legacy
+        legacy = legacy or GCE.is_legacy_tip_content(data)
+        return GCE.tip_content_decrypt(tip_key, data).decode()
 
     if 'label' in tip and tip['label']:
-        tip['label'] = GCE.asymmetric_decrypt(tip_key, base64.b64decode(tip['label'].encode())).decode()
+        tip['label'] = decrypt(tip['label'])
 
     for questionnaire in tip['questionnaires']:
-        questionnaire['answers'] = json.loads(GCE.asymmetric_decrypt(tip_key, base64.b64decode(questionnaire['answers'].encode())).decode())
+        questionnaire['answers'] = json.loads(decrypt(questionnaire['answers']))
 
     for k in ['whistleblower_identity']:
         if k in tip['data'] and tip['data'][k]:
-            tip['data'][k] = json.loads(GCE.asymmetric_decrypt(tip_key, base64.b64decode(tip['data'][k].encode())).decode())
+            tip['data'][k] = json.loads(decrypt(tip['data'][k]))
 
             if k == 'whistleblower_identity' and isinstance(tip['data'][k], list):
                 # Fix for issue: https://github.com/globaleaks/GlobaLeaks/issues/2612
@@ -36,27 +87,50 @@ def decrypt_tip(user_key, tip_prv_key, tip):
     if 'iar' in tip:
         if tip['iar']['request_motivation']:
             try:
-                tip['iar']['request_motivation'] = GCE.asymmetric_decrypt(tip_key, base64.b64decode(tip['iar']['request_motivation'])).decode()
+                tip['iar']['request_motivation'] = decrypt(tip['iar']['request_motivation'])
             except:
                 pass
 
         if tip['iar']['reply_motivation']:
             try:
-                tip['iar']['reply_motivation'] = GCE.asymmetric_decrypt(tip_key, base64.b64decode(tip['iar']['reply_motivation'])).decode()
+                tip['iar']['reply_motivation'] = decrypt(tip['iar']['reply_motivation'])
             except:
                 pass
 
     for x in tip['comments']:
-        x['content'] = GCE.asymmetric_decrypt(tip_key, base64.b64decode(x['content'].encode())).decode()
+        x['content'] = decrypt(x['content'])
 
     for x in tip['wbfiles'] + tip['rfiles']:
         for k in ['name', 'description', 'type', 'size']:
             if k in x and x[k]:
-                x[k] = GCE.asymmetric_decrypt(tip_key, base64.b64decode(x[k].encode())).decode()
+                x[k] = decrypt(x[k])
                 if k == 'size':
                     x[k] = int(x[k])
 
-    return tip
+    return tip, legacy
+
+
+@inlineCallbacks
+def open_tip(user_session, tip_prv_key, tip):
+    """
+    Decrypt a tip scheduling the re-encryption with the symmetric format
+    of the contents still encrypted with the legacy format
+
+    The key of the tip is available only within the session of the user;
+    the upgrade is scheduled once per tip with the key and performed by
+    the TipEncryptionUpgrade job out of the read path.
+
+    :param user_session: The session of the user opening the tip
+    :param tip_prv_key: The key of the tip encrypted for the user
+    :param tip: The serialized tip
+    :return: The decrypted tip
+    """
+    tip, legacy = yield deferToThread(decrypt_tip, user_session, tip_prv_key, tip)
+
+    if legacy and State.settings.tip_encryption_upgrade:
+        State.TipEncryptionUpgrades.setdefault(tip['id'], user_session.get_tip_key(tip['id'], tip_prv_key))
+
+    returnValue(tip)
 
 
 def db_set_internaltip_answers(session, itip_id, questionnaire_hash, answers, date=None):
@@ -132,7 +206,7 @@ def db_create_receivertip(session, receiver, internaltip, tip_key):
     return receivertip
 
 
-def db_create_submission(session, tid, request, user_session, client_using_tor, client_using_mobile):
+def db_create_submission(session, tid, request, user_session, client_using_tor, client_using_mobile, receipt, receipt_hash, wb_key):
     encryption = db_get(session, models.Config, (models.Config.tid == tid, models.Config.var_name == 'encryption'))
 
     crypto_is_available = encryption.value
@@ -210,8 +284,7 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
     if whistleblower_identity is not None:
         itip.enable_whistleblower_identity = True
 
-    receipt = GCE.generate_receipt()
-    itip.receipt_hash = GCE.hash_password(receipt, State.tenants[tid].cache.receipt_salt)
+    itip.receipt_hash = receipt_hash
 
     session.add(itip)
     session.flush()
@@ -219,7 +292,6 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
     # Evaluate if the whistleblower tip should be encrypted
     if crypto_is_available:
         crypto_tip_prv_key, itip.crypto_tip_pub_key = GCE.generate_keypair()
-        wb_key = GCE.derive_key(receipt.encode(), State.tenants[tid].cache.receipt_salt)
         wb_prv_key, wb_pub_key = GCE.generate_keypair()
         itip.crypto_prv_key = Base64Encoder.encode(GCE.symmetric_encrypt(wb_key, wb_prv_key))
         itip.crypto_pub_key = wb_pub_key
@@ -228,7 +300,7 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
     # Apply special handling to the whistleblower identity question
     if itip.enable_whistleblower_identity and request['identity_provided'] and answers[whistleblower_identity.id]:
         if crypto_is_available:
-            wbi = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, json.dumps(answers[whistleblower_identity.id][0]).encode())).decode()
+            wbi = GCE.tip_content_encrypt(crypto_tip_prv_key, json.dumps(answers[whistleblower_identity.id][0]))
         else:
             wbi = answers[whistleblower_identity.id][0]
 
@@ -237,7 +309,7 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
         db_set_internaltip_data(session, itip.id, 'whistleblower_identity', wbi, itip.creation_date)
 
     if crypto_is_available:
-        answers = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, json.dumps(answers, cls=JSONEncoder).encode())).decode()
+        answers = GCE.tip_content_encrypt(crypto_tip_prv_key, json.dumps(answers, cls=JSONEncoder))
 
     db_set_internaltip_answers(session, itip.id, questionnaire_hash, answers, itip.creation_date)
 
@@ -247,7 +319,7 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
 
         if crypto_is_available:
             for k in ['name', 'type', 'size']:
-                uploaded_file[k] = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, str(uploaded_file[k])))
+                uploaded_file[k] = GCE.tip_content_encrypt(crypto_tip_prv_key, str(uploaded_file[k]))
 
         new_file = models.InternalFile()
         new_file.tid = tid
@@ -273,9 +345,26 @@ def db_create_submission(session, tid, request, user_session, client_using_tor,
     return {'receipt': receipt}
 
 
-@transact
-def create_submission(session, tid, request, user_session, client_using_tor, client_using_mobile):
-    return db_create_submission(session, tid, request, user_session, client_using_tor, client_using_mobile)
+@inlineCallbacks
+def create_submission(tid, request, user_session, client_using_tor, client_using_mobile):
+    """
+    Create a submission
+
+    The memory hard receipt hashing and whistleblower key derivation are
+    performed with a single computation before starting the transaction
+    so that no database lock is held during its execution.
+    """
+    receipt = GCE.generate_receipt()
+
+    receipt_hash, wb_key = yield deferToThread(GCE.calculate_hash_and_key,
+                                               receipt,
+                                               State.tenants[tid].cache.receipt_salt)
+
+    result = yield tw(db_create_submission, tid, request, user_session,
+                      client_using_tor, client_using_mobile,
+                      receipt, receipt_hash, wb_key)
+
+    returnValue(result)
 
 
 class SubmissionInstance(BaseHandler):
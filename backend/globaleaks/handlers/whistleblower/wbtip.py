@@ -11,17 +11,17 @@ from globaleaks import models
 from globaleaks.handlers.admin.node import db_admin_serialize_node
 from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.base import BaseHandler
-from globaleaks.handlers.whistleblower.submission import decrypt_tip, \
+from globaleaks.handlers.whistleblower.submission import open_tip, \
     db_set_internaltip_answers, db_get_questionnaire, \
     db_archive_questionnaire_schema, db_set_internaltip_data
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.models import serializers
 from globaleaks.orm import db_get, transact
 from globaleaks.rest import requests
+from globaleaks.state import State
 from globaleaks.utils.crypto import GCE
 from globaleaks.utils.fs import directory_traversal_check
 from globaleaks.utils.log import log
-from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now, datetime_null
 
 
@@ -44,14 +44,7 @@ def db_notify_recipients_of_tip_update(session, itip_id):
         else:
             data['notification'] = db_get_notification(session, 1, user.language)
 
-        subject, body = Templating().get_mail_subject_and_body(data)
-
-        session.add(models.Mail({
-            'address': data['user']['mail_address'],
-            'subject': subject,
-            'body': body,
-            'tid': user.tid
-        }))
+        State.format_and_send_mail(session, user.tid, data['user']['mail_address'], data)
 
 
 def db_get_wbtip(session, itip_id, language):
@@ -68,7 +61,7 @@ def get_wbtip(session, itip_id, language):
 
 
 @transact
-def create_comment(session, tid, user_id, content):
+def create_comment(session, tid, user_id, user_cc, content):
     itip = db_get(session,
                   models.InternalTip,
                   (models.InternalTip.id == user_id,
@@ -80,7 +73,8 @@ def create_comment(session, tid, user_id, content):
 
     _content = content
     if itip.crypto_tip_pub_key:
-        _content = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, content)).decode()
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(itip.crypto_tip_prv_key))
+        _content = GCE.tip_content_encrypt(crypto_tip_prv_key, content)
 
     comment = models.Comment()
     comment.internaltip_id = itip.id
@@ -95,7 +89,7 @@ def create_comment(session, tid, user_id, content):
 
 
 @transact
-def update_identity_information(session, tid, user_id, identity_field_id, wbi, language):
+def update_identity_information(session, tid, user_id, user_cc, identity_field_id, wbi, language):
     itip = db_get(session,
                   models.InternalTip,
                   (models.InternalTip.id == user_id,
@@ -103,7 +97,8 @@ def update_identity_information(session, tid, user_id, identity_field_id, wbi, l
                    models.InternalTip.tid == tid))
 
     if itip.crypto_tip_pub_key:
-        wbi = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, json.dumps(wbi).encode())).decode()
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(itip.crypto_tip_prv_key))
+        wbi = GCE.tip_content_encrypt(crypto_tip_prv_key, json.dumps(wbi))
 
     db_set_internaltip_data(session, itip.id, 'whistleblower_identity', wbi)
 
@@ -115,7 +110,7 @@ def update_identity_information(session, tid, user_id, identity_field_id, wbi, l
 
 
 @transact
-def store_additional_questionnaire_answers(session, tid, user_id, answers, language):
+def store_additional_questionnaire_answers(session, tid, user_id, user_cc, answers, language):
     itip, context = session.query(models.InternalTip, models.Context) \
                            .filter(models.InternalTip.id == user_id,
                                    models.InternalTip.status != 'closed',
@@ -129,7 +124,8 @@ def store_additional_questionnaire_answers(session, tid, user_id, answers, langu
     questionnaire_hash = db_archive_questionnaire_schema(session, steps)
 
     if itip.crypto_tip_pub_key:
-        answers = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, json.dumps(answers).encode())).decode()
+        crypto_tip_prv_key = GCE.asymmetric_decrypt(user_cc, base64.b64decode(itip.crypto_tip_prv_key))
+        answers = GCE.tip_content_encrypt(crypto_tip_prv_key, json.dumps(answers))
 
     db_set_internaltip_answers(session, itip.id, questionnaire_hash, answers)
 
@@ -148,7 +144,7 @@ class WBTipInstance(BaseHandler):
         tip, crypto_tip_prv_key = yield get_wbtip(self.session.user_id, self.request.language)
 
         if crypto_tip_prv_key:
-            tip = yield deferToThread(decrypt_tip, self.session.cc, crypto_tip_prv_key, tip)
+            tip = yield open_tip(self.session, crypto_tip_prv_key, tip)
 
         returnValue(tip)
 
@@ -161,7 +157,7 @@ class WBTipCommentCollection(BaseHandler):
 
     def post(self):
         request = self.validate_request(self.request.content.read(), requests.CommentDesc)
-        return create_comment(self.request.tid, self.session.user_id, request['content'])
+        return create_comment(self.request.tid, self.session.user_id, self.session.cc, request['content'])
 
 
 class ReceiverFileDownload(BaseHandler):
@@ -185,19 +181,19 @@ class ReceiverFileDownload(BaseHandler):
         log.debug("Download of file %s by whistleblower %s",
                   rfile.id, self.session.user_id)
 
-        return rfile.name, rfile.id, base64.b64decode(wbtip.crypto_tip_prv_key), ''
+        return rfile.name, rfile.id, wbtip.id, base64.b64decode(wbtip.crypto_tip_prv_key), ''
 
     @inlineCallbacks
     def get(self, rfile_id):
-        name, filelocation, tip_prv_key, pgp_key = yield self.download_rfile(self.request.tid, rfile_id)
+        name, filelocation, itip_id, tip_prv_key, pgp_key = yield self.download_rfile(self.request.tid, rfile_id)
 
         filelocation = os.path.join(self.state.settings.attachments_path, filelocation)
         directory_traversal_check(self.state.settings.attachments_path, filelocation)
 
         if tip_prv_key:
-            tip_prv_key = GCE.asymmetric_decrypt(self.session.cc, tip_prv_key)
-            name = GCE.asymmetric_decrypt(tip_prv_key, base64.b64decode(name.encode())).decode()
-            filelocation = GCE.streaming_encryption_open('DECRYPT', tip_prv_key, filelocation)
+            tip_prv_key = self.session.get_tip_key(itip_id, tip_prv_key)
+            name = GCE.tip_content_decrypt(tip_prv_key, name).decode()
+            filelocation = yield deferToThread(GCE.streaming_encryption_open, 'DECRYPT', tip_prv_key, filelocation)
 
         yield self.write_file_as_download(name, filelocation, pgp_key)
 
@@ -213,6 +209,7 @@ class WBTipIdentityHandler(BaseHandler):
 
         return update_identity_information(self.request.tid,
                                            self.session.user_id,
+                                           self.session.cc,
                                            request['identity_field_id'],
                                            request['identity_field_answers'],
                                            self.request.language)
@@ -229,5 +226,6 @@ class WBTipAdditionalQuestionnaire(BaseHandler):
 
         return store_additional_questionnaire_answers(self.request.tid,
                                                       self.session.user_id,
+                                                      self.session.cc,
                                                       request['answers'],
                                                       self.request.language)
@@ -1,11 +1,15 @@
 # -*- coding: utf-8
 #
 # Handlers implementing platform wizard
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread
+
 from globaleaks import models
 from globaleaks.handlers.admin.context import db_create_context
 from globaleaks.handlers.admin.node import db_update_enabled_languages
 from globaleaks.handlers.admin.user import db_create_user, db_set_user_password
 from globaleaks.handlers.base import BaseHandler
+from globaleaks.handlers.user.operation import generate_password_credentials
 from globaleaks.models import config, profiles
 from globaleaks.orm import transact
 from globaleaks.rest import requests, errors
@@ -13,7 +17,28 @@ from globaleaks.utils.crypto import Base64Encoder, GCE, generateRandomPassword
 from globaleaks.utils.log import log
 
 
-def db_wizard(session, tid, hostname, request):
+def generate_wizard_credentials(request):
+    """
+    Compute the credentials of the accounts created by the wizard
+
+    The function performs the memory hard password hashing and
+    it is intended to be executed out of any transaction.
+
+    :param request: A user request
+    :return: A dictionary mapping the roles of the accounts to their credentials
+    """
+    credentials = {}
+
+    if not request['skip_admin_account_creation']:
+        credentials['admin'] = generate_password_credentials(request['admin_password'])
+
+    if not request['skip_recipient_account_creation']:
+        credentials['receiver'] = generate_password_credentials(request['receiver_password'])
+
+    return credentials
+
+
+def db_wizard(session, tid, hostname, request, credentials):
     """
     Transaction for the handling of wizard request
 
@@ -21,6 +46,7 @@ def db_wizard(session, tid, hostname, request):
     :param tid: A tenant ID
     :param hostname: The hostname to be configured
     :param request: A user request
+    :param credentials: The credentials of the accounts to be created
     """
     language = request['node_language']
 
@@ -71,7 +97,7 @@ def db_wizard(session, tid, hostname, request):
         admin_desc['role'] = 'admin'
         admin_desc['pgp_key_remove'] = False
         admin_user = db_create_user(session, tid, None, admin_desc, language)
-        db_set_user_password(session, tid, admin_user, request['admin_password'])
+        db_set_user_password(session, tid, admin_user, credentials['admin'])
         admin_user.password_change_needed = (tid != 1)
 
         if encryption and escrow:
@@ -87,7 +113,7 @@ def db_wizard(session, tid, hostname, request):
         receiver_desc['role'] = 'receiver'
         receiver_desc['pgp_key_remove'] = False
         receiver_user = db_create_user(session, tid, None, receiver_desc, language)
-        db_set_user_password(session, tid, receiver_user, request['receiver_password'])
+        db_set_user_password(session, tid, receiver_user, credentials['receiver'])
         receiver_user.password_change_needed = (tid != 1)
 
     context_desc = models.Context().dict(language)
@@ -140,8 +166,8 @@ def db_wizard(session, tid, hostname, request):
 
 
 @transact
-def wizard(session, tid, hostname, request):
-    return db_wizard(session, tid, hostname, request)
+def wizard(session, tid, hostname, request, credentials):
+    return db_wizard(session, tid, hostname, request, credentials)
 
 
 class Wizard(BaseHandler):
@@ -151,6 +177,7 @@ class Wizard(BaseHandler):
     check_roles = 'any'
     invalidate_cache = True
 
+    @inlineCallbacks
     def post(self):
         request = self.validate_request(self.request.content.read(),
                                         requests.WizardDesc)
@@ -160,4 +187,6 @@ class Wizard(BaseHandler):
         else:
             hostname = ''
 
-        return wizard(self.request.tid, hostname, request)
+        credentials = yield deferToThread(generate_wizard_credentials, request)
+
+        yield wizard(self.request.tid, hostname, request, credentials)
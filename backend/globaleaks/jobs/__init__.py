@@ -7,6 +7,7 @@ from globaleaks.jobs import anomalies, \
                             pgp_check, \
                             session_management, \
                             statistics, \
+                            tip_encryption_upgrade, \
                             update_check
 
 jobs_list = [
@@ -19,5 +20,6 @@ jobs_list = [
     pgp_check.PGPCheck,
     session_management.SessionManagement,
     statistics.Statistics,
+    tip_encryption_upgrade.TipEncryptionUpgrade,
     update_check.UpdateCheck,
 ]
@@ -15,8 +15,8 @@ from globaleaks.handlers.admin.notification import db_get_notification
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.jobs.job import DailyJob
 from globaleaks.orm import db_del, db_log, db_query, transact, tw
+from globaleaks.sessions import Sessions
 from globaleaks.utils.fs import srm
-from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now, is_expired
 
 
@@ -40,6 +40,8 @@ class Cleaning(DailyJob):
 
         db_del(session, models.InternalTip, models.InternalTip.id.in_(itips_ids))
 
+        Sessions.revoke_tip_keys(itips_ids)
+
         for result in results:
             db_log(session, tid=result[1], type='delete_report', user_id='system', object_id=result[0])
 
@@ -71,14 +73,7 @@ class Cleaning(DailyJob):
                 'earliest_expiration_date': earliest_expiration_date
             }
 
-            subject, body = Templating().get_mail_subject_and_body(data)
-
-            session.add(models.Mail({
-                'tid': tid,
-                'address': user_desc['mail_address'],
-                'subject': subject,
-                'body': body
-            }))
+            self.state.format_and_send_mail(session, tid, user_desc['mail_address'], data)
 
     @transact
     def clean(self, session):
@@ -120,6 +115,9 @@ class Cleaning(DailyJob):
         # Delete the outdated ramdisk tokens older than 1 week
         for f in os.listdir(self.state.settings.ramdisk_path):
             path = os.path.join(self.state.settings.ramdisk_path, f)
+            if not os.path.isfile(path):
+                continue
+
             timestamp = datetime.fromtimestamp(os.path.getmtime(path))
             if is_expired(timestamp, days=7):
                 srm(path)
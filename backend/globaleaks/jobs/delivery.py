@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 
-from twisted.internet import abstract
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import abstract, reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks
+from twisted.internet.threads import deferToThreadPool
 
 from globaleaks import models
 from globaleaks.jobs.job import LoopingJob
@@ -10,7 +12,7 @@ from globaleaks.orm import transact
 from globaleaks.settings import Settings
 from globaleaks.utils.crypto import GCE
 from globaleaks.utils.log import log
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.pgp import get_pgp_context, get_pgp_copy_name
 from globaleaks.utils.utility import uuid4
 
 
@@ -18,11 +20,16 @@ __all__ = ['Delivery']
 
 
 @transact
-def file_delivery(session):
+def file_delivery(session, limit):
     """
     This function roll over the InternalFile uploaded, extract a path, id and
     receivers associated, one entry for each combination. representing the
     WhistleblowerFile that need to be created.
+
+    :param session: An ORM session
+    :param limit: The maximum number of files of each kind to be processed
+    :return: The descriptors of the files to be processed and the number
+             of the files left to be processed
     """
     receiverfiles_maps = {}
     whistleblowerfiles_maps = {}
@@ -31,7 +38,7 @@ def file_delivery(session):
                               .filter(models.InternalFile.new.is_(True),
                                       models.InternalTip.id == models.InternalFile.internaltip_id) \
                               .order_by(models.InternalFile.creation_date) \
-                              .limit(20):
+                              .limit(limit):
         ifile.new = False
         src = ifile.id
 
@@ -53,19 +60,34 @@ def file_delivery(session):
                 receiverfiles_maps[ifile.id] = {
                     'key': itip.crypto_tip_pub_key,
                     'src': src,
-                    'wbfiles': []
+                    'dst': os.path.abspath(os.path.join(Settings.attachments_path, ifile.id)),
+                    'plaintext': False,
+                    'pgp_files': []
                 }
 
-            receiverfiles_maps[ifile.id]['wbfiles'].append({
-                'dst': os.path.abspath(os.path.join(Settings.attachments_path, receiverfile.internalfile_id)),
-                'pgp_key_public': user.pgp_key_public
-            })
+            m = receiverfiles_maps[ifile.id]
+
+            if m['key']:
+                # The file is encrypted once with the key of the tip
+                continue
+
+            if not user.pgp_key_public:
+                # The plaintext copy is written only for the recipients without a PGP key
+                m['plaintext'] = True
+            else:
+                # The recipient gets a distinct copy encrypted with its PGP key
+                receiverfile.id = uuid4()
+                m['pgp_files'].append({
+                    'dst': os.path.abspath(os.path.join(Settings.attachments_path,
+                                                        get_pgp_copy_name(receiverfile.id, user.pgp_key_fingerprint))),
+                    'pgp_key_public': user.pgp_key_public
+                })
 
     for rfile, itip in session.query(models.ReceiverFile, models.InternalTip)\
                                .filter(models.ReceiverFile.new.is_(True),
                                        models.ReceiverFile.internaltip_id == models.InternalTip.id) \
                                .order_by(models.ReceiverFile.creation_date) \
-                               .limit(20):
+                               .limit(limit):
         rfile.new = False
         src = rfile.id
 
@@ -77,7 +99,10 @@ def file_delivery(session):
 
         rfile.new = False
 
-    return receiverfiles_maps, whistleblowerfiles_maps
+    backlog = session.query(models.InternalFile).filter(models.InternalFile.new.is_(True)).count() + \
+              session.query(models.ReceiverFile).filter(models.ReceiverFile.new.is_(True)).count()
+
+    return receiverfiles_maps, whistleblowerfiles_maps, backlog
 
 
 def write_plaintext_file(sf, dest_path):
@@ -106,58 +131,165 @@ def write_encrypted_file(key, sf, dest_path):
         log.err("Unable to create plaintext file %s: %s", dest_path, excep)
 
 
-def process_receiverfiles(state, files_maps):
+def write_plaintext_and_pgp_files(sf, plaintext_path, pgp_files):
     """
-    Function that process uploaded receiverfiles
+    Write the plaintext copy of a file and its copies encrypted with
+    the PGP keys of the recipients reading the file only once
 
-    :param state: A reference to the application state
-    :param files_maps: descriptors of whistleblower files to be processed
+    :param sf: The temporary file to be processed
+    :param plaintext_path: The path of the plaintext copy or None if no plaintext copy is needed
+    :param pgp_files: The list of descriptors of the PGP encrypted copies
     """
-    for a, m in files_maps.items():
-        sf = state.get_tmp_file_by_name(m['src'])
+    outputs = []
+
+    if plaintext_path is not None:
+        outputs.append((plaintext_path, open(plaintext_path, 'wb')))
+
+    for pgp_file in pgp_files:
+        try:
+            outputs.append((pgp_file['dst'], get_pgp_context(pgp_file['pgp_key_public']).open_file_encryption(pgp_file['dst'])))
+        except Exception as excep:
+            log.err("Unable to create PGP encrypted file %s: %s", pgp_file['dst'], excep)
+
+    try:
+        with sf.open('rb') as encrypted_file:
+            chunk = encrypted_file.read(abstract.FileDescriptor.bufferSize)
+            while chunk:
+                for _, output in outputs:
+                    output.write(chunk)
 
-        for rcounter, rf in enumerate(m['wbfiles']):
+                chunk = encrypted_file.read(abstract.FileDescriptor.bufferSize)
+    except Exception as excep:
+        log.err("Unable to read file %s: %s", sf.filepath, excep)
+    finally:
+        for dest_path, output in outputs:
             try:
-                if m['key']:
-                    write_encrypted_file(m['key'], sf, rf['dst'])
-                elif rf['pgp_key_public']:
-                    with sf.open('rb') as encrypted_file:
-                        PGPContext(rf['pgp_key_public']).encrypt_file(encrypted_file, rf['dst'])
-                else:
-                    write_plaintext_file(sf, rf['dst'])
-            except:
-                pass
-
-
-def process_whistleblowerfiles(state, files_maps):
+                output.close()
+            except Exception as excep:
+                log.err("Unable to create file %s: %s", dest_path, excep)
+
+
+def process_receiverfile(sf, m):
     """
-    Function that process uploaded whistleblowerfiles
+    Function that process an uploaded receiverfile
 
-    :param state: A reference to the application state
-    :param files_maps: descriptors of whistleblower files to be processed
+    :param sf: The temporary file to be processed
+    :param m: The descriptor of the whistleblower files to be created
+    :return: The size of the processed file
     """
-    for _, m in files_maps.items():
-        try:
-            sf = state.get_tmp_file_by_name(m['src'])
+    try:
+        if m['key']:
+            write_encrypted_file(m['key'], sf, m['dst'])
+        else:
+            write_plaintext_and_pgp_files(sf, m['dst'] if m['plaintext'] else None, m['pgp_files'])
+    except:
+        pass
 
-            if m['key']:
-                write_encrypted_file(m['key'], sf, m['dst'])
-            else:
-                write_plaintext_file(sf, m['dst'])
-        except:
-            pass
+    return sf.size
+
+
+def process_whistleblowerfile(sf, m):
+    """
+    Function that process an uploaded whistleblowerfile
+
+    :param sf: The temporary file to be processed
+    :param m: The descriptor of the receiver file to be created
+    :return: The size of the processed file
+    """
+    try:
+        if m['key']:
+            write_encrypted_file(m['key'], sf, m['dst'])
+        else:
+            write_plaintext_file(sf, m['dst'])
+    except:
+        pass
+
+    return sf.size
 
 
 class Delivery(LoopingJob):
     interval = 5
     monitor_interval = 180
+    wakeup_models = (models.InternalFile, models.ReceiverFile)
+
+    # Bounds of the number of files of each kind fetched on each batch;
+    # the size of the batches is adapted so that each of them takes
+    # approximately batch_target_time seconds to be processed
+    min_batch_size = 20
+    max_batch_size = 1000
+    batch_target_time = 2
+    batch_size = min_batch_size
+
+    backlog = 0
+    delivered_files = 0
+    delivered_bytes = 0
+    throughput = 0
+
+    def process_files(self, receiverfiles_maps, whistleblowerfiles_maps):
+        """
+        Process the files of a batch in the delivery thread pool
+
+        The temporary files are looked up in the reactor thread while the
+        decryption and the encryption of each file run in a worker thread.
+        """
+        dl = []
+
+        for function, files_maps in [(process_receiverfile, receiverfiles_maps),
+                                     (process_whistleblowerfile, whistleblowerfiles_maps)]:
+            for m in files_maps.values():
+                sf = self.state.get_tmp_file_by_name(m['src'])
+                if sf is None:
+                    continue
+
+                dl.append(deferToThreadPool(reactor, self.state.delivery_tp, function, sf, m))
+
+        return DeferredList(dl, consumeErrors=True)
+
+    def adapt_batch_size(self, count, elapsed):
+        if count < self.batch_size:
+            return
+
+        if elapsed < self.batch_target_time / 2:
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+        elif elapsed > self.batch_target_time * 2:
+            self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+
+    def get_stats(self):
+        return {
+            'backlog': self.backlog,
+            'batch_size': self.batch_size,
+            'delivered_files': self.delivered_files,
+            'delivered_bytes': self.delivered_bytes,
+            'throughput': self.throughput
+        }
 
     @inlineCallbacks
     def operation(self):
         """
         This function creates receiver files
+
+        The files are processed in batches until the backlog is empty; a new
+        batch is fetched only after the previous one has been processed.
         """
-        receiverfiles_maps, whistleblowerfiles_maps = yield file_delivery()
+        while not self.state.shutdown:
+            start = time.monotonic()
+
+            receiverfiles_maps, whistleblowerfiles_maps, self.backlog = yield file_delivery(self.batch_size)
+
+            count = max(len(receiverfiles_maps), len(whistleblowerfiles_maps))
+            if not count:
+                break
+
+            results = yield self.process_files(receiverfiles_maps, whistleblowerfiles_maps)
+
+            size = sum(result for success, result in results if success)
+            elapsed = max(time.monotonic() - start, 0.001)
+
+            self.delivered_files += len(results)
+            self.delivered_bytes += size
+            self.throughput = int(size / elapsed)
+
+            self.adapt_batch_size(count, elapsed)
 
-        process_receiverfiles(self.state, receiverfiles_maps)
-        process_whistleblowerfiles(self.state, whistleblowerfiles_maps)
+            if not self.backlog:
+                break
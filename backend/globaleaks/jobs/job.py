@@ -3,6 +3,7 @@ import time
 
 from twisted.internet import task, defer, reactor
 
+from globaleaks.orm import add_commit_observer, remove_commit_observer, run_with_caller, run_with_priority, PRIORITY_LOW
 from globaleaks.state import State, extract_exception_traceback_and_schedule_email
 from globaleaks.utils.log import log
 from globaleaks.utils.utility import datetime_now
@@ -46,7 +47,9 @@ class Job(task.LoopingCall):
         self.begin()
 
         try:
-            yield self.operation()
+            # The transactions of the jobs are queued after the ones of the requests
+            yield run_with_caller('%s.%s' % (self.__module__, self.name),
+                                  run_with_priority, PRIORITY_LOW, self.operation)
         except Exception as e:
             if not self.state.shutdown:
                 self.on_error(e)
@@ -85,6 +88,9 @@ class Job(task.LoopingCall):
     def get_delay(self):
         return 0
 
+    def get_stats(self):
+        return {}
+
     def on_error(self, excep):
         log.err("Exception while running %s" % self.name)
         log.exception(excep)
@@ -101,6 +107,54 @@ class LoopingJob(Job):
     monitor_period = 5 * 60
     last_monitor_check_failed = 0  # Epoch start
 
+    # The models whose insertion wakes up the job. When set, the executions
+    # not preceded by any insertion are skipped unless idle_interval seconds
+    # have passed since the last execution.
+    wakeup_models = ()
+    idle_interval = 60
+    pending = True
+    last_run = 0
+
+    def start(self, interval):
+        if self.wakeup_models:
+            add_commit_observer(self.wakeup, self.wakeup_models)
+
+        Job.start(self, interval)
+
+    def stop(self):
+        remove_commit_observer(self.wakeup)
+
+        return Job.stop(self)
+
+    def wakeup(self):
+        """
+        Anticipate the next execution of the job
+
+        The wakeups received while the job is waiting are coalesced in a
+        single execution; the ones received while the job is running cause
+        a single further execution.
+        """
+        self.pending = True
+
+        if self.running and self.call is not None:
+            self.call.reset(0)
+
+    def on_run_end(self, result):
+        if self.pending:
+            self.clock.callLater(0, self.wakeup)
+
+        return result
+
+    def run(self):
+        if self.wakeup_models and not self.pending and \
+           self.clock.seconds() - self.last_run < self.idle_interval:
+            return defer.succeed(None)
+
+        self.pending = False
+        self.last_run = self.clock.seconds()
+
+        return Job.run(self).addCallback(self.on_run_end)
+
     def on_error(self, excep):
         error = "Job %s died with runtime %.4f [low: %.4f, high: %.4f]" % \
                 (self.name, self.mean_time, self.low_time, self.high_time)
@@ -6,27 +6,78 @@ from datetime import timedelta
 
 from sqlalchemy import or_
 from twisted.internet import defer
+from twisted.internet.threads import deferToThread
 
 from globaleaks import models
 from globaleaks.handlers.admin.node import db_admin_serialize_node
 from globaleaks.handlers.admin.notification import db_get_notification
-from globaleaks.handlers.user import user_serialize_user
+from globaleaks.handlers.public import db_get_submission_statuses
 from globaleaks.jobs.job import LoopingJob
 from globaleaks.models import serializers
-from globaleaks.orm import db_del, transact, tw
+from globaleaks.orm import db_del, transact, transact_ro
 from globaleaks.utils.log import log
+from globaleaks.utils.pgp import get_pgp_context
 from globaleaks.utils.templating import Templating
-from globaleaks.utils.utility import datetime_now, deferred_sleep
+from globaleaks.utils.utility import datetime_never, datetime_now
 
 
 def gen_cache_key(*args):
     return '-'.join(['{}'.format(arg) for arg in args])
 
 
+def serialize_user(user):
+    """
+    Serialize the attributes of a user referenced by the notification templates
+
+    :param user: The user to be serialized
+    :return: The descriptor of the user
+    """
+    return {
+        'id': user.id,
+        'name': user.name,
+        'username': user.username,
+        'mail_address': user.mail_address,
+        'language': user.language,
+        'notification': user.notification,
+        'pgp_key_fingerprint': user.pgp_key_fingerprint,
+        'pgp_key_public': user.pgp_key_public,
+        'pgp_key_expiration': user.pgp_key_expiration
+    }
+
+
+def serialize_tip(itip, rtip, questionnaires):
+    """
+    Serialize the attributes of a tip referenced by the notification templates
+
+    :param itip: The internaltip to be serialized
+    :param rtip: The receivertip of the user to be notified
+    :param questionnaires: The serialized questionnaires of the tip
+    :return: The descriptor of the tip
+    """
+    return {
+        'id': itip.id,
+        'progressive': itip.progressive,
+        'label': itip.label,
+        'status': itip.status,
+        'substatus': itip.substatus,
+        'creation_date': itip.creation_date,
+        'enable_notifications': rtip.enable_notifications,
+        'questionnaires': questionnaires
+    }
+
+
 class MailGenerator(object):
     def __init__(self, state):
         self.state = state
         self.cache = {}
+        self.mails = []
+        self.now = datetime_now()
+
+        # The objects notified, marked only by the transaction spooling the mails
+        self.notified = {}
+        self.notified_rtips = set()
+        self.reminded_users = set()
+        self.daily_run = False
 
     def serialize_config(self, session, key, tid, language):
         cache_key = gen_cache_key(key, tid, language)
@@ -37,11 +88,86 @@ class MailGenerator(object):
                 cache_obj = db_admin_serialize_node(session, tid, language)
             elif key == 'notification':
                 cache_obj = db_get_notification(session, tid, language)
+            elif key == 'submission_statuses':
+                cache_obj = db_get_submission_statuses(session, tid, language)
 
             self.cache[cache_key] = cache_obj
 
         return self.cache[cache_key]
 
+    def get_notification(self, session, tid, language):
+        node = self.serialize_config(session, 'node', tid, language)
+
+        return self.serialize_config(session, 'notification', tid if node['mode'] == 'default' else 1, language)
+
+    def serialize_questionnaire(self, questionnaire_hash, schema, language):
+        cache_key = gen_cache_key('questionnaire', questionnaire_hash, language)
+
+        if cache_key not in self.cache:
+            self.cache[cache_key] = serializers.serialize_archived_questionnaire_schema(schema, language)
+
+        return self.cache[cache_key]
+
+    def load_questionnaires(self, session, itip_ids):
+        """
+        Load with a single query the answers of a set of tips
+
+        :param session: An ORM session
+        :param itip_ids: The IDs of the tips
+        :return: A dictionary mapping each tip to the list of its (hash, schema, answers)
+        """
+        ret = {}
+
+        if not itip_ids:
+            return ret
+
+        for itip_id, answers, questionnaire_hash, schema in session.query(models.InternalTipAnswers.internaltip_id,
+                                                                          models.InternalTipAnswers.answers,
+                                                                          models.ArchivedSchema.hash,
+                                                                          models.ArchivedSchema.schema) \
+                                                                   .filter(models.ArchivedSchema.hash == models.InternalTipAnswers.questionnaire_hash,
+                                                                           models.InternalTipAnswers.internaltip_id.in_(itip_ids)) \
+                                                                   .order_by(models.InternalTipAnswers.creation_date.asc()):
+            ret.setdefault(itip_id, []).append((questionnaire_hash, schema, answers))
+
+        return ret
+
+    def process_tip_events(self, session, events):
+        """
+        Create the mails notifying a batch of events regarding tips
+
+        The data referenced by the templates is loaded for the whole batch
+        with a fixed number of queries; the answers are loaded only for the
+        tips notified with templates including them.
+
+        :param session: An ORM session
+        :param events: A list of tuples (type, user, rtip, itip)
+        """
+        itip_ids = set()
+
+        for data_type, user, rtip, itip in events:
+            notification = self.get_notification(session, user.tid, user.language)
+            if '{QuestionnaireAnswers}' in notification[data_type + '_mail_template']:
+                itip_ids.add(itip.id)
+
+        questionnaires = self.load_questionnaires(session, itip_ids)
+
+        for data_type, user, rtip, itip in events:
+            try:
+                data = {
+                    'type': data_type,
+                    'user': serialize_user(user),
+                    'tip': serialize_tip(itip, rtip, [{
+                        'steps': self.serialize_questionnaire(questionnaire_hash, schema, user.language),
+                        'answers': answers
+                    } for questionnaire_hash, schema, answers in questionnaires.get(itip.id, [])]),
+                    'submission_statuses': self.serialize_config(session, 'submission_statuses', user.tid, user.language)
+                }
+
+                self.process_mail_creation(session, user.tid, data)
+            except:
+                pass
+
     def process_mail_creation(self, session, tid, data):
         user_id = data['user']['id']
         language = data['user']['language']
@@ -52,27 +178,88 @@ class MailGenerator(object):
             return
 
         data['node'] = self.serialize_config(session, 'node', tid, language)
-
-        if data['node']['mode'] == 'default':
-            data['notification'] = self.serialize_config(session, 'notification', tid, language)
-        else:
-            data['notification'] = self.serialize_config(session, 'notification', 1, language)
+        data['notification'] = self.get_notification(session, tid, language)
 
         subject, body = Templating().get_mail_subject_and_body(data)
 
-        session.add(models.Mail({
+        self.mails.append({
             'address': data['user']['mail_address'],
             'subject': subject,
             'body': body,
             'tid': tid,
-        }))
+            'pgp_key_public': data['user']['pgp_key_public']
+        })
+
+    def encrypt_mails(self):
+        """
+        Encrypt the bodies of the mails addressed to users with a PGP key
+
+        The bodies are encrypted with a single gpg process for each key;
+        the function is intended to be executed out of any transaction.
+
+        :return: The list of the mails to be spooled
+        """
+        mails_by_key = {}
+        for mail in self.mails:
+            mails_by_key.setdefault(mail.pop('pgp_key_public'), []).append(mail)
+
+        self.mails = []
+
+        ret = []
+        for pgp_key_public, mails in mails_by_key.items():
+            if pgp_key_public:
+                try:
+                    bodies = get_pgp_context(pgp_key_public).encrypt_messages([mail['body'] for mail in mails])
+                except:
+                    bodies = [''] * len(mails)
+
+                for mail, body in zip(mails, bodies):
+                    mail['body'] = body
+
+            ret.extend(mails)
+
+        return ret
 
     @transact
+    def spool_mails(self, session, mails):
+        """
+        Add the mails created to the pool of the mails to be sent
+
+        The objects notified are marked in the same transaction so that
+        the events are never marked as notified without their mails.
+
+        :param session: An ORM session
+        :param mails: The list of the mails to be spooled
+        """
+        for model, ids in self.notified.items():
+            session.query(model).filter(model.id.in_(ids)).update({'new': False}, synchronize_session=False)
+
+        if self.notified_rtips:
+            session.query(models.ReceiverTip) \
+                   .filter(models.ReceiverTip.id.in_(self.notified_rtips)) \
+                   .update({'last_notification': self.now}, synchronize_session=False)
+
+        if self.reminded_users:
+            session.query(models.User) \
+                   .filter(models.User.id.in_(self.reminded_users)) \
+                   .update({'reminder_date': self.now}, synchronize_session=False)
+
+        for mail in mails:
+            session.add(models.Mail(mail))
+
+    @transact_ro
     def generate(self, session):
-        now = datetime_now()
+        self.generate_mails(session)
+
+    def mark_notified(self, obj):
+        self.notified.setdefault(type(obj), set()).add(obj.id)
+
+    def generate_mails(self, session):
+        now = self.now
 
         rtips_ids = {}
         silent_tids = []
+        events = []
 
         reminder_time = self.state.tenants[1].cache.unread_reminder_time if 1 in self.state.tenants else 7
 
@@ -108,26 +295,17 @@ class MailGenerator(object):
             if (rtips_ids.get(rtip.id, False) or tid in silent_tids) or \
                (isinstance(obj, models.Comment) and obj.author_id == user.id) or \
                (rtip.last_notification > rtip.last_access):
-                obj.new = False
+                self.mark_notified(obj)
                 continue
 
-            obj.new = False
-            rtip.last_notification = now
+            self.mark_notified(obj)
+            self.notified_rtips.add(rtip.id)
 
             rtips_ids[rtip.id] = True
 
-            try:
-                if isinstance(obj, models.ReceiverTip):
-                    data = {'type': 'tip'}
-                else:
-                    data = {'type': 'tip_update'}
+            events.append(('tip' if isinstance(obj, models.ReceiverTip) else 'tip_update', user, rtip, itip))
 
-                data['user'] = user_serialize_user(session, user, user.language)
-                data['tip'] = serializers.serialize_rtip(session, itip, rtip, user.language)
-
-                self.process_mail_creation(session, tid, data)
-            except:
-                pass
+        self.process_tip_events(session, events)
 
         for user in session.query(models.User).filter(models.User.reminder_date < now - timedelta(reminder_time),
                                                       models.User.id == models.ReceiverTip.receiver_id,
@@ -139,11 +317,11 @@ class MailGenerator(object):
             if tid in silent_tids:
                 continue
 
-            user.reminder_date = now
+            self.reminded_users.add(user.id)
             data = {'type': 'unread_tips'}
 
             try:
-                data['user'] = user_serialize_user(session, user, user.language)
+                data['user'] = serialize_user(user)
                 self.process_mail_creation(session, tid, data)
             except:
                 pass
@@ -151,7 +329,7 @@ class MailGenerator(object):
         if now < Notification.next_daily_run:
             return
 
-        Notification.next_daily_run = now + timedelta(1)
+        self.daily_run = True
 
         for user in session.query(models.User).filter(models.User.id == models.ReceiverTip.receiver_id,
                                                       models.ReceiverTip.internaltip_id == models.InternalTip.id,
@@ -164,21 +342,25 @@ class MailGenerator(object):
             data = {'type': 'tip_reminder'}
 
             try:
-                data['user'] = user_serialize_user(session, user, user.language)
+                data['user'] = serialize_user(user)
                 self.process_mail_creation(session, tid, data)
             except:
                 pass
 
 
-
 @transact
 def get_mails_from_the_pool(session):
     """
-    Fetch up to 100 email from the pool of email to be sent
+    Fetch up to 100 email due to be sent from the pool of email
+
+    :param session: An ORM session
     """
     ret = []
 
-    for mail in session.query(models.Mail).order_by(models.Mail.creation_date).limit(100):
+    for mail in session.query(models.Mail) \
+                       .filter(models.Mail.next_attempt <= datetime_now()) \
+                       .order_by(models.Mail.next_attempt, models.Mail.creation_date) \
+                       .limit(100):
         ret.append({
             'id': mail.id,
             'address': mail.address,
@@ -190,23 +372,95 @@ def get_mails_from_the_pool(session):
     return ret
 
 
+@transact
+def update_mails_of_the_pool(session, sent_ids, failed_ids, attempts_limit, retry_delay):
+    """
+    Remove from the pool the mails sent and reschedule the mails failed
+
+    The failed mails are retried with an exponential backoff and parked
+    once attempts_limit is reached; the parked mails are never retried
+    and are removed by the periodic cleaning of the pool.
+
+    :param session: An ORM session
+    :param sent_ids: The IDs of the mails sent
+    :param failed_ids: The IDs of the mails that could not be sent
+    :param attempts_limit: The maximum number of attempts for each mail
+    :param retry_delay: The delay in seconds after the first failed attempt
+    """
+    if sent_ids:
+        db_del(session, models.Mail, models.Mail.id.in_(sent_ids))
+
+    if not failed_ids:
+        return
+
+    now = datetime_now()
+
+    for mail in session.query(models.Mail).filter(models.Mail.id.in_(failed_ids)):
+        mail.attempts += 1
+
+        if mail.attempts >= attempts_limit:
+            log.err("Giving up sending a mail to %s after %d attempts", mail.address, mail.attempts, tid=mail.tid)
+            mail.next_attempt = datetime_never()
+        else:
+            mail.next_attempt = now + timedelta(seconds=retry_delay * 2 ** (mail.attempts - 1))
+
+
 class Notification(LoopingJob):
     interval = 10
     monitor_interval = 3 * 60
+    wakeup_models = (models.ReceiverTip, models.Comment, models.WhistleblowerFile, models.Mail)
     next_daily_run = datetime_now()
 
+    @defer.inlineCallbacks
     def generate_emails(self):
-        return MailGenerator(self.state).generate()
+        """
+        Generate the mails of the events to be notified
+
+        The mails are generated by a read-only transaction and encrypted
+        in a thread; a single write transaction then marks the events as
+        notified and adds the mails to the pool, so that the gpg processes
+        never stall the writer thread and no event is lost in between.
+        """
+        generator = MailGenerator(self.state)
+
+        yield generator.generate()
+
+        mails = yield deferToThread(generator.encrypt_mails)
+
+        if mails or generator.notified or generator.reminded_users:
+            yield generator.spool_mails(mails)
+
+        if generator.daily_run:
+            Notification.next_daily_run = generator.now + timedelta(1)
 
     @defer.inlineCallbacks
     def spool_emails(self):
-        mails = yield get_mails_from_the_pool()
-        for mail in mails:
-            sent = yield self.state.sendmail(mail['tid'], mail['address'], mail['subject'], mail['body'])
-            if sent:
-                yield tw(db_del, models.Mail, models.Mail.id == mail['id'])
+        """
+        Send the mails of the pool that are due until none is left
+
+        The mails are handed over all together to the SMTP connection pools
+        that enforce the concurrency and the rate limits of each server;
+        the mails that could not be sent are rescheduled with a backoff.
+        """
+        while not self.state.shutdown:
+            mails = yield get_mails_from_the_pool()
+            if not mails:
+                break
+
+            results = yield defer.DeferredList([self.state.sendmail(mail['tid'], mail['address'], mail['subject'], mail['body']) for mail in mails],
+                                               consumeErrors=True)
+
+            sent_ids, failed_ids = [], []
+            for mail, (success, sent) in zip(mails, results):
+                if success and sent:
+                    sent_ids.append(mail['id'])
+                else:
+                    failed_ids.append(mail['id'])
 
-            yield deferred_sleep(1)
+            yield update_mails_of_the_pool(sent_ids,
+                                           failed_ids,
+                                           self.state.settings.mail_attempts_limit,
+                                           self.state.settings.mail_retry_delay)
 
     @defer.inlineCallbacks
     def operation(self):
@@ -10,9 +10,7 @@ from globaleaks.handlers.admin.user import db_get_users
 from globaleaks.handlers.user import user_serialize_user
 from globaleaks.jobs.job import DailyJob
 from globaleaks.orm import transact
-from globaleaks.transactions import db_schedule_email
 from globaleaks.utils.log import log
-from globaleaks.utils.templating import Templating
 from globaleaks.utils.utility import datetime_now, datetime_null
 
 
@@ -43,9 +41,7 @@ class PGPCheck(DailyJob):
                 'user': user_desc,
             }
 
-            subject, body = Templating().get_mail_subject_and_body(data)
-
-            db_schedule_email(session, tid, data['user']['mail_address'], subject, body)
+            self.state.format_and_send_mail(session, tid, data['user']['mail_address'], data)
 
     def prepare_user_pgp_alerts(self, session, tid, user_desc):
         user_language = user_desc['language']
@@ -57,9 +53,7 @@ class PGPCheck(DailyJob):
             'user': user_desc
         }
 
-        subject, body = Templating().get_mail_subject_and_body(data)
-
-        db_schedule_email(session, tid, user_desc['mail_address'], subject, body)
+        self.state.format_and_send_mail(session, tid, user_desc['mail_address'], data)
 
     @transact
     def perform_pgp_validation_checks(self, session):
@@ -0,0 +1,27 @@
+# -*- coding: utf-8
+# Implement the re-encryption of the tips encrypted with the legacy format
+from twisted.internet.defer import inlineCallbacks
+
+from globaleaks.handlers.whistleblower.submission import db_upgrade_tip_encryption
+from globaleaks.jobs.job import LoopingJob
+from globaleaks.orm import tw
+
+
+__all__ = ['TipEncryptionUpgrade']
+
+
+class TipEncryptionUpgrade(LoopingJob):
+    interval = 10
+    monitor_interval = 300
+
+    @inlineCallbacks
+    def operation(self):
+        """
+        This scheduler is responsible for re-encrypting with the symmetric
+        format the tips whose legacy contents have been found when opened
+        within the session of a user holding their key.
+        """
+        while self.state.TipEncryptionUpgrades:
+            itip_id, tip_key = self.state.TipEncryptionUpgrades.popitem()
+
+            yield tw(db_upgrade_tip_encryption, itip_id, tip_key)
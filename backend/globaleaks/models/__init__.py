@@ -213,7 +213,6 @@ class _AuditLog(Model):
     This model contains audit logs
     """
     __tablename__ = 'auditlog'
-    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
     tid = Column(Integer, default=1)
@@ -224,6 +223,11 @@ class _AuditLog(Model):
     object_id = Column(UnicodeText(36))
     data = Column(JSON)
 
+    @declared_attr
+    def __table_args__(self):
+        return (Index('ix_auditlog_tid_date_type', 'tid', 'date', 'type'),
+                {'sqlite_autoincrement': True})
+
 
 class _Comment(Model):
     """
@@ -648,6 +652,10 @@ class _InternalTip(Model):
     def __table_args__(self):
         return (UniqueConstraint('tid', 'progressive'),
                 UniqueConstraint('tid', 'receipt_hash'),
+                Index('ix_internaltip_tid_expiration_date', 'tid', 'expiration_date'),
+                Index('ix_internaltip_expiration_date', 'expiration_date'),
+                Index('ix_internaltip_reminder_date', 'reminder_date'),
+                Index('ix_internaltip_update_date', 'update_date'),
                 ForeignKeyConstraint(['tid'], ['tenant.id'], ondelete='CASCADE', deferrable=True, initially='DEFERRED'),
                 ForeignKeyConstraint(['context_id'], ['context.id'], ondelete='CASCADE', deferrable=True, initially='DEFERRED'))
 
@@ -694,12 +702,16 @@ class _Mail(Model):
     address = Column(UnicodeText, nullable=False)
     subject = Column(UnicodeText, nullable=False)
     body = Column(UnicodeText, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt = Column(DateTime, default=datetime_null, nullable=False)
 
     unicode_keys = ['address', 'subject', 'body']
 
     @declared_attr
     def __table_args__(self):
-        return ForeignKeyConstraint(['tid'], ['tenant.id'], ondelete='CASCADE', deferrable=True, initially='DEFERRED'),
+        return (Index('ix_mail_next_attempt_creation_date', 'next_attempt', 'creation_date'),
+                Index('ix_mail_creation_date', 'creation_date'),
+                ForeignKeyConstraint(['tid'], ['tenant.id'], ondelete='CASCADE', deferrable=True, initially='DEFERRED'))
 
 
 class _Questionnaire(Model):
@@ -1014,6 +1026,8 @@ class _User(Model):
     def __table_args__(self):
         return (ForeignKeyConstraint(['tid'], ['tenant.id'], ondelete='CASCADE', deferrable=True, initially='DEFERRED'),
                 UniqueConstraint('tid', 'username'),
+                Index('ix_user_tid_lower_username', 'tid', func.lower(self.username)),
+                Index('ix_user_tid_lower_mail_address', 'tid', func.lower(self.mail_address)),
                 CheckConstraint(self.role.in_(EnumUserRole.keys())))
 
 
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import not_
-from globaleaks.models import Config, ConfigL10N, EnabledLanguage
+import copy
+import itertools
+import threading
+
+from sqlalchemy import event, not_
+from sqlalchemy.orm import Session
+
+from globaleaks.models import Config, ConfigL10N, EnabledLanguage, File
 from globaleaks.models.properties import *
 from globaleaks.models.config_desc import ConfigDescriptor, ConfigFilters, ConfigL10NFilters
 from globaleaks.utils.onion import generate_onion_service_v3
@@ -16,6 +22,244 @@ inherit_from_root_tenant = [
 ]
 
 
+# Models whose changes invalidate the cached serializations of the configuration
+config_cache_models = (Config, ConfigL10N, EnabledLanguage, File)
+
+# Marker of the variables deleted by a transaction
+_DELETED = object()
+
+
+class _ConfigCache(object):
+    """
+    Cache of the configuration of the tenants
+
+    The cache keeps for each tenant a store of the values of the variables
+    of the configuration and the serializations built on top of them.
+
+    Each tenant has a version incremented by every committed transaction
+    writing its configuration and each transaction uses the versions that
+    are current when it begins. The entries are valid only for the version
+    current when they are created and they are bypassed by the transactions
+    writing the configuration or started before its last update.
+
+    The stores are updated on commit with the values written by the
+    transactions so that they do not need to be reloaded from the database.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = 0
+        self.versions = {}
+        self.stores = {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.reads_avoided = 0
+
+    def clear(self):
+        self.invalidate({None})
+
+    def snapshot(self):
+        with self.lock:
+            return self.epoch, self.versions
+
+    def invalidate(self, tids, snapshot=None, values=None):
+        """
+        Invalidate the entries of the specified tenants; None invalidates all the entries
+
+        :param tids: The tenants whose configuration has been written
+        :param snapshot: The versions current when the writing transaction began
+        :param values: The variables written by the transaction indexed by tenant
+        """
+        with self.lock:
+            if None in tids:
+                self.epoch += 1
+                self.versions = {}
+                self.stores = {}
+                self.entries = {}
+                return
+
+            # The versions are copied on write as the transactions keep a reference to them
+            versions = dict(self.versions)
+            for tid in tids:
+                versions[tid] = versions.get(tid, 0) + 1
+
+                store = self.stores.pop(tid, None)
+
+                # A store is updated only if no other transaction wrote the
+                # configuration of the tenant since the transaction began
+                if store is None or snapshot is None or values is None or \
+                   snapshot[0] != self.epoch or \
+                   snapshot[1].get(tid, 0) != store[0][1] or \
+                   store[0][1] != self.versions.get(tid, 0):
+                    continue
+
+                store = dict(store[1])
+                for var_name, value in values.get(tid, {}).items():
+                    if value is _DELETED:
+                        store.pop(var_name, None)
+                    else:
+                        store[var_name] = value
+
+                self.stores[tid] = ((self.epoch, versions[tid]), store)
+
+            self.versions = versions
+
+    def get_version(self, session, tid):
+        """
+        Return the version of the configuration of a tenant usable by a transaction
+
+        :param session: An ORM session
+        :param tid: A tenant ID
+        :return: The version or None if the transaction could not use the cache
+        """
+        # Begins the transaction if needed in order to snapshot the versions
+        session.connection()
+
+        written = session.info.get('config_tids', ())
+        snapshot = session.info.get('config_versions')
+        if snapshot is None or tid in written or None in written:
+            return
+
+        # The writes not yet flushed are looked up among the objects modified
+        # by the transaction without flushing them
+        for obj in itertools.chain(session.new, session.dirty, session.deleted):
+            if isinstance(obj, config_cache_models) and obj.tid == tid:
+                return
+
+        version = (snapshot[0], snapshot[1].get(tid, 0))
+
+        with self.lock:
+            if version == (self.epoch, self.versions.get(tid, 0)):
+                return version
+
+    def get_values(self, session, tid, load=True):
+        """
+        Return the values of the variables of the configuration of a tenant
+
+        :param session: An ORM session
+        :param tid: A tenant ID
+        :param load: A boolean to enable the loading of the store if not available
+        :return: A dictionary of the values or None if the transaction could not use the cache
+        """
+        version = self.get_version(session, tid)
+        if version is None:
+            return
+
+        with self.lock:
+            store = self.stores.get(tid)
+            if store is not None and store[0] == version:
+                self.reads_avoided += 1
+                return store[1]
+
+        if not load:
+            return
+
+        values = {var_name: value for var_name, value in session.query(Config.var_name, Config.value).filter(Config.tid == tid) if var_name in ConfigDescriptor}
+
+        with self.lock:
+            if version == (self.epoch, self.versions.get(tid, 0)):
+                self.stores[tid] = (version, values)
+
+        return values
+
+    def get(self, session, tid, resource, language, serialize):
+        """
+        Return the cached serialization of a resource computing it if needed
+
+        :param session: An ORM session
+        :param tid: A tenant ID
+        :param resource: The name of the serialized resource
+        :param language: The language of the serialization
+        :param serialize: A function performing the serialization
+        :return: A copy of the serialization
+        """
+        version = self.get_version(session, tid)
+        if version is None:
+            return serialize()
+
+        key = (tid, resource, language)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+
+        if entry is not None:
+            return copy.deepcopy(entry[1])
+
+        value = serialize()
+
+        with self.lock:
+            self.entries[key] = (version, value)
+
+        return copy.deepcopy(value)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'stores': len(self.stores),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reads_avoided': self.reads_avoided
+            }
+
+
+config_cache = _ConfigCache()
+
+
+@event.listens_for(Session, 'after_begin')
+def snapshot_config_versions(session, transaction, connection):
+    session.info['config_versions'] = config_cache.snapshot()
+
+
+@event.listens_for(Session, 'after_flush')
+def track_config_writes(session, flush_context):
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, config_cache_models):
+            session.info.setdefault('config_tids', set()).add(obj.tid)
+
+            values = session.info.setdefault('config_values', {})
+            if isinstance(obj, Config) and values is not None:
+                values.setdefault(obj.tid, {})[obj.var_name] = _DELETED if obj in session.deleted else obj.value
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_config_bulk_writes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+       orm_execute_state.bind_mapper is not None and \
+       issubclass(orm_execute_state.bind_mapper.class_, config_cache_models):
+        orm_execute_state.session.info.setdefault('config_tids', set()).add(None)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_config_cache(session):
+    snapshot = session.info.pop('config_versions', None)
+    values = session.info.pop('config_values', {})
+
+    tids = session.info.pop('config_tids', None)
+    if tids:
+        config_cache.invalidate(tids, snapshot, values)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_config_values(session, previous_transaction):
+    # The values written within a savepoint rolled back are not known
+    # and the stores of the tenants written are thus reloaded
+    if previous_transaction.nested and 'config_tids' in session.info:
+        session.info['config_values'] = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_config_writes(session):
+    session.info.pop('config_versions', None)
+    session.info.pop('config_values', None)
+    session.info.pop('config_tids', None)
+
+
 def get_default(default):
     if callable(default):
         return default()
@@ -40,6 +284,13 @@ class ConfigFactory(object):
         return self.session.query(Config).filter(Config.tid == self.tid, Config.var_name == var_name).one_or_none()
 
     def get_val(self, var_name):
+        values = config_cache.get_values(self.session, self.tid)
+        if values is not None:
+            if var_name not in values:
+                return get_default(ConfigDescriptor[var_name].default)
+
+            return values[var_name]
+
         v = self.get_cfg(var_name)
         if v is None:
             return get_default(ConfigDescriptor[var_name].default)
@@ -47,11 +298,20 @@ class ConfigFactory(object):
         return v.value
 
     def set_val(self, var_name, value):
+        values = config_cache.get_values(self.session, self.tid)
+        if values is not None and var_name in values and \
+           type(values[var_name]) is type(value) and values[var_name] == value:
+            return
+
         v = self.get_cfg(var_name)
         if v:
             v.set_v(value)
 
     def serialize(self, group):
+        values = config_cache.get_values(self.session, self.tid)
+        if values is not None:
+            return {k: values[k] for k in ConfigFilters[group] if k in values}
+
         return {k: v.value for k, v in self.get_all(group).items()}
 
     def update_defaults(self):
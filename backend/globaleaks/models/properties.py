@@ -2,7 +2,7 @@
 # pylint: disable=unused-import
 import json
 
-from sqlalchemy import Column, CheckConstraint, ForeignKeyConstraint, UniqueConstraint, types
+from sqlalchemy import Column, CheckConstraint, ForeignKeyConstraint, Index, UniqueConstraint, func, types
 from sqlalchemy.schema import ForeignKey
 from sqlalchemy.types import Boolean, DateTime, Integer, LargeBinary, UnicodeText
 
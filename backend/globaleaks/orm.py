@@ -1,34 +1,75 @@
 # -*- coding: utf-8
-import random
+import contextvars
+import itertools
+import queue
+import re
 import time
 import warnings
 import sqlite3
 import threading
 
+from collections import Counter
+
 from sqlalchemy import create_engine, event
 from sqlalchemy.exc import OperationalError, SAWarning
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
 
 from globaleaks.models import AuditLog
+from globaleaks.utils.log import log
 
 
 _ORM_DEBUG = False
 _ORM_DB_URI = 'sqlite:'
 _ORM_THREAD_POOL = None
-_ORM_TRANSACTION_RETRIES = 20
+_ORM_READER_THREAD_POOL = None
+_ORM_COMMIT_OBSERVERS = {}
+_ORM_JOURNAL_MODE = 'WAL'
+_ORM_WAL_AUTOCHECKPOINT = 1000
+_ORM_POOL_SIZE = 16
+_ORM_LOCK_WAIT_THRESHOLD = 0.001
+_ORM_ENGINES = {}
+_ORM_ENGINES_LOCK = threading.Lock()
+_ORM_STATS = {
+    'transactions': 0,
+    'group_commits': 0,
+    'failures': 0,
+    'lock_waits': 0,
+    'lock_wait_time': 0.0
+}
+_ORM_STATS_LOCK = threading.Lock()
+_ORM_PROFILES = {}
+_ORM_N_PLUS_ONE = {}
+_ORM_N_PLUS_ONE_THRESHOLD = 10
+_ORM_QUERY_COUNTERS = []
 
 
 SQLITE_DELETE=9
 SQLITE_FUNCTION=31
 SQLITE_INSERT=18
 SQLITE_READ=20
+SQLITE_SAVEPOINT=32
 SQLITE_SELECT=21
 SQLITE_TRANSACTION=22
 SQLITE_UPDATE=23
 
+# Priorities of the transactions queued for the writer thread
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_ORM_PRIORITY = contextvars.ContextVar('orm_priority', default=PRIORITY_NORMAL)
+
+# Name of the handler or of the job the transactions are attributed to
+_ORM_CALLER = contextvars.ContextVar('orm_caller', default=None)
+
+# Expanded lists of parameters, as the ones of the IN operators, have a single shape
+_ORM_PARAMETERS_LIST_RE = re.compile(r'\?(?:, \?)+')
+
 THREAD_LOCAL = threading.local()
 
 
@@ -43,18 +84,52 @@ def set_db_uri(db_uri):
     global _DB_URI
     _DB_URI = db_uri
 
+    # The pooled connections refer to the previous database
+    dispose_engines()
+
 
 def get_db_uri():
     return _DB_URI
 
 
-def get_engine(db_uri=None, foreign_keys=True, orm_lockdown=True):
+def get_engine(db_uri=None, foreign_keys=True, orm_lockdown=True, mode=None):
+    """
+    Create an engine for the application database
+
+    :param db_uri: The URI of the database
+    :param foreign_keys: A boolean to enable the foreign keys constraints
+    :param orm_lockdown: A boolean to enable the restrictions on the SQL statements
+    :param mode: None for a plain engine, 'writer' or 'reader' for an engine
+                 with a pool of connections respectively for writing and reading
+    :return: The engine
+    """
     if db_uri is None:
         db_uri = get_db_uri()
 
-    engine = create_engine(db_uri, connect_args={'timeout': 30}, echo=_ORM_DEBUG)
+    if mode is None:
+        engine = create_engine(db_uri,
+                               connect_args={'timeout': 30, 'factory': InstrumentedConnection},
+                               echo=_ORM_DEBUG)
+    else:
+        engine = create_engine(db_uri,
+                               connect_args={'timeout': 30,
+                                             'check_same_thread': False,
+                                             'factory': InstrumentedConnection},
+                               poolclass=QueuePool,
+                               pool_size=_ORM_POOL_SIZE,
+                               max_overflow=-1,
+                               echo=_ORM_DEBUG)
 
     def authorizer_callback(action, table, column, sql_location, ignore):
+        if mode == 'reader' and action in [SQLITE_DELETE,
+                                           SQLITE_INSERT,
+                                           SQLITE_UPDATE]:
+            return sqlite3.SQLITE_DENY
+
+        # The savepoints are used by the writer for isolating the transactions committed in group
+        if mode == 'writer' and action == SQLITE_SAVEPOINT:
+            return sqlite3.SQLITE_OK
+
         if action in [SQLITE_DELETE,
                       SQLITE_INSERT,
                       SQLITE_READ,
@@ -73,20 +148,289 @@ def get_engine(db_uri=None, foreign_keys=True, orm_lockdown=True):
     def do_connect(conn, connection_record):
         conn.execute('PRAGMA trusted_schema=OFF')
         conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA journal_mode=%s' % _ORM_JOURNAL_MODE)
+        conn.execute('PRAGMA wal_autocheckpoint=%d' % _ORM_WAL_AUTOCHECKPOINT)
 
         if foreign_keys:
             conn.execute('PRAGMA foreign_keys=ON')
 
+        if mode == 'reader':
+            conn.execute('PRAGMA query_only=ON')
+
+        if mode is not None:
+            # The transactions are begun explicitly on the begin event
+            conn.isolation_level = None
+
         if orm_lockdown:
             conn.set_authorizer(authorizer_callback)
 
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        tracker = getattr(THREAD_LOCAL, 'tracker', None)
+        if tracker is not None:
+            tracker.statement_start = time.monotonic()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        tracker = getattr(THREAD_LOCAL, 'tracker', None)
+        if tracker is not None:
+            tracker.track_statement(statement, cursor.rowcount)
+
+    if mode == 'writer':
+        @event.listens_for(engine, "begin")
+        def do_begin(conn):
+            # The write lock is acquired at the beginning of the transaction so that
+            # the transaction could not fail on the upgrade of a read lock
+            start = time.monotonic()
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            wait = time.monotonic() - start
+
+            if wait >= _ORM_LOCK_WAIT_THRESHOLD:
+                update_stats(lock_waits=1, lock_wait_time=wait)
+
+    elif mode == 'reader':
+        @event.listens_for(engine, "begin")
+        def do_begin(conn):
+            conn.exec_driver_sql('BEGIN')
+
     return engine
 
 
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor counting the rows fetched by the transaction being tracked
+    """
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            track_rows(1)
+
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        track_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        track_rows(len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+
+def get_pooled_engine(mode='writer'):
+    """
+    Return the engine shared by the transactions for the specified mode
+
+    :param mode: 'writer' or 'reader'
+    :return: The engine
+    """
+    with _ORM_ENGINES_LOCK:
+        engine = _ORM_ENGINES.get(mode)
+        if engine is None:
+            engine = _ORM_ENGINES[mode] = get_engine(mode=mode)
+
+        return engine
+
+
+def dispose_engines():
+    with _ORM_ENGINES_LOCK:
+        for engine in _ORM_ENGINES.values():
+            engine.dispose()
+
+        _ORM_ENGINES.clear()
+
+
+def checkpoint(db_uri=None, mode='TRUNCATE'):
+    """
+    Transfer to the database file the transactions recorded in the write-ahead log
+
+    :param db_uri: The URI of the database
+    :param mode: The checkpoint mode: PASSIVE, FULL, RESTART or TRUNCATE
+    :return: A tuple reporting if the checkpoint was blocked, the pages in the log and the pages transferred
+    """
+    engine = get_engine(db_uri, orm_lockdown=False)
+
+    try:
+        with engine.connect() as conn:
+            return tuple(conn.exec_driver_sql('PRAGMA wal_checkpoint(%s)' % mode).fetchone())
+    finally:
+        engine.dispose()
+
+
+def set_journal_mode(journal_mode):
+    global _ORM_JOURNAL_MODE
+    _ORM_JOURNAL_MODE = journal_mode
+    dispose_engines()
+
+
+def update_stats(**kwargs):
+    with _ORM_STATS_LOCK:
+        for key, value in kwargs.items():
+            _ORM_STATS[key] += value
+
+
+def get_stats():
+    """
+    Return the counters of the transactions, of their failures and of the waits on the write lock
+    """
+    with _ORM_STATS_LOCK:
+        return dict(_ORM_STATS)
+
+
+def track_rows(rows):
+    tracker = getattr(THREAD_LOCAL, 'tracker', None)
+    if tracker is not None:
+        tracker.rows += rows
+
+
+class QueryTracker(object):
+    """
+    Tracker of the statements, of the rows and of the time of a transaction
+    """
+    def __init__(self, caller, transaction):
+        self.caller = caller
+        self.transaction = transaction
+        self.statements = 0
+        self.rows = 0
+        self.query_time = 0.0
+        self.shapes = Counter()
+        self.start = time.monotonic()
+        self.statement_start = self.start
+
+    def track_statement(self, statement, rowcount):
+        if statement.startswith(('BEGIN', 'SAVEPOINT', 'RELEASE', 'ROLLBACK')):
+            return
+
+        self.statements += 1
+        self.query_time += time.monotonic() - self.statement_start
+        self.shapes[_ORM_PARAMETERS_LIST_RE.sub('?', statement)] += 1
+
+        # The rows of the SELECT statements are counted while fetched
+        if rowcount > 0:
+            self.rows += rowcount
+
+    def close(self):
+        """
+        Account the transaction in the profile of the caller and report
+        the statements repeated enough times to be likely N+1 queries
+        """
+        elapsed = time.monotonic() - self.start
+        key = (self.caller, self.transaction)
+
+        with _ORM_STATS_LOCK:
+            profile = _ORM_PROFILES.get(key)
+            if profile is None:
+                profile = _ORM_PROFILES[key] = {
+                    'caller': self.caller,
+                    'transaction': self.transaction,
+                    'count': 0,
+                    'statements': 0,
+                    'max_statements': 0,
+                    'rows': 0,
+                    'time': 0.0,
+                    'query_time': 0.0
+                }
+
+            profile['count'] += 1
+            profile['statements'] += self.statements
+            profile['max_statements'] = max(profile['max_statements'], self.statements)
+            profile['rows'] += self.rows
+            profile['time'] += elapsed
+            profile['query_time'] += self.query_time
+
+            for statement, executions in self.shapes.items():
+                if executions < _ORM_N_PLUS_ONE_THRESHOLD:
+                    continue
+
+                entry = _ORM_N_PLUS_ONE.get(key + (statement,))
+                if entry is None:
+                    entry = _ORM_N_PLUS_ONE[key + (statement,)] = {
+                        'caller': self.caller,
+                        'transaction': self.transaction,
+                        'statement': statement,
+                        'count': 0,
+                        'max_executions': 0
+                    }
+
+                entry['count'] += 1
+                entry['max_executions'] = max(entry['max_executions'], executions)
+
+            for counter in _ORM_QUERY_COUNTERS:
+                counter.track(self)
+
+
+def get_query_stats():
+    """
+    Return the profiles of the transactions of every handler and job and
+    the statements detected as likely N+1 queries
+    """
+    with _ORM_STATS_LOCK:
+        return {
+            'transactions': sorted((dict(x) for x in _ORM_PROFILES.values()), key=lambda x: -x['time']),
+            'n_plus_one': sorted((dict(x) for x in _ORM_N_PLUS_ONE.values()), key=lambda x: -x['max_executions'])
+        }
+
+
+class max_queries(object):
+    """
+    Context manager failing when the transactions executed within it
+    issue more than the specified number of statements
+
+    :param limit: The maximum number of statements
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.statements = 0
+        self.transactions = []
+
+    def track(self, tracker):
+        self.statements += tracker.statements
+        self.transactions.append((tracker.transaction, tracker.statements))
+
+    def __enter__(self):
+        with _ORM_STATS_LOCK:
+            _ORM_QUERY_COUNTERS.append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with _ORM_STATS_LOCK:
+            _ORM_QUERY_COUNTERS.remove(self)
+
+        if exc_type is None and self.statements > self.limit:
+            raise AssertionError('%d statements issued while at most %d were expected: %s' %
+                                 (self.statements, self.limit, self.transactions))
+
+
 def get_session(db_uri=None, foreign_keys=True):
     return sessionmaker(bind=get_engine(db_uri, foreign_keys))()
 
 
+def get_thread_session(mode='writer'):
+    """
+    Return the session of the current thread bound to the pooled engine of the specified mode
+
+    :param mode: 'writer' or 'reader'
+    :return: The session
+    """
+    engine = get_pooled_engine(mode)
+
+    sessions = getattr(THREAD_LOCAL, 'sessions', None)
+    if sessions is None:
+        sessions = THREAD_LOCAL.sessions = {}
+
+    session = sessions.get(mode)
+    if session is None or session.bind is not engine:
+        session = sessions[mode] = sessionmaker(bind=engine)()
+
+    return session
+
 
 def enable_orm_debug():
     global _ORM_DEBUG
@@ -102,6 +446,258 @@ def get_thread_pool():
     return _ORM_THREAD_POOL
 
 
+def set_reader_thread_pool(thread_pool):
+    global _ORM_READER_THREAD_POOL
+    _ORM_READER_THREAD_POOL = thread_pool
+
+
+def get_reader_thread_pool():
+    return _ORM_READER_THREAD_POOL if _ORM_READER_THREAD_POOL is not None else _ORM_THREAD_POOL
+
+
+def run_with_priority(priority, f, *args, **kwargs):
+    """
+    Invoke a function queuing with the specified priority the transactions it issues
+
+    The priority is kept by the inlineCallbacks generators started by the function.
+
+    :param priority: The priority of the transactions
+    :param f: The function to be invoked
+    :return: The result of the function
+    """
+    def wrapper():
+        _ORM_PRIORITY.set(priority)
+        return f(*args, **kwargs)
+
+    return contextvars.copy_context().run(wrapper)
+
+
+def run_with_caller(caller, f, *args, **kwargs):
+    """
+    Invoke a function attributing to the specified caller the transactions it issues
+
+    :param caller: The name of the handler or of the job
+    :param f: The function to be invoked
+    :return: The result of the function
+    """
+    def wrapper():
+        _ORM_CALLER.set(caller)
+        return f(*args, **kwargs)
+
+    return contextvars.copy_context().run(wrapper)
+
+
+class TransactionQueue(object):
+    """
+    Queue serializing the transactions in a single writer thread
+
+    The transactions are executed in order of priority and, with the same
+    priority, in order of submission; being the writer the only thread
+    writing the database, the transactions never wait for the lock.
+
+    When group_commit is greater than one, up to group_commit transactions
+    found in the queue are executed in a single database transaction, each
+    one within a savepoint, and committed together with a single sync of
+    the database.
+
+    The queue exposes the interface of twisted.python.threadpool.ThreadPool
+    used by deferToThreadPool.
+    """
+    def __init__(self, group_commit=0):
+        self.group_commit = group_commit
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name='orm-writer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            # The queued transactions are executed before stopping
+            self.queue.put((float('inf'), next(self.counter), None, None, None, None))
+            self.thread.join()
+            self.thread = None
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        self.queue.put((_ORM_PRIORITY.get(), next(self.counter), onResult, func, args, kw))
+
+    def call(self, func, *args, **kw):
+        """
+        Execute a function in the writer thread waiting for its result
+
+        The function is executed directly when the writer thread is not
+        running or when the caller is the writer thread itself.
+
+        :param func: The function to be executed
+        :return: The result of the function
+        """
+        if self.thread is None or self.thread is threading.current_thread():
+            return func(*args, **kw)
+
+        done = threading.Event()
+        result = []
+
+        def onResult(success, value):
+            result.extend((success, value))
+            done.set()
+
+        self.callInThreadWithCallback(onResult, func, *args, **kw)
+
+        done.wait()
+
+        if not result[0]:
+            result[1].raiseException()
+
+        return result[1]
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item[3] is None:
+                break
+
+            batch = [item]
+            while len(batch) < self.group_commit:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if item[3] is None:
+                    self.queue.put(item)
+                    break
+
+                batch.append(item)
+
+            if len(batch) == 1:
+                self.execute(*batch[0][2:])
+            else:
+                self.execute_group(batch)
+
+    def execute(self, onResult, func, args, kw):
+        try:
+            result = func(*args, **kw)
+        except:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+    def execute_group(self, batch):
+        session = get_thread_session()
+        results = []
+
+        THREAD_LOCAL.group_commit = True
+
+        try:
+            for _, _, _, func, args, kw in batch:
+                try:
+                    results.append((True, func(*args, **kw)))
+                except:
+                    results.append((False, Failure()))
+        finally:
+            THREAD_LOCAL.group_commit = False
+
+        try:
+            session.commit()
+            update_stats(group_commits=1)
+        except:
+            session.rollback()
+            results = [(False, Failure())] * len(batch)
+        finally:
+            session.close()
+
+        for item, result in zip(batch, results):
+            item[2](*result)
+
+
+def add_commit_observer(observer, model_classes):
+    """
+    Register a callable to be invoked in the reactor thread every time
+    a transaction inserting objects of the specified models is committed
+
+    :param observer: A callable without arguments
+    :param model_classes: The models whose insertions are observed
+    """
+    _ORM_COMMIT_OBSERVERS[observer] = frozenset(model_classes)
+
+
+def remove_commit_observer(observer):
+    _ORM_COMMIT_OBSERVERS.pop(observer, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def track_inserts(session, flush_context):
+    if _ORM_COMMIT_OBSERVERS and session.new:
+        session.info.setdefault('inserted', set()).update(type(obj) for obj in session.new)
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_commit_observers(session):
+    inserted = session.info.pop('inserted', None)
+    if not inserted:
+        return
+
+    for observer, model_classes in list(_ORM_COMMIT_OBSERVERS.items()):
+        if not inserted.isdisjoint(model_classes):
+            reactor.callFromThread(observer)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_inserts(session):
+    session.info.pop('inserted', None)
+    session.info.pop('after_commit', None)
+
+
+class _Committed(object):
+    """
+    Result of a transaction that registered callables to be invoked after its commit
+    """
+    __slots__ = ('result', 'callbacks')
+
+    def __init__(self, result, callbacks):
+        self.result = result
+        self.callbacks = callbacks
+
+
+def _with_callbacks(result, callbacks):
+    return _Committed(result, callbacks) if callbacks else result
+
+
+def run_after_commit(result):
+    """
+    Invoke in the reactor thread the callables registered by a committed
+    transaction, returning its result once all of them have completed
+    """
+    if not isinstance(result, _Committed):
+        return result
+
+    def log_failures(outcomes):
+        for success, value in outcomes:
+            if not success:
+                log.exception(value)
+
+        return result.result
+
+    d = defer.DeferredList([defer.maybeDeferred(f, *args, **kwargs) for f, args, kwargs in result.callbacks],
+                           consumeErrors=True)
+
+    return d.addCallback(log_failures)
+
+
+def db_after_commit(session, f, *args, **kwargs):
+    """
+    Register a callable to be invoked in the reactor thread after the commit
+    of the current transaction; the callable is discarded on rollback.
+
+    This is intended for the expensive operations, like the PGP encryption,
+    that should not be executed while holding the write lock.
+    """
+    session.info.setdefault('after_commit', []).append((f, args, kwargs))
+
+
 def db_add(session, model_class, model_fields):
     obj = model_class(model_fields)
     session.add(obj)
@@ -155,7 +751,10 @@ class transact(object):
         return self
 
     def __call__(self, *args, **kwargs):
-        return self.run(self._wrap, self.method, *args, **kwargs)
+        return self.finish(self.run(self._track, _ORM_CALLER.get(), self.method, *args, **kwargs))
+
+    def finish(self, d):
+        return d.addCallback(run_after_commit)
 
     def run(self, function, *args, **kwargs):
         return deferToThreadPool(reactor,
@@ -164,53 +763,133 @@ class transact(object):
                                  *args,
                                  **kwargs)
 
+    def _track(self, caller, function, *args, **kwargs):
+        """
+        Execute the transaction tracking the statements it issues
+        """
+        previous = getattr(THREAD_LOCAL, 'tracker', None)
+        tracker = THREAD_LOCAL.tracker = QueryTracker(caller, '%s.%s' % (function.__module__, function.__qualname__))
+
+        try:
+            return self._wrap(function, *args, **kwargs)
+        finally:
+            THREAD_LOCAL.tracker = previous
+            tracker.close()
+
     def _wrap(self, function, *args, **kwargs):
         """
         Wrap provided function calling it inside a thread and
         passing the ORM session to it.
         """
-        global THREAD_LOCAL
-        session = getattr(THREAD_LOCAL, 'session', None)
-        if not session:
-            session = THREAD_LOCAL.session = get_session()
+        session = get_thread_session()
 
-        retries = 0
+        if getattr(THREAD_LOCAL, 'group_commit', False):
+            return self._wrap_in_group(session, function, *args, **kwargs)
 
         try:
-            while True:
-                try:
-                    if self.instance:
-                        result = function(self.instance, session, *args, **kwargs)
-                    else:
-                        result = function(session, *args, **kwargs)
+            if self.instance:
+                result = function(self.instance, session, *args, **kwargs)
+            else:
+                result = function(session, *args, **kwargs)
+
+            session.commit()
+        except OperationalError as e:
+            session.rollback()
+
+            if "database is locked" in str(e):
+                update_stats(failures=1)
+
+            raise
+        except:
+            session.rollback()
+            raise
+        else:
+            update_stats(transactions=1)
+            return _with_callbacks(result, session.info.pop('after_commit', None))
+        finally:
+            session.close()
+
+    def _wrap_in_group(self, session, function, *args, **kwargs):
+        """
+        Execute the transaction within a savepoint of the group being
+        executed by the writer thread, that is responsible of the commit
+        """
+        savepoint = session.begin_nested()
 
-                    session.commit()
-                except OperationalError as e:
-                    session.rollback()
+        try:
+            if self.instance:
+                result = function(self.instance, session, *args, **kwargs)
+            else:
+                result = function(session, *args, **kwargs)
+
+            session.flush()
+        except:
+            savepoint.rollback()
+            session.info.pop('after_commit', None)
+            raise
+        else:
+            savepoint.commit()
+            update_stats(transactions=1)
+            return _with_callbacks(result, session.info.pop('after_commit', None))
 
-                    if "database is locked" not in str(e):
-                        raise
 
-                    retries += 1
+class transact_ro(transact):
+    """
+    Class decorator for managing read-only transactions.
 
-                    if retries >= _ORM_TRANSACTION_RETRIES:
-                        raise Exception("Transaction failed with too many retries")
+    The transactions are executed by a dedicated thread pool on the
+    connections of the reader pool, that refuse any write, and they
+    are never committed.
+    """
+    def run(self, function, *args, **kwargs):
+        return deferToThreadPool(reactor,
+                                 get_reader_thread_pool(),
+                                 function,
+                                 *args,
+                                 **kwargs)
 
-                    time.sleep(0.2 * random.uniform(1, 2 ** retries))
-                except:
-                    session.rollback()
-                    raise
-                else:
-                    return result
+    def _wrap(self, function, *args, **kwargs):
+        session = get_thread_session('reader')
+
+        try:
+            if self.instance:
+                return function(self.instance, session, *args, **kwargs)
+            else:
+                return function(session, *args, **kwargs)
         finally:
             session.close()
 
 
 class transact_sync(transact):
+    """
+    Class decorator for managing transactions executed synchronously.
+
+    The transactions are executed by the writer thread, when running,
+    and the caller is blocked until their completion; the callables
+    registered for the commit are scheduled in the reactor thread.
+    """
+    def finish(self, result):
+        if not isinstance(result, _Committed):
+            return result
+
+        for f, args, kwargs in result.callbacks:
+            reactor.callFromThread(f, *args, **kwargs)
+
+        return result.result
+
     def run(self, function, *args, **kwargs):
+        thread_pool = get_thread_pool()
+        if isinstance(thread_pool, TransactionQueue):
+            return thread_pool.call(function, *args, **kwargs)
+
         return function(*args, **kwargs)
 
 
 @transact
 def tw(session, f, *args, **kwargs):
     return f(session, *args, **kwargs)
+
+
+@transact_ro
+def tr(session, f, *args, **kwargs):
+    return f(session, *args, **kwargs)
@@ -37,6 +37,7 @@ from globaleaks.handlers import admin, \
                                 wizard, \
                                 whistleblower
 
+from globaleaks.orm import run_with_caller
 from globaleaks.rest import decorators, requests, errors
 from globaleaks.state import State, extract_exception_traceback_and_schedule_email
 from globaleaks.utils.json import JSONEncoder
@@ -69,6 +70,7 @@ api_spec = [
     # Receiver Handlers
     (r'/api/recipient/operations', recipient.Operations),
     (r'/api/recipient/rtips', recipient.TipsCollection),
+    (r'/api/recipient/rtips/export', recipient.export.BulkExportHandler),
     (r'/api/recipient/rtips/' + uuid_regexp, recipient.rtip.RTipInstance),
     (r'/api/recipient/rtips/' + uuid_regexp + r'/comments', recipient.rtip.RTipCommentCollection),
     (r'/api/recipient/rtips/' + uuid_regexp + r'/iars', recipient.rtip.IdentityAccessRequestsCollection),
@@ -114,6 +116,8 @@ api_spec = [
     (r'/api/admin/auditlog/access', admin.auditlog.AccessLog),
     (r'/api/admin/auditlog/debug', admin.auditlog.DebugLog),
     (r'/api/admin/auditlog/jobs', admin.auditlog.JobsTiming),
+    (r'/api/admin/auditlog/queries', admin.auditlog.QueriesProfile),
+    (r'/api/admin/auditlog/stats', admin.auditlog.Stats),
     (r'/api/admin/auditlog/tips', admin.auditlog.TipsCollection),
     (r'/api/admin/l10n/(' + '|'.join(LANGUAGES_SUPPORTED_CODES) + ')', admin.l10n.AdminL10NHandler),
     (r'/api/admin/config', admin.operation.AdminOperationHandler),
@@ -457,7 +461,11 @@ class APIResourceWrapper(Resource):
 
             request.finish()
 
-        d = defer.maybeDeferred(f, self.handler, *groups).addCallbacks(concludeHandlerSuccess, concludeHandlerFailure)
+        # The transactions of the request are attributed to the handler method
+        caller = '%s.%s.%s' % (handler.__module__, handler.__name__, method)
+
+        d = defer.maybeDeferred(run_with_caller, caller, f, self.handler, *groups)
+        d.addCallbacks(concludeHandlerSuccess, concludeHandlerFailure)
 
         def _finish(_ret):
             request.finished = True
@@ -173,6 +173,10 @@ OpsDesc = {
     'args': dict,
 }
 
+TipsExportDesc = {
+    'rtips': [uuid_regexp]
+}
+
 TipOpsDesc = {
     'operation': tip_operation_regexp,
     'args': dict
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from globaleaks.settings import Settings
-from globaleaks.utils.crypto import generateRandomKey
+from globaleaks.utils.crypto import generateRandomKey, GCE
+from globaleaks.utils.lrucache import LRUCache
 from globaleaks.utils.tempdict import TempDict
 from globaleaks.utils.utility import datetime_now, uuid4
 
@@ -19,11 +20,30 @@ class Session(object):
         self.ratelimit_time = datetime_now()
         self.ratelimit_count = 0
         self.files = []
+        self.tip_keys = LRUCache(Settings.session_tip_keys_cache_size)
         self.expireCall = None
 
+    def expireCallback(self):
+        self.tip_keys.clear()
+
     def getTime(self):
         return self.expireCall.getTime() if self.expireCall else 0
 
+    def get_tip_key(self, itip_id, crypto_tip_prv_key):
+        """
+        Return the decrypted key of a tip caching it for the session lifetime
+
+        :param itip_id: The ID of the tip
+        :param crypto_tip_prv_key: The key of the tip encrypted for the user
+        :return: The decrypted key of the tip
+        """
+        tip_key = self.tip_keys.get(itip_id)
+        if tip_key is None:
+            tip_key = GCE.asymmetric_decrypt(self.cc, crypto_tip_prv_key)
+            self.tip_keys.set(itip_id, tip_key)
+
+        return tip_key
+
     def has_permission(self, permission):
         return self.permissions.get(permission, False)
 
@@ -53,6 +73,28 @@ class SessionsFactory(TempDict):
         self[session.id] = session
         return session
 
+    def revoke_tip_key(self, user_id, itip_id):
+        for session in list(self.values()):
+            if session.user_id == user_id:
+                session.tip_keys.pop(itip_id)
+
+    def revoke_tip_keys(self, itip_ids):
+        for session in list(self.values()):
+            for itip_id in itip_ids:
+                session.tip_keys.pop(itip_id)
+
+    def get_tip_keys_stats(self):
+        stats = {'sessions': 0, 'entries': 0, 'hits': 0, 'misses': 0}
+
+        for session in list(self.values()):
+            x = session.tip_keys.get_stats()
+            stats['sessions'] += 1
+            stats['entries'] += x['entries']
+            stats['hits'] += x['hits']
+            stats['misses'] += x['misses']
+
+        return stats
+
     def regenerate(self, session_id):
         session = self.pop(session_id)
         session.id = generateRandomKey()
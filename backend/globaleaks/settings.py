@@ -40,9 +40,39 @@ class SettingsClass(object, metaclass=Singleton):
 
         self.ramdisk_path = '/dev/shm/globaleaks'
         self.working_path = '/var/globaleaks'
+        self.changelog_path = '/usr/share/globaleaks/CHANGELOG'
+        self.license_path = '/usr/share/globaleaks/LICENSE'
 
         self.authentication_lifetime = 1800
 
+        # Memory available to the concurrent Argon2 computations; with the
+        # 128MB required by each computation 512MB allow 4 of them in parallel
+        self.argon2_memory_budget = 1 << 29
+
+        # Maximum number of decrypted tip keys cached by each session
+        self.session_tip_keys_cache_size = 5000
+
+        # Maximum number of PGP keys kept imported in GnuPG homes on the ramdisk
+        self.pgp_contexts_cache_size = 1000
+
+        # Re-encrypt with the symmetric format the tips opened by their users
+        self.tip_encryption_upgrade = True
+
+        # Number of threads decrypting in advance the files of a bulk export
+        self.export_decryption_threads = 4
+
+        # Maximum number of files encrypted in parallel by the delivery job
+        self.delivery_threads = 4
+
+        # Maximum number of threads reading and encrypting the files being downloaded
+        self.download_threads = 16
+
+        # Maximum number of queued transactions committed together by the ORM writer (0 disables the group commit)
+        self.orm_group_commit = 0
+
+        # Deflate level used for the exports; 0 disables the compression
+        self.export_compression_level = 6
+
         self.accept_submissions = True
 
         # statistical, referred to latest period
@@ -82,7 +112,12 @@ class SettingsClass(object, metaclass=Singleton):
         self.enable_input_length_checks = True
 
         self.mail_timeout = 15  # seconds
-        self.mail_attempts_limit = 3  # per mail limit
+        self.mail_attempts_limit = 10  # per mail limit
+        self.mail_retry_delay = 60  # seconds; doubled at every failed attempt
+
+        # Maximum number of connections and of mails sent every minute for each SMTP server
+        self.smtp_concurrency = 4
+        self.smtp_rate_limit = 120  # 0 disables the limit
 
         self.acme_directory_url = 'https://acme-v02.api.letsencrypt.org/directory'
 
@@ -94,6 +129,7 @@ class SettingsClass(object, metaclass=Singleton):
         self.files_path = os.path.abspath(os.path.join(self.working_path, 'files'))
         self.attachments_path = os.path.abspath(os.path.join(self.working_path, 'attachments'))
         self.tmp_path = os.path.abspath(os.path.join(self.working_path, 'tmp'))
+        self.pgp_path = os.path.abspath(os.path.join(self.ramdisk_path, 'gnupg'))
         self.tor_control = os.path.abspath(os.path.join(self.tmp_path, 'tor_control'))
 
         self.db_file_path = os.path.abspath(os.path.join(self.working_path, 'globaleaks.db'))
@@ -139,6 +175,9 @@ class SettingsClass(object, metaclass=Singleton):
         if options.orm_debug:
             enable_orm_debug()
 
+        if options.argon2_memory_budget:
+            self.argon2_memory_budget = options.argon2_memory_budget << 20
+
         if options.working_path:
             self.working_path = options.working_path
 
@@ -14,16 +14,19 @@ from twisted.python.threadpool import ThreadPool
 from twisted.web.client import ResponseNeverReceived
 
 from globaleaks import __version__, orm
+from globaleaks.models.config import config_cache
 from globaleaks.orm import tw
 from globaleaks.rest import errors
 from globaleaks.settings import Settings
 from globaleaks.transactions import db_schedule_email
+from globaleaks.utils import producer
 from globaleaks.utils.agent import get_tor_agent, get_web_agent
-from globaleaks.utils.crypto import sha256, totpVerify
+from globaleaks.utils.crypto import argon2_pool, sha256, totpVerify
+from globaleaks.utils.fs import read_file
 from globaleaks.utils.log import log
 from globaleaks.utils.mail import sendmail
 from globaleaks.utils.objectdict import ObjectDict
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.pgp import get_pgp_context, pgp_contexts
 from globaleaks.utils.singleton import Singleton
 from globaleaks.utils.sni import SNIMap
 from globaleaks.utils.sock import reserve_tcp_socket
@@ -52,6 +55,13 @@ class TenantState(object):
     def __init__(self):
         self.cache = ObjectDict()
 
+        # Version of the configuration from which the cache has been built
+        self.config_version = None
+
+        # Whether reports with a receipt hashed with the legacy scheme could
+        # still exist; None until checked on the first failed receipt login
+        self.legacy_receipt_hashes = None
+
         # An ACME challenge will have 5 minutes to resolve
         self.acme_tmp_chall_dict = TempDict(300)
 
@@ -89,6 +99,10 @@ class StateClass(ObjectDict, metaclass=Singleton):
 
         self.accept_submissions = True
 
+        # Static files served within the node configuration loaded at startup
+        self.changelog = ''
+        self.license = ''
+
         self.tenants = {}
 
         self.tenant_uuid_id_map = {}
@@ -96,13 +110,25 @@ class StateClass(ObjectDict, metaclass=Singleton):
         self.tenant_subdomain_id_map = {}
 
         self.orm_tp = None
-        self.set_orm_tp(ThreadPool(4, 16))
+        self.set_orm_tp(orm.TransactionQueue(self.settings.orm_group_commit))
+
+        self.orm_ro_tp = None
+        self.set_orm_ro_tp(ThreadPool(4, 16, 'orm-ro'))
+
+        self.delivery_tp = ThreadPool(1, self.settings.delivery_threads, 'delivery')
+
+        self.download_tp = None
+        self.set_download_tp(ThreadPool(1, self.settings.download_threads, 'download'))
 
         self.tokens = TokenList(60)
         self.TempKeys = TempDict(3600 * 72)
         self.TwoFactorTokens = TempDict(120)
         self.TempUploadFiles = TempDict(3600)
 
+        # The keys of the tips whose contents are to be re-encrypted with
+        # the symmetric format by the TipEncryptionUpgrade job
+        self.TipEncryptionUpgrades = {}
+
         self.shutdown = False
 
     def init_environment(self):
@@ -110,10 +136,28 @@ class StateClass(ObjectDict, metaclass=Singleton):
         self.settings.eval_paths()
         self.create_directories()
 
+        pgp_contexts.path = self.settings.pgp_path
+        pgp_contexts.size = self.settings.pgp_contexts_cache_size
+
+        argon2_pool.memory_budget = self.settings.argon2_memory_budget
+
+        config_cache.clear()
+
+        self.changelog = read_file(self.settings.changelog_path)
+        self.license = read_file(self.settings.license_path)
+
     def set_orm_tp(self, orm_tp):
         self.orm_tp = orm_tp
         orm.set_thread_pool(orm_tp)
 
+    def set_orm_ro_tp(self, orm_ro_tp):
+        self.orm_ro_tp = orm_ro_tp
+        orm.set_reader_thread_pool(orm_ro_tp)
+
+    def set_download_tp(self, download_tp):
+        self.download_tp = download_tp
+        producer.set_thread_pool(download_tp)
+
     def get_agent(self):
         if 1 not in self.tenants or self.tenants[1].cache.anonymize_outgoing_connections:
             return get_tor_agent(self.settings.socks_port)
@@ -147,6 +191,7 @@ class StateClass(ObjectDict, metaclass=Singleton):
                         self.settings.files_path,
                         self.settings.attachments_path,
                         self.settings.ramdisk_path,
+                        self.settings.pgp_path,
                         self.settings.tmp_path,
                         self.settings.log_path]:
             self.create_directory(dirpath)
@@ -207,7 +252,10 @@ class StateClass(ObjectDict, metaclass=Singleton):
                         self.tenants[tid].cache.name + ' - ' + subject,
                         body,
                         self.tenants[1].cache.anonymize_outgoing_connections,
-                        self.settings.socks_port)
+                        self.settings.socks_port,
+                        self.settings.smtp_concurrency,
+                        self.settings.smtp_rate_limit,
+                        self.settings.mail_timeout)
 
     def schedule_support_email(self, tid, text):
         subject = "Support request"
@@ -221,7 +269,7 @@ class StateClass(ObjectDict, metaclass=Singleton):
             # unencrypted if one address in the list does not have a public key set.
             if pgp_key_public:
                 try:
-                    body = PGPContext(pgp_key_public).encrypt_message(mail_body)
+                    body = get_pgp_context(pgp_key_public).encrypt_message(body)
                 except:
                     continue
 
@@ -267,7 +315,7 @@ class StateClass(ObjectDict, metaclass=Singleton):
             # Opportunisticly encrypt the mail body. NOTE that mails will go out
             # unencrypted if one address in the list does not have a public key set.
             if pgp_key_public:
-                mail_body = PGPContext(pgp_key_public).encrypt_message(mail_body)
+                mail_body = get_pgp_context(pgp_key_public).encrypt_message(mail_body)
 
             # avoid waiting for the notification to send and instead rely on threads to handle it
             tw(db_schedule_email, 1, mail_address, mail_subject, mail_body)
@@ -275,7 +323,9 @@ class StateClass(ObjectDict, metaclass=Singleton):
     def format_and_send_mail(self, session, tid, mail_address, template_vars):
         mail_subject, mail_body = Templating().get_mail_subject_and_body(template_vars)
 
-        db_schedule_email(session, tid, mail_address, mail_subject, mail_body)
+        pgp_key_public = template_vars['user']['pgp_key_public'] if 'user' in template_vars else ''
+
+        db_schedule_email(session, tid, mail_address, mail_subject, mail_body, pgp_key_public)
 
     def get_tmp_file_by_name(self, filename):
         for k, v in self.TempUploadFiles.items():
@@ -2,6 +2,7 @@
 from twisted.internet.defer import inlineCallbacks
 
 from globaleaks.handlers.admin import auditlog
+from globaleaks.sessions import Sessions
 from globaleaks.tests import helpers
 
 
@@ -27,3 +28,29 @@ class TestJobsTiming(helpers.TestHandler):
         handler = self.request({}, role='admin')
 
         yield handler.get()
+
+
+class TestStats(helpers.TestHandler):
+    _handler = auditlog.Stats
+
+    @inlineCallbacks
+    def test_get(self):
+        handler = self.request({}, role='admin')
+        response = yield handler.get()
+
+        self.assertEqual(response['argon2']['size'], 4)
+        self.assertEqual(response['tip_keys']['sessions'], len(Sessions))
+
+
+class TestQueriesProfile(helpers.TestHandlerWithPopulatedDB):
+    _handler = auditlog.QueriesProfile
+
+    @inlineCallbacks
+    def test_get(self):
+        yield self.perform_full_submission_actions()
+
+        handler = self.request({}, role='admin')
+        response = yield handler.get()
+
+        self.assertTrue(len(response['transactions']) > 0)
+        self.assertTrue(isinstance(response['n_plus_one'], list))
@@ -4,6 +4,7 @@ from twisted.internet.defer import inlineCallbacks
 from globaleaks import __version__
 from globaleaks import models
 from globaleaks.handlers.admin import node
+from globaleaks.models.config import config_cache, ConfigFactory
 from globaleaks.orm import transact
 from globaleaks.rest.errors import InputValidationError
 from globaleaks.tests import helpers
@@ -65,3 +66,30 @@ class TestNodeInstance(helpers.TestHandlerWithPopulatedDB):
         resp = yield handler.put()
 
         self.assertNotEqual('version', resp['version'])
+
+    @inlineCallbacks
+    def test_serialization_cache(self):
+        @transact
+        def serialize(session):
+            return node.db_admin_serialize_node(session, 1, 'en')
+
+        @transact
+        def update(session, name):
+            ConfigFactory(session, 1).set_val('name', name)
+            return node.db_admin_serialize_node(session, 1, 'en')
+
+        stats = config_cache.get_stats()
+
+        x = yield serialize()
+        x['name'] = 'altered'
+        y = yield serialize()
+        self.assertNotEqual(y['name'], 'altered')
+        self.assertEqual(config_cache.get_stats()['hits'], stats['hits'] + 1)
+
+        # The transaction writing the configuration is not served by the cache
+        y = yield update('new name')
+        self.assertEqual(y['name'], 'new name')
+
+        # The commit invalidates the entries of the tenant
+        y = yield serialize()
+        self.assertEqual(y['name'], 'new name')
@@ -81,6 +81,16 @@ class TestAdminOperations(helpers.TestHandlerWithPopulatedDB):
                                            {'user_id': self.dummyReceiver_1['id'],
                                             'password': 'GlobaLeaks123!'})
 
+    @defer.inlineCallbacks
+    def test_admin_test_set_user_password_out_of_transactions(self):
+        status = helpers.forbid_argon2_in_transactions(self)
+
+        yield self._test_operation_handler('set_user_password',
+                                           {'user_id': self.dummyReceiver_1['id'],
+                                            'password': 'GlobaLeaks123!'})
+
+        self.assertEqual(status['argon2'], 1)
+
     def test_admin_test_smtp_settings(self):
         return self._test_operation_handler('reset_smtp_settings')
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-"""
 from twisted.internet.defer import inlineCallbacks
 
+from globaleaks.db import refresh_tenant_cache
 from globaleaks.handlers.admin import tenant
 from globaleaks.models import config
 from globaleaks.orm import tw
@@ -63,3 +64,24 @@ class TestTenantInstance(helpers.TestHandlerWithPopulatedDB):
 
     def test_delete(self):
         return self.handler.delete(4)
+
+    @inlineCallbacks
+    def test_refresh_tenant_cache(self):
+        yield refresh_tenant_cache()
+
+        cache_3 = self.state.tenants[3].cache
+        old_hostnames = self.state.tenants[2].cache.hostnames
+
+        yield tw(config.db_set_config_variable, 2, 'hostname', 'www.example.net')
+        yield tw(config.db_set_config_variable, 2, 'reachable_via_web', True)
+
+        # The refresh of the root tenant includes the tenants whose configuration changed
+        yield refresh_tenant_cache(1)
+
+        self.assertIs(self.state.tenants[3].cache, cache_3)
+        self.assertEqual(self.state.tenants[2].cache.hostname, 'www.example.net')
+        self.assertEqual(self.state.tenant_hostname_id_map[b'www.example.net'], 2)
+
+        for h in old_hostnames:
+            if h not in self.state.tenants[2].cache.hostnames:
+                self.assertNotIn(h, self.state.tenant_hostname_id_map)
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+from io import BytesIO
+from zipfile import ZipFile
 
 from globaleaks.handlers.recipient import export
 from globaleaks.jobs.delivery import Delivery
+from globaleaks.rest import errors
 from globaleaks.tests import helpers
+from globaleaks.utils.utility import uuid4
 from twisted.internet.defer import inlineCallbacks
 
 
@@ -32,3 +36,44 @@ class TestExportHandler(helpers.TestHandlerWithPopulatedDB):
 
         yield handler.get(rtips_desc[0]['id'])
         self.assertNotEqual(handler.request.getResponseBody(), b'')
+
+
+class TestBulkExportHandler(helpers.TestHandlerWithPopulatedDB):
+    complex_field_population = True
+    pgp_configuration = 'NONE'
+    _handler = export.BulkExportHandler
+
+    @inlineCallbacks
+    def setUp(self):
+        yield helpers.TestHandlerWithPopulatedDB.setUp(self)
+
+        yield self.perform_full_submission_actions()
+
+        yield Delivery().run()
+
+    @inlineCallbacks
+    def test_post(self):
+        rtips_desc = yield self.get_rtips()
+
+        receiver_id = rtips_desc[0]['receiver_id']
+        rtips = [rtip_desc['id'] for rtip_desc in rtips_desc if rtip_desc['receiver_id'] == receiver_id]
+
+        handler = self.request({'rtips': rtips}, role='receiver', user_id=receiver_id)
+
+        yield handler.post()
+
+        with ZipFile(BytesIO(handler.request.getResponseBody()), 'r') as f:
+            self.assertIsNone(f.testzip())
+
+            reports = [x for x in f.namelist() if x.endswith('/report.txt')]
+            self.assertEqual(len(reports), len(rtips))
+
+    def test_post_unknown_tips(self):
+        handler = self.request({'rtips': [uuid4()]}, role='receiver')
+
+        return self.assertFailure(handler.post(), errors.ResourceNotFound)
+
+    def test_post_too_many_tips(self):
+        handler = self.request({'rtips': [uuid4() for _ in range(export.BulkExportHandler.max_tips + 1)]}, role='receiver')
+
+        return self.assertFailure(handler.post(), errors.InputValidationError)
@@ -4,6 +4,7 @@ from twisted.internet.defer import inlineCallbacks
 from globaleaks import models
 from globaleaks.handlers import recipient
 from globaleaks.orm import transact
+from globaleaks.sessions import Sessions
 from globaleaks.tests import helpers
 from globaleaks.utils.utility import datetime_never
 
@@ -29,6 +30,25 @@ class TestTipsCollection(helpers.TestHandlerWithPopulatedDB):
             self.assertEqual(rtips[idx]['file_count'], 2)
             self.assertEqual(rtips[idx]['comment_count'], 3)
 
+    @inlineCallbacks
+    def test_get_caches_tip_keys(self):
+        handler = self.request(user_id=self.dummyReceiver_1['id'], role='receiver')
+        rtips = yield handler.get()
+        self.assertEqual(handler.session.tip_keys.get_stats()['misses'], len(rtips))
+
+        rtips = yield handler.get()
+        self.assertEqual(handler.session.tip_keys.get_stats()['hits'], len(rtips))
+        self.assertEqual(len(handler.session.tip_keys), len(rtips))
+
+        Sessions.revoke_tip_key(self.dummyReceiver_1['id'], rtips[0]['id'])
+        self.assertEqual(len(handler.session.tip_keys), len(rtips) - 1)
+
+        Sessions.revoke_tip_keys([rtips[1]['id']])
+        self.assertEqual(len(handler.session.tip_keys), len(rtips) - 2)
+
+        del Sessions[handler.session.id]
+        self.assertEqual(len(handler.session.tip_keys), 0)
+
 
 class TestOperations(helpers.TestHandlerWithPopulatedDB):
     _handler = recipient.Operations
@@ -40,7 +60,8 @@ class TestOperations(helpers.TestHandlerWithPopulatedDB):
 
     @inlineCallbacks
     def test_put_revoke_and_grant(self):
-        rtips = yield recipient.get_receivertips(1, self.dummyReceiver_1['id'], helpers.USER_PRV_KEY, 'en')
+        user_session = Sessions.new(1, self.dummyReceiver_1['id'], 1, 'receiver', helpers.USER_PRV_KEY)
+        rtips = yield recipient.get_receivertips(1, self.dummyReceiver_1['id'], user_session, 'en')
         rtips_ids = [rtip['id'] for rtip in rtips]
 
         yield self.test_model_count(models.ReceiverTip, 4)
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+import base64
+
 from sqlalchemy.orm.exc import NoResultFound
 from twisted.internet.defer import inlineCallbacks
 
 from globaleaks import models
 from globaleaks.handlers.recipient import rtip
 from globaleaks.jobs.delivery import Delivery
+from globaleaks.jobs.tip_encryption_upgrade import TipEncryptionUpgrade
+from globaleaks.models.config import ConfigFactory
+from globaleaks.orm import transact
 from globaleaks.tests import helpers
+from globaleaks.utils.crypto import GCE
 from globaleaks.utils.utility import datetime_now, datetime_null
 
 
@@ -298,6 +304,55 @@ class TestWhistleblowerFileDownload(helpers.TestHandlerWithPopulatedDB):
                 yield handler.get(wbfile_id)
                 self.assertNotEqual(handler.request.getResponseBody(), '')
 
+    @transact
+    def disable_encryption(self, session):
+        ConfigFactory(session, 1).set_val('encryption', False)
+
+    @transact
+    def change_pgp_key_fingerprints(self, session):
+        for user in session.query(models.User).filter(models.User.pgp_key_public != ''):
+            user.pgp_key_fingerprint = 'A' * 40
+
+    @transact
+    def get_receivers_wbfiles(self, session):
+        return session.query(models.ReceiverTip.receiver_id, models.WhistleblowerFile.id) \
+                      .filter(models.WhistleblowerFile.receivertip_id == models.ReceiverTip.id).all()
+
+    @inlineCallbacks
+    def download_wbfiles(self):
+        ret = []
+
+        for receiver_id, wbfile_id in (yield self.get_receivers_wbfiles()):
+            handler = self.request(role='receiver', user_id=receiver_id)
+            downloads = []
+            handler.write_file_as_download = lambda *args: downloads.append(args)
+            yield handler.get(wbfile_id)
+            ret.extend(downloads)
+
+        return ret
+
+    @inlineCallbacks
+    def test_get_after_pgp_key_change(self):
+        yield self.disable_encryption()
+        yield self.perform_minimal_submission_actions()
+        yield Delivery().run()
+
+        # The copies encrypted on delivery are served as they are
+        downloads = yield self.download_wbfiles()
+        self.assertTrue(downloads)
+
+        for filename, filelocation, pgp_key in downloads:
+            self.assertTrue(filename.endswith('.pgp'))
+            self.assertEqual(pgp_key, '')
+
+        yield self.change_pgp_key_fingerprints()
+
+        # Without a plaintext copy to be encrypted with the new key, the
+        # copies encrypted with the key in use on delivery are served
+        for filename, filelocation, pgp_key in (yield self.download_wbfiles()):
+            self.assertTrue(filename.endswith('.pgp'))
+            self.assertEqual(pgp_key, '')
+
 
 class TestIdentityAccessRequestsCollection(helpers.TestHandlerWithPopulatedDB):
     _handler = rtip.IdentityAccessRequestsCollection
@@ -317,3 +372,48 @@ class TestIdentityAccessRequestsCollection(helpers.TestHandlerWithPopulatedDB):
         for rtip_desc in rtip_descs:
             handler = self.request(body, role='receiver', user_id=rtip_desc['receiver_id'])
             yield handler.post(rtip_desc['id'])
+
+
+class TestTipEncryptionUpgrade(helpers.TestHandlerWithPopulatedDB):
+    _handler = rtip.RTipInstance
+
+    @inlineCallbacks
+    def setUp(self):
+        yield helpers.TestHandlerWithPopulatedDB.setUp(self)
+        yield self.perform_full_submission_actions()
+
+    @transact
+    def count_legacy_comments(self, session):
+        return len([c for c in session.query(models.Comment) if GCE.is_legacy_tip_content(c.content)])
+
+    @transact
+    def set_legacy_comments(self, session):
+        for comment, itip in session.query(models.Comment, models.InternalTip) \
+                                    .filter(models.Comment.internaltip_id == models.InternalTip.id):
+            comment.content = base64.b64encode(GCE.asymmetric_encrypt(itip.crypto_tip_pub_key, 'comment')).decode()
+
+    @inlineCallbacks
+    def test_upgrade(self):
+        # Comments are written directly with the symmetric format
+        count = yield self.count_legacy_comments()
+        self.assertEqual(count, 0)
+
+        yield self.set_legacy_comments()
+        count = yield self.count_legacy_comments()
+        self.assertEqual(count, self.population_of_submissions * (self.population_of_recipients + 1))
+
+        for rtip_desc in (yield self.get_rtips()):
+            handler = self.request(role='receiver', user_id=rtip_desc['receiver_id'])
+            tip = yield handler.get(rtip_desc['id'])
+            self.assertEqual({x['content'] for x in tip['comments']}, {'comment'})
+
+        # The tips are not written by the requests reading them
+        count = yield self.count_legacy_comments()
+        self.assertEqual(count, self.population_of_submissions * (self.population_of_recipients + 1))
+        self.assertEqual(len(self.state.TipEncryptionUpgrades), self.population_of_submissions)
+
+        yield TipEncryptionUpgrade().run()
+
+        count = yield self.count_legacy_comments()
+        self.assertEqual(count, 0)
+        self.assertEqual(self.state.TipEncryptionUpgrades, {})
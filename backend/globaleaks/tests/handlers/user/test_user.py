@@ -197,3 +197,13 @@ class TestUserOperations(helpers.TestHandlerWithPopulatedDB):
         yield self._test_operation_handler('change_password',
                                            {'password': valid_password,
                                             'current': helpers.VALID_PASSWORD1})
+
+    @inlineCallbacks
+    def test_user_test_change_password_out_of_transactions(self):
+        status = helpers.forbid_argon2_in_transactions(self)
+
+        yield self._test_operation_handler('change_password',
+                                           {'password': 'validPassword1!',
+                                            'current': helpers.VALID_PASSWORD1})
+
+        self.assertEqual(status['argon2'], 2)
@@ -33,7 +33,7 @@ from globaleaks.handlers.admin.step import db_create_step
 from globaleaks.handlers.admin.tenant import create as create_tenant
 from globaleaks.handlers.admin.user import create_user
 from globaleaks.handlers.recipient import rtip
-from globaleaks.handlers.wizard import db_wizard
+from globaleaks.handlers.wizard import db_wizard, generate_wizard_credentials
 from globaleaks.handlers.whistleblower import wbtip
 from globaleaks.handlers.whistleblower.submission import create_submission
 from globaleaks.models import serializers
@@ -44,7 +44,7 @@ from globaleaks.sessions import initialize_submission_session, Sessions
 from globaleaks.settings import Settings
 from globaleaks.state import State, TenantState
 from globaleaks.utils import tempdict
-from globaleaks.utils.crypto import generateRandomKey, GCE
+from globaleaks.utils.crypto import argon2_pool, generateRandomKey, GCE
 from globaleaks.utils.securetempfile import SecureTemporaryFile
 from globaleaks.utils.token import Token
 from globaleaks.utils.utility import datetime_now, sum_dicts, uuid4
@@ -133,6 +133,37 @@ class FakeThreadPool(object):
         onResult(success, result)
 
 
+def forbid_argon2_in_transactions(test):
+    """
+    Patch the ORM and the Argon2 pool so that the test fails in case of an
+    Argon2 computation performed while a transaction is open
+
+    :param test: The test case on which to apply the patches
+    :return: A dictionary counting the Argon2 computations performed
+    """
+    status = {'transactions': 0, 'argon2': 0}
+
+    orig_wrap = orm.transact._wrap
+    orig_run = argon2_pool.run
+
+    def _wrap(self, *args, **kwargs):
+        status['transactions'] += 1
+        try:
+            return orig_wrap(self, *args, **kwargs)
+        finally:
+            status['transactions'] -= 1
+
+    def run(*args):
+        status['argon2'] += 1
+        test.assertEqual(status['transactions'], 0)
+        return orig_run(*args)
+
+    test.patch(orm.transact, '_wrap', _wrap)
+    test.patch(argon2_pool, 'run', run)
+
+    return status
+
+
 def init_state():
     Settings.set_devel_mode()
     Settings.disable_notifications = True
@@ -145,6 +176,9 @@ def init_state():
         shutil.rmtree(Settings.working_path)
 
     orm.set_thread_pool(FakeThreadPool())
+    orm.set_reader_thread_pool(FakeThreadPool())
+    State.set_download_tp(FakeThreadPool())
+    State.delivery_tp = FakeThreadPool()
 
     State.settings.enable_api_cache = False
     State.tenants[1] = TenantState()
@@ -537,6 +571,17 @@ def forge_request(uri=b'https://www.globaleaks.org/',
 
     request.notifyFinish = notifyFinish
 
+    def registerProducer(producer, streaming):
+        # Differently from the DummyRequest implementation looping
+        # on resumeProducing, let the producers drive the transfer
+        request.producer = producer
+
+    def unregisterProducer():
+        request.producer = None
+
+    request.registerProducer = registerProducer
+    request.unregisterProducer = unregisterProducer
+
     request.requestHeaders.setRawHeaders('host', [b'127.0.0.1'])
     request.requestHeaders.setRawHeaders('user-agent', [b'NSA Agent'])
 
@@ -825,7 +870,7 @@ class TestGLWithPopulatedDB(TestGL):
         for i in range(1, self.population_of_tenants):
             name = 'tenant-' + str(i+1)
             t = yield create_tenant({'mode': 'default', 'name': name, 'active': True, 'subdomain': name})
-            yield tw(db_wizard, t['id'], '127.0.0.1', self.dummyWizard)
+            yield tw(db_wizard, t['id'], '127.0.0.1', self.dummyWizard, generate_wizard_credentials(self.dummyWizard))
             yield self.set_hostnames(i+1)
 
     @transact
@@ -869,6 +914,7 @@ class TestGLWithPopulatedDB(TestGL):
         for rtip_desc in self.dummyRTips:
             yield rtip.create_comment(1,
                                       rtip_desc['receiver_id'],
+                                      USER_PRV_KEY,
                                       rtip_desc['id'],
                                       'comment')
 
@@ -877,6 +923,7 @@ class TestGLWithPopulatedDB(TestGL):
         for wbtip_desc in self.dummyWBTips:
             yield wbtip.create_comment(1,
                                        wbtip_desc['id'],
+                                       USER_PRV_KEY,
                                        'comment')
 
     @inlineCallbacks
@@ -1,14 +1,25 @@
 # -*- coding: utf-8 -*-
+import os
+
 from datetime import timedelta
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
 
-from globaleaks import models
+from globaleaks import models, orm
+from globaleaks.db import db_get_tracked_attachments
+from globaleaks.handlers.admin.node import db_admin_serialize_node
+from globaleaks.handlers.admin.notification import db_get_notification
+from globaleaks.handlers.public import db_get_submission_statuses
+from globaleaks.handlers.user import user_serialize_user
 from globaleaks.jobs.delivery import Delivery
-from globaleaks.jobs.notification import Notification
-from globaleaks.orm import transact
+from globaleaks.jobs.notification import MailGenerator, Notification
+from globaleaks.models import serializers
+from globaleaks.models.config import ConfigFactory, ConfigL10NFactory
+from globaleaks.orm import transact, tw
 from globaleaks.state import State
 from globaleaks.tests import helpers
-from globaleaks.utils.utility import datetime_now, datetime_null
+from globaleaks.utils.pgp import PGPContext, get_pgp_copy_name
+from globaleaks.utils.templating import Templating
+from globaleaks.utils.utility import datetime_never, datetime_now, datetime_null
 
 @transact
 def simulate_unread_tips(session):
@@ -31,6 +42,132 @@ def simulate_reminders(session):
         itip.reminder_date = datetime_now() - timedelta(1)
 
 
+@transact
+def disable_encryption(session):
+    ConfigFactory(session, 1).set_val('encryption', False)
+
+
+@transact
+def get_delivered_files(session):
+    return [(wbfile.id, wbfile.internalfile_id, user.pgp_key_public, user.pgp_key_fingerprint)
+            for wbfile, user in session.query(models.WhistleblowerFile, models.User) \
+                                       .filter(models.WhistleblowerFile.receivertip_id == models.ReceiverTip.id,
+                                               models.ReceiverTip.receiver_id == models.User.id)]
+
+
+@transact
+def set_tip_mail_template(session, template):
+    ConfigL10NFactory(session, 1).set_val('tip_mail_template', 'en', template)
+
+
+@transact
+def get_expected_tip_mails(session):
+    ret = []
+
+    for user, rtip, itip in session.query(models.User, models.ReceiverTip, models.InternalTip) \
+                                   .filter(models.User.id == models.ReceiverTip.receiver_id,
+                                           models.InternalTip.id == models.ReceiverTip.internaltip_id):
+        data = {
+            'type': 'tip',
+            'user': user_serialize_user(session, user, 'en'),
+            'tip': serializers.serialize_rtip(session, itip, rtip, 'en'),
+            'node': db_admin_serialize_node(session, 1, 'en'),
+            'notification': db_get_notification(session, 1, 'en'),
+            'submission_statuses': db_get_submission_statuses(session, 1, 'en')
+        }
+
+        ret.append((user.mail_address, Templating().get_mail_subject_and_body(data)))
+
+    return sorted(ret)
+
+
+@transact
+def get_spooled_mails(session):
+    return sorted((mail.address, (mail.subject, mail.body)) for mail in session.query(models.Mail))
+
+
+@transact
+def add_mails(session, addresses):
+    for address in addresses:
+        session.add(models.Mail({'address': address, 'subject': 'subject', 'body': 'body'}))
+
+
+@transact
+def get_mails(session):
+    return {mail.address: (mail.attempts, mail.next_attempt) for mail in session.query(models.Mail)}
+
+
+@transact
+def expire_mails_backoff(session, attempts):
+    for mail in session.query(models.Mail):
+        mail.attempts = attempts
+        mail.next_attempt = datetime_now() - timedelta(seconds=1)
+
+
+class TestDelivery(helpers.TestGLWithPopulatedDB):
+    @inlineCallbacks
+    def test_delivery(self):
+        yield self.perform_full_submission_actions()
+
+        delivery = Delivery()
+        delivery.batch_size = 1
+
+        yield delivery.run()
+
+        yield self.test_model_count(models.WhistleblowerFile, 8)
+
+        stats = delivery.get_stats()
+        self.assertEqual(stats['backlog'], 0)
+        self.assertEqual(stats['delivered_files'], 4)
+        self.assertTrue(stats['delivered_bytes'] > 0)
+
+
+class TestDeliveryWithoutEncryption(helpers.TestGLWithPopulatedDB):
+    @inlineCallbacks
+    def test_delivery(self):
+        yield disable_encryption()
+
+        yield self.perform_full_submission_actions()
+
+        yield Delivery().run()
+
+        files = yield get_delivered_files()
+        self.assertEqual(len(files), 8)
+
+        for wbfile_id, ifile_id, pgp_key_public, pgp_key_fingerprint in files:
+            self.assertTrue(pgp_key_public)
+
+            # Each recipient gets a copy encrypted with its PGP key and bound to its fingerprint
+            pgp_copy = get_pgp_copy_name(wbfile_id, pgp_key_fingerprint)
+            self.assertTrue(os.path.exists(os.path.join(self.state.settings.attachments_path, pgp_copy)))
+
+            # No plaintext copy is written as all the recipients have a PGP key
+            self.assertFalse(os.path.exists(os.path.join(self.state.settings.attachments_path, ifile_id)))
+
+        tracked_files = yield tw(db_get_tracked_attachments)
+        for wbfile_id, ifile_id, pgp_key_public, pgp_key_fingerprint in files:
+            self.assertIn(get_pgp_copy_name(wbfile_id, pgp_key_fingerprint), tracked_files)
+
+
+class TestDeliveryWithoutEncryptionAndPGP(helpers.TestGLWithPopulatedDB):
+    pgp_configuration = 'NONE'
+
+    @inlineCallbacks
+    def test_delivery(self):
+        yield disable_encryption()
+
+        yield self.perform_full_submission_actions()
+
+        yield Delivery().run()
+
+        files = yield get_delivered_files()
+        self.assertEqual(len(files), 8)
+
+        for wbfile_id, ifile_id, pgp_key_public, pgp_key_fingerprint in files:
+            self.assertFalse(pgp_key_public)
+            self.assertTrue(os.path.exists(os.path.join(self.state.settings.attachments_path, ifile_id)))
+
+
 class TestNotification(helpers.TestGLWithPopulatedDB):
     @inlineCallbacks
     def test_notification(self):
@@ -97,3 +234,117 @@ class TestNotification(helpers.TestGLWithPopulatedDB):
         yield notification.spool_emails()
 
         yield self.test_model_count(models.Mail, 0)
+
+
+class TestNotificationEncryption(helpers.TestGLWithPopulatedDB):
+    @inlineCallbacks
+    def test_encryption_out_of_transactions(self):
+        status = {'transactions': 0, 'encryptions': 0}
+
+        orig_wrap = orm.transact._wrap
+        orig_encrypt_messages = PGPContext.encrypt_messages
+
+        def _wrap(transaction, *args, **kwargs):
+            status['transactions'] += 1
+            try:
+                return orig_wrap(transaction, *args, **kwargs)
+            finally:
+                status['transactions'] -= 1
+
+        def encrypt_messages(ctx, plaintexts):
+            status['encryptions'] += 1
+            self.assertEqual(status['transactions'], 0)
+            return orig_encrypt_messages(ctx, plaintexts)
+
+        self.patch(orm.transact, '_wrap', _wrap)
+        self.patch(PGPContext, 'encrypt_messages', encrypt_messages)
+
+        yield self.perform_full_submission_actions()
+        yield Delivery().run()
+        yield Notification().generate_emails()
+
+        self.assertTrue(status['encryptions'] > 0)
+        yield self.test_model_count(models.Mail, 4)
+
+    @inlineCallbacks
+    def test_events_kept_on_encryption_failure(self):
+        yield self.perform_full_submission_actions()
+        yield Delivery().run()
+
+        def encrypt_mails(generator):
+            raise Exception('gpg failure')
+
+        patch = self.patch(MailGenerator, 'encrypt_mails', encrypt_mails)
+        yield self.assertFailure(Notification().generate_emails(), Exception)
+        patch.restore()
+
+        yield self.test_model_count(models.Mail, 0)
+
+        # The events are notified by the next run
+        yield Notification().generate_emails()
+        yield self.test_model_count(models.Mail, 4)
+
+
+class TestNotificationTemplates(helpers.TestGLWithPopulatedDB):
+    pgp_configuration = 'NONE'
+
+    @inlineCallbacks
+    def test_tip_mails(self):
+        yield disable_encryption()
+        yield set_tip_mail_template('{TipNum} {TipLabel} {TipStatus} {EventTime} {Url}\n{QuestionnaireAnswers}')
+
+        for _ in range(self.population_of_submissions):
+            yield self.perform_minimal_submission_actions()
+
+        expected = yield get_expected_tip_mails()
+
+        yield Notification().generate_emails()
+
+        mails = yield get_spooled_mails()
+
+        self.assertEqual(len(mails), self.population_of_submissions * self.population_of_recipients)
+        self.assertEqual(mails, expected)
+
+
+class TestNotificationRetries(helpers.TestGLWithPopulatedDB):
+    @inlineCallbacks
+    def setUp(self):
+        yield helpers.TestGLWithPopulatedDB.setUp(self)
+
+        self.attempts = []
+
+        def sendmail(state, tid, to_address, subject, body):
+            self.attempts.append(to_address)
+            return succeed(to_address != 'poison@example.net')
+
+        self.patch(State.__class__, 'sendmail', sendmail)
+
+    @inlineCallbacks
+    def test_backoff_and_parking(self):
+        yield add_mails(['poison@example.net', 'valid@example.net'])
+
+        notification = Notification()
+
+        yield notification.spool_emails()
+
+        mails = yield get_mails()
+        self.assertEqual(list(mails), ['poison@example.net'])
+        self.assertEqual(mails['poison@example.net'][0], 1)
+        self.assertTrue(mails['poison@example.net'][1] > datetime_now())
+
+        # The failed mail is not retried until its backoff expires
+        yield add_mails(['valid@example.net'])
+        yield notification.spool_emails()
+        self.assertEqual(self.attempts.count('poison@example.net'), 1)
+        self.assertEqual(self.attempts.count('valid@example.net'), 2)
+        yield self.test_model_count(models.Mail, 1)
+
+        # The mail is parked once the limit of the attempts is reached
+        yield expire_mails_backoff(self.state.settings.mail_attempts_limit - 1)
+        yield notification.spool_emails()
+
+        mails = yield get_mails()
+        self.assertEqual(mails['poison@example.net'], (self.state.settings.mail_attempts_limit, datetime_never()))
+
+        yield notification.spool_emails()
+        self.assertEqual(self.attempts.count('poison@example.net'), 2)
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
+from twisted.internet.defer import inlineCallbacks
+
+from globaleaks import models
 from globaleaks.jobs.job import LoopingJob
+from globaleaks.orm import transact
 
 from globaleaks.tests import helpers
 
@@ -12,6 +16,22 @@ class LoopingJobX(LoopingJob):
         self.operation_called += 1
 
 
+class LoopingJobY(LoopingJob):
+    interval = 2
+    idle_interval = 10
+    wakeup_models = (models.Mail,)
+    operation_called = 0
+
+    def operation(self):
+        self.operation_called += 1
+
+
+@transact
+def add_mails(session, count):
+    for _ in range(count):
+        session.add(models.Mail({'address': 'user@example.net', 'subject': 'subject', 'body': 'body'}))
+
+
 class TestLoopingJob(helpers.TestGL):
     def test_base_scheduler(self):
         """
@@ -35,3 +55,33 @@ class TestLoopingJob(helpers.TestGL):
             self.assertEqual(job.operation_called, i)
 
         return job.stop()
+
+    @inlineCallbacks
+    def test_wakeup(self):
+        job = LoopingJobY()
+
+        self.test_reactor.advance(0)
+        self.assertEqual(job.operation_called, 1)
+
+        # The executions not preceded by any insertion are skipped
+        self.test_reactor.advance(2)
+        self.assertEqual(job.operation_called, 1)
+
+        # An insertion wakes up the job immediately
+        yield add_mails(3)
+        self.test_reactor.advance(0)
+        self.assertEqual(job.operation_called, 2)
+
+        # The wakeups received while waiting are coalesced
+        yield add_mails(1)
+        yield add_mails(1)
+        self.test_reactor.advance(0)
+        self.assertEqual(job.operation_called, 3)
+
+        # The job is executed anyhow once idle_interval is elapsed
+        for _ in range(5):
+            self.test_reactor.advance(2)
+
+        self.assertEqual(job.operation_called, 4)
+
+        yield job.stop()
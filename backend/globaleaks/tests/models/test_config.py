@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from twisted.internet.defer import inlineCallbacks
+
 from globaleaks import models
 from globaleaks.models import config
 from globaleaks.orm import transact
@@ -30,3 +32,63 @@ class TestModels(helpers.TestGL):
             config.ConfigFactory(session, 1).update_defaults()
 
         return transaction()
+
+    @inlineCallbacks
+    def test_config_store(self):
+        @transact
+        def get_val(session, var_name):
+            return config.ConfigFactory(session, 1).get_val(var_name)
+
+        @transact
+        def set_val(session, var_name, value):
+            config.ConfigFactory(session, 1).set_val(var_name, value)
+            return config.ConfigFactory(session, 1).get_val(var_name)
+
+        yield get_val('name')
+
+        stats = config.config_cache.get_stats()
+        yield get_val('name')
+        self.assertEqual(config.config_cache.get_stats()['reads_avoided'], stats['reads_avoided'] + 1)
+
+        # The transaction writing the configuration reads from the database
+        value = yield set_val('name', 'new name')
+        self.assertEqual(value, 'new name')
+
+        # The store is updated on commit and does not need to be reloaded
+        stats = config.config_cache.get_stats()
+        value = yield get_val('name')
+        self.assertEqual(value, 'new name')
+        self.assertEqual(config.config_cache.get_stats()['reads_avoided'], stats['reads_avoided'] + 1)
+
+    @inlineCallbacks
+    def test_config_cache_returns_copies(self):
+        @transact
+        def get(session):
+            return config.config_cache.get(session, 1, 'test', 'en', lambda: {'list': [1], 'dict': {'a': 1}})
+
+        value = yield get()
+        value['list'].append(2)
+        value['dict']['a'] = 2
+
+        stats = config.config_cache.get_stats()
+        value = yield get()
+        self.assertEqual(value, {'list': [1], 'dict': {'a': 1}})
+        self.assertEqual(config.config_cache.get_stats()['hits'], stats['hits'] + 1)
+
+    @inlineCallbacks
+    def test_config_cache_does_not_flush(self):
+        @transact
+        def get_val(session):
+            tenant = models.Tenant()
+            session.add(tenant)
+
+            config.ConfigFactory(session, 1).get_val('name')
+
+            return tenant in session.new
+
+        yield get_val()
+
+        # The reads served by the cache leave the pending writes unflushed
+        stats = config.config_cache.get_stats()
+        self.assertTrue((yield get_val()))
+        self.assertEqual(config.config_cache.get_stats()['reads_avoided'], stats['reads_avoided'] + 1)
@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
+import sqlite3
+import threading
+
+from sqlalchemy.exc import DatabaseError
+
+from globaleaks import orm
 from globaleaks.models import Tenant
-from globaleaks.orm import get_session, transact
+from globaleaks.orm import db_after_commit, get_engine, get_query_stats, get_session, get_stats, max_queries, \
+    run_with_caller, run_with_priority, transact, transact_ro, transact_sync, tr, \
+    TransactionQueue, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from globaleaks.settings import Settings
 from globaleaks.tests import helpers
+from twisted.internet import defer, reactor
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThreadPool
 
 
 class TestORM(helpers.TestGL):
@@ -39,9 +50,235 @@ class TestORM(helpers.TestGL):
 
         self.assertEqual(count1, count2)
 
+    @transact
+    def _transact_with_callback(self, session, callbacks, fail):
+        self.db_add_config(session)
+        db_after_commit(session, lambda: callbacks.append(threading.current_thread().name))
+
+        if fail:
+            raise Exception("antani")
+
+        return fail
+
+    @inlineCallbacks
+    def test_db_after_commit(self):
+        callbacks = []
+
+        self.assertFalse((yield self._transact_with_callback(callbacks, False)))
+        yield self.assertFailure(self._transact_with_callback(callbacks, True), Exception)
+
+        # The callables are invoked in the reactor thread only for the committed transactions
+        self.assertEqual(callbacks, ['MainThread'])
+
     def test_transact_decorate_function(self):
         @transact
         def transaction(session):
             self.assertTrue(getattr(session, 'query'))
 
         return transaction()
+
+    @inlineCallbacks
+    def test_journal_mode(self):
+        yield self._transact_with_success()
+
+        with get_engine(orm_lockdown=False).connect() as conn:
+            self.assertEqual(conn.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+
+    @inlineCallbacks
+    def test_lock_wait(self):
+        stats = get_stats()
+
+        # A concurrent writer keeps the write lock for a while
+        conn = sqlite3.connect(Settings.db_file_path, isolation_level=None, check_same_thread=False)
+        conn.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(0.2, conn.rollback)
+        timer.start()
+
+        try:
+            yield self._transact_with_success()
+        finally:
+            timer.join()
+            conn.close()
+
+        x = get_stats()
+        self.assertEqual(x['transactions'], stats['transactions'] + 1)
+        self.assertEqual(x['failures'], stats['failures'])
+        self.assertEqual(x['lock_waits'], stats['lock_waits'] + 1)
+        self.assertTrue(x['lock_wait_time'] >= stats['lock_wait_time'] + 0.1)
+
+    def test_write_lock_at_begin(self):
+        def transaction(session):
+            session.query(Tenant).count()
+
+            # The write lock is held from the beginning of the transaction so
+            # that the reads preceding the writes are not changed concurrently
+            conn = sqlite3.connect(Settings.db_file_path, timeout=0, isolation_level=None)
+            try:
+                self.assertRaises(sqlite3.OperationalError, conn.execute, 'BEGIN IMMEDIATE')
+            finally:
+                conn.close()
+
+        return transact(transaction)()
+
+    def test_transact_ro(self):
+        @transact_ro
+        def count(session):
+            return session.query(Tenant).count()
+
+        return count()
+
+    @inlineCallbacks
+    def test_transact_ro_refuses_writes(self):
+        @transact_ro
+        def transaction(session):
+            self.db_add_config(session)
+            session.flush()
+
+        count = yield transact_ro(lambda session: session.query(Tenant).count())()
+
+        yield self.assertFailure(transaction(), DatabaseError)
+
+        self.assertEqual((yield transact_ro(lambda session: session.query(Tenant).count())()), count)
+
+    @inlineCallbacks
+    def test_tr(self):
+        count = yield tr(lambda session: session.query(Tenant).count())
+
+        def db_add_tenant(session):
+            self.db_add_config(session)
+            session.flush()
+
+        yield self.assertFailure(tr(db_add_tenant), DatabaseError)
+
+        self.assertEqual((yield tr(lambda session: session.query(Tenant).count())), count)
+
+    @inlineCallbacks
+    def test_query_stats(self):
+        executions = orm._ORM_N_PLUS_ONE_THRESHOLD
+
+        @transact
+        def transaction(session):
+            for _ in range(executions):
+                session.query(Tenant).filter(Tenant.id == 1).one()
+
+        yield run_with_caller('test_query_stats', transaction)
+
+        stats = get_query_stats()
+
+        profile = [x for x in stats['transactions'] if x['caller'] == 'test_query_stats'][0]
+        self.assertEqual(profile['count'], 1)
+        self.assertEqual(profile['statements'], executions)
+        self.assertEqual(profile['rows'], executions)
+        self.assertTrue(profile['time'] >= profile['query_time'] > 0)
+
+        n_plus_one = [x for x in stats['n_plus_one'] if x['caller'] == 'test_query_stats'][0]
+        self.assertEqual(n_plus_one['transaction'], profile['transaction'])
+        self.assertEqual(n_plus_one['max_executions'], executions)
+        self.assertTrue(n_plus_one['statement'].startswith('SELECT'))
+
+    @inlineCallbacks
+    def test_max_queries(self):
+        count = transact(lambda session: session.query(Tenant).count())
+
+        with max_queries(1) as counter:
+            yield count()
+
+        self.assertEqual(counter.statements, 1)
+
+        with self.assertRaises(AssertionError):
+            with max_queries(1):
+                yield count()
+                yield count()
+
+    def run_in_transaction_queue(self, transaction_queue, priority, f):
+        return run_with_priority(priority, deferToThreadPool, reactor, transaction_queue, f)
+
+    @inlineCallbacks
+    def test_transaction_queue(self):
+        transaction_queue = TransactionQueue()
+        transaction_queue.start()
+        self.addCleanup(transaction_queue.stop)
+
+        executions = []
+
+        # The writer is kept busy while the other transactions are queued
+        event = threading.Event()
+        d0 = self.run_in_transaction_queue(transaction_queue, PRIORITY_NORMAL, event.wait)
+
+        ds = []
+        for priority in [PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH, PRIORITY_NORMAL]:
+            ds.append(self.run_in_transaction_queue(transaction_queue, priority, lambda p=priority: executions.append(p)))
+
+        event.set()
+
+        yield d0
+        yield defer.gatherResults(ds)
+
+        self.assertEqual(executions, [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_NORMAL, PRIORITY_LOW])
+
+    def test_transact_sync_in_transaction_queue(self):
+        orm.set_thread_pool(TransactionQueue())
+        orm.get_thread_pool().start()
+        self.addCleanup(orm.get_thread_pool().stop)
+
+        @transact_sync
+        def transaction(session):
+            self.db_add_config(session)
+            return threading.current_thread().name
+
+        # The synchronous transactions are executed by the writer thread
+        self.assertEqual(transaction(), 'orm-writer')
+        self.assertRaises(ZeroDivisionError, transact_sync(lambda session: 1 / 0))
+
+    @inlineCallbacks
+    def test_transaction_queue_group_commit(self):
+        orm.set_thread_pool(TransactionQueue(10))
+        orm.get_thread_pool().start()
+        self.addCleanup(orm.get_thread_pool().stop)
+
+        stats = get_stats()
+
+        event = threading.Event()
+        d0 = self.run_in_transaction_queue(orm.get_thread_pool(), PRIORITY_NORMAL, event.wait)
+
+        count = yield transact_ro(lambda session: session.query(Tenant).count())()
+
+        ds = [self._transact_with_success(),
+              self._transact_with_exception(),
+              self._transact_with_success()]
+
+        event.set()
+
+        yield d0
+        yield ds[0]
+        yield self.assertFailure(ds[1], Exception)
+        yield ds[2]
+
+        # The transactions are committed together and the failed one is rolled back
+        self.assertEqual((yield transact_ro(lambda session: session.query(Tenant).count())()), count + 2)
+        self.assertEqual(get_stats()['group_commits'], stats['group_commits'] + 1)
+
+    @inlineCallbacks
+    def test_db_after_commit_in_group_commit(self):
+        orm.set_thread_pool(TransactionQueue(10))
+        orm.get_thread_pool().start()
+        self.addCleanup(orm.get_thread_pool().stop)
+
+        callbacks = []
+
+        event = threading.Event()
+        d0 = self.run_in_transaction_queue(orm.get_thread_pool(), PRIORITY_NORMAL, event.wait)
+
+        ds = [self._transact_with_callback(callbacks, False),
+              self._transact_with_callback(callbacks, True),
+              self._transact_with_callback(callbacks, False)]
+
+        event.set()
+
+        yield d0
+        yield ds[0]
+        yield self.assertFailure(ds[1], Exception)
+        yield ds[2]
+
+        # The callables of the savepoint rolled back are discarded
+        self.assertEqual(callbacks, ['MainThread', 'MainThread'])
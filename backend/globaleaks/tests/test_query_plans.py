@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import re
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from twisted.internet.defer import inlineCallbacks
+
+from globaleaks.handlers import recipient
+from globaleaks.handlers.admin.auditlog import get_audit_log, get_tips
+from globaleaks.handlers.auth import get_login_credentials
+from globaleaks.handlers.user.reset_password import generate_password_reset_token_by_username_or_mail
+from globaleaks.jobs import cleaning, delivery, notification
+from globaleaks.models import Base
+from globaleaks.settings import Settings
+from globaleaks.tests import helpers
+from globaleaks.utils.utility import datetime_now
+
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+class QueryRecorder(object):
+    """
+    Context manager recording the statements executed on the database
+    """
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, 'before_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            self.statements.append((statement, parameters))
+
+
+class TestQueryPlans(helpers.TestHandlerWithPopulatedDB):
+    _handler = recipient.TipsCollection
+
+    @inlineCallbacks
+    def setUp(self):
+        yield helpers.TestHandlerWithPopulatedDB.setUp(self)
+        yield self.perform_full_submission_actions()
+        yield delivery.Delivery().run()
+
+    def get_table_scans(self, statements):
+        """
+        Return the tables that are fully scanned by the statements provided
+
+        Scans of covering indexes are not reported as they do not access the tables.
+
+        :param statements: A list of (statement, parameters) tuples
+        :return: A dictionary mapping every scanned table to a statement scanning it
+        """
+        tables = set(Base.metadata.tables)
+        scans = {}
+
+        db = sqlite3.connect(Settings.db_file_path)
+        try:
+            for statement, parameters in statements:
+                for row in db.execute('EXPLAIN QUERY PLAN ' + statement, parameters):
+                    match = SCAN_RE.match(row[3])
+                    if match and match.group(1) in tables:
+                        scans.setdefault(match.group(1), statement)
+        finally:
+            db.close()
+
+        return scans
+
+    def assertNoTableScans(self, statements, expected=()):
+        scans = self.get_table_scans(statements)
+        for table in expected:
+            scans.pop(table, None)
+
+        self.assertEqual(list(scans), [], '\n\n'.join(scans.values()))
+
+    @inlineCallbacks
+    def test_cleaning(self):
+        with QueryRecorder() as recorder:
+            yield cleaning.Cleaning().run()
+
+        # The garbage collection of the questionnaire schemas, of the expired
+        # signups and of the untracked attachments needs to go through the
+        # whole tables
+        self.assertNoTableScans(recorder.statements, ['archivedschema', 'receiverfile', 'subscriber'])
+
+    @inlineCallbacks
+    def test_notification(self):
+        notification.Notification.next_daily_run = datetime_now()
+
+        with QueryRecorder() as recorder:
+            yield notification.Notification().generate_emails()
+            yield notification.get_mails_from_the_pool()
+
+        # The events to be notified are selected by means of the flags of the
+        # new objects and the statuses are serialized for all the tenant
+        self.assertNoTableScans(recorder.statements,
+                                ['receivertip', 'receiverfile', 'submissionstatus', 'submissionsubstatus'])
+
+    @inlineCallbacks
+    def test_receiver_tips(self):
+        handler = self.request(role='receiver', user_id=self.dummyReceiver_1['id'])
+
+        with QueryRecorder() as recorder:
+            yield handler.get()
+
+        self.assertNoTableScans(recorder.statements)
+
+    @inlineCallbacks
+    def test_admin_views(self):
+        with QueryRecorder() as recorder:
+            yield get_audit_log(1)
+            yield get_tips(1)
+
+        self.assertNoTableScans(recorder.statements)
+
+    @inlineCallbacks
+    def test_user_lookups(self):
+        with QueryRecorder() as recorder:
+            yield get_login_credentials(1, 'receiver1')
+            yield generate_password_reset_token_by_username_or_mail(1, 'Receiver1')
+            yield generate_password_reset_token_by_username_or_mail(1, 'RECEIVER1@localhost')
+
+        # The lookup of the picture of the user serialized in the mail
+        self.assertNoTableScans(recorder.statements, ['file'])
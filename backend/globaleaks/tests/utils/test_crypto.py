@@ -1,10 +1,12 @@
 # -*- coding: utf-8
 import filecmp
 import os
+import threading
+import time
 
 from globaleaks.settings import Settings
 from globaleaks.tests import helpers
-from globaleaks.utils.crypto import Base64Encoder, GCE
+from globaleaks.utils.crypto import argon2_pool, Base64Encoder, GCE
 
 password = b'password'
 message = b'message'
@@ -37,10 +39,40 @@ class TestCryptoUtils(helpers.TestGL):
         dec = GCE.asymmetric_decrypt(prv_key, enc)
         self.assertEqual(dec, message)
 
+    def test_tip_content_encrypt_decrypt(self):
+        prv_key, pub_key = GCE.generate_keypair()
+
+        enc = GCE.tip_content_encrypt(prv_key, message)
+        self.assertFalse(GCE.is_legacy_tip_content(enc))
+        self.assertEqual(GCE.tip_content_decrypt(prv_key, enc), message)
+
+        enc = Base64Encoder.encode(GCE.asymmetric_encrypt(pub_key, message))
+        self.assertTrue(GCE.is_legacy_tip_content(enc))
+        self.assertEqual(GCE.tip_content_decrypt(prv_key, enc), message)
+
     def test_check_password(self):
         self.assertTrue(GCE.check_password(password, salt, hash_argon2))
         self.assertFalse(GCE.check_password(password, salt, 'nohashnoparty'))
 
+        hash = GCE.hash_password(password, salt)
+        self.assertEqual(len(hash), len(hash_argon2))
+        self.assertFalse(GCE.is_legacy_hash(hash))
+        self.assertTrue(GCE.is_legacy_hash(hash_argon2))
+        self.assertTrue(GCE.check_password(password, salt, hash))
+        self.assertFalse(GCE.check_password(b'antani', salt, hash))
+
+    def test_calculate_hash_and_key(self):
+        hash, key = GCE.calculate_hash_and_key(password, salt)
+        self.assertEqual(hash, GCE.hash_password(password, salt))
+        self.assertEqual(key, GCE.derive_key(password, salt))
+
+    def test_check_password_and_derive_key(self):
+        hash, key = GCE.calculate_hash_and_key(password, salt)
+
+        for x in [hash, hash_argon2]:
+            self.assertEqual(GCE.check_password_and_derive_key(password, salt, x), (True, key, hash))
+            self.assertEqual(GCE.check_password_and_derive_key(b'antani', salt, x), (False, b'', x))
+
     def test_encrypt_and_decrypt_file(self):
         prv_key, pub_key = GCE.generate_keypair()
         a = __file__
@@ -77,3 +109,65 @@ class TestCryptoUtils(helpers.TestGL):
         plain_rec_key = GCE.asymmetric_decrypt(prv_key, Base64Encoder.decode(rec_key))
         x = GCE.symmetric_decrypt(plain_rec_key, Base64Encoder.decode(bck_key))
         self.assertEqual(x, prv_key)
+
+    def test_argon2_pool(self):
+        stats = argon2_pool.get_stats()
+
+        threads = [threading.Thread(target=GCE.hash_password, args=(password, salt)) for _ in range(8)]
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        x = argon2_pool.get_stats()
+        self.assertEqual(x['size'], 4)
+        self.assertEqual(x['running'], 0)
+        self.assertEqual(x['queued'], 0)
+        self.assertEqual(x['executions'], stats['executions'] + 8)
+        self.assertTrue(x['wait_time'] >= stats['wait_time'])
+
+    def test_argon2_pool_concurrency(self):
+        size = argon2_pool.get_stats()['size']
+        release = threading.Event()
+        lock = threading.Lock()
+        status = {'running': 0, 'max_running': 0}
+
+        def computation():
+            with lock:
+                status['running'] += 1
+                status['max_running'] = max(status['max_running'], status['running'])
+
+            release.wait()
+
+            with lock:
+                status['running'] -= 1
+
+        threads = [threading.Thread(target=argon2_pool.run, args=(computation,)) for _ in range(size + 2)]
+        for t in threads:
+            t.start()
+
+        # The computations exceeding the memory budget wait for a free slot
+        while argon2_pool.get_stats()['queued'] < 2 or status['running'] < size:
+            time.sleep(0.01)
+
+        time.sleep(0.1)
+
+        self.assertEqual(status['running'], size)
+        self.assertEqual(argon2_pool.get_stats()['running'], size)
+        self.assertEqual(argon2_pool.get_stats()['queued'], 2)
+
+        release.set()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual(status['max_running'], size)
+        self.assertEqual(argon2_pool.get_stats()['running'], 0)
+
+    def test_argon2_pool_size(self):
+        self.patch(argon2_pool, 'memory_budget', 1 << 28)
+        self.assertEqual(argon2_pool.get_stats()['size'], 2)
+
+        self.patch(argon2_pool, 'memory_budget', 0)
+        self.assertEqual(argon2_pool.get_stats()['size'], 1)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from globaleaks.tests import helpers
+from globaleaks.utils.lrucache import LRUCache
+
+
+class TestLRUCache(helpers.TestGL):
+    def test_eviction(self):
+        cache = LRUCache(3)
+
+        for x in range(3):
+            cache.set(x, str(x))
+
+        self.assertEqual(cache.get(0), '0')
+
+        cache.set(3, '3')
+
+        self.assertEqual(len(cache), 3)
+        self.assertTrue(0 in cache)
+        self.assertFalse(1 in cache)
+        self.assertEqual(cache.get(1), None)
+
+        self.assertEqual(cache.pop(2), '2')
+        self.assertEqual(len(cache), 2)
+
+        self.assertEqual(cache.get_stats(), {'size': 3, 'entries': 2, 'hits': 1, 'misses': 1})
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
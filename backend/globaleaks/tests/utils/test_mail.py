@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from twisted.internet import defer, reactor, task
+from twisted.mail import smtp
+from zope.interface import implementer
+
+from globaleaks.tests import helpers
+from globaleaks.utils.mail import sendmail, SMTPPools
+
+
+@implementer(smtp.IMessage)
+class Message(object):
+    def __init__(self, server):
+        self.server = server
+        self.lines = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def eomReceived(self):
+        self.server.messages.append(self.lines)
+        return defer.succeed(None)
+
+    def connectionLost(self):
+        pass
+
+
+@implementer(smtp.IMessageDelivery)
+class MessageDelivery(object):
+    def __init__(self, server):
+        self.server = server
+
+    def receivedHeader(self, helo, origin, recipients):
+        return b'Received: test'
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        if user.dest.local == b'invalid':
+            raise smtp.SMTPBadRcpt(user)
+
+        return lambda: Message(self.server)
+
+
+class Server(smtp.SMTPFactory):
+    def __init__(self):
+        smtp.SMTPFactory.__init__(self)
+        self.messages = []
+        self.connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        p = smtp.ESMTP()
+        p.factory = self
+        p.delivery = MessageDelivery(self)
+        return p
+
+
+class TestMail(helpers.TestGL):
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield helpers.TestGL.setUp(self)
+
+        self.server = Server()
+        self.port = reactor.listenTCP(0, self.server, interface='127.0.0.1')
+
+        self.port_number = self.port.getHost().port
+
+        SMTPPools.clear()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        # The sessions are closed after the delivery of the last message
+        while SMTPPools.pools:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+        yield self.port.stopListening()
+
+        yield helpers.TestGL.tearDown(self)
+
+    def sendmail(self, to_address, concurrency=1, rate_limit=0):
+        return sendmail(1, '127.0.0.1', self.port_number, 'NONE', False, '', '',
+                        'Sender', 'sender@example.net', to_address, 'subject', 'body',
+                        anonymize=False, concurrency=concurrency, rate_limit=rate_limit)
+
+    @defer.inlineCallbacks
+    def test_sendmail_reuses_connections(self):
+        results = yield defer.gatherResults([self.sendmail('user%d@example.net' % i, 2) for i in range(10)])
+
+        self.assertEqual(results, [True] * 10)
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertTrue(self.server.connections <= 2)
+
+    @defer.inlineCallbacks
+    def test_sendmail_rate_limit(self):
+        start = reactor.seconds()
+
+        results = yield defer.gatherResults([self.sendmail('user%d@example.net' % i, 1, 240) for i in range(3)])
+
+        self.assertEqual(results, [True] * 3)
+
+        # The first mail is sent immediately and the others every 0.25 seconds
+        self.assertTrue(reactor.seconds() - start >= 0.5)
+
+    @defer.inlineCallbacks
+    def test_sendmail_invalid_recipient(self):
+        results = yield defer.gatherResults([self.sendmail('invalid@example.net'),
+                                             self.sendmail('user@example.net')])
+
+        self.assertEqual(results, [False, True])
+        self.assertEqual(len(self.server.messages), 1)
+
+    @defer.inlineCallbacks
+    def test_sendmail_unreachable_server(self):
+        yield self.port.stopListening()
+
+        results = yield defer.gatherResults([self.sendmail('user%d@example.net' % i) for i in range(3)])
+
+        self.assertEqual(results, [False] * 3)
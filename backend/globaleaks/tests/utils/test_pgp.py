@@ -1,9 +1,11 @@
 # -*- coding: utf-8
 import os
+
+from io import BytesIO
 from datetime import datetime
 
 from globaleaks.tests import helpers
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.pgp import get_pgp_context, pgp_contexts, PGPContext
 
 
 class TestPGP(helpers.TestGL):
@@ -44,6 +46,66 @@ class TestPGP(helpers.TestGL):
         with open(file_dst, 'rb') as f:
             self.assertEqual(str(pgpctx.gnupg.decrypt_file(f)), self.secret_content)
 
+    def test_encrypt_stream(self):
+        pgpctx = PGPContext(helpers.PGPKEYS['VALID_PGP_KEY1_PRV'])
+
+        stream = pgpctx.encrypt_stream(BytesIO(self.secret_content.encode()))
+
+        encrypted = b''
+        while True:
+            data = stream.read(1024)
+            if not data:
+                break
+
+            encrypted += data
+
+        stream.close()
+
+        self.assertEqual(str(pgpctx.gnupg.decrypt(encrypted)), self.secret_content)
+
+    def test_encrypt_stream_close_before_the_end(self):
+        pgpctx = PGPContext(helpers.PGPKEYS['VALID_PGP_KEY1_PRV'])
+
+        stream = pgpctx.encrypt_stream(BytesIO(os.urandom(1024 * 1024)))
+        stream.read(1024)
+
+        stream.close()
+
+        self.assertIsNotNone(stream.process.returncode)
+        self.assertFalse(stream.thread.is_alive())
+
+    def test_open_file_encryption(self):
+        file_dst = os.path.join(os.getcwd(), 'test_encrypted_file.txt')
+
+        pgpctx = PGPContext(helpers.PGPKEYS['VALID_PGP_KEY1_PRV'])
+
+        f = pgpctx.open_file_encryption(file_dst)
+        f.write(self.secret_content.encode())
+        f.close()
+
+        with open(file_dst, 'rb') as f:
+            self.assertEqual(str(pgpctx.gnupg.decrypt_file(f)), self.secret_content)
+
+    def test_encrypt_messages(self):
+        pgpctx = PGPContext(helpers.PGPKEYS['VALID_PGP_KEY1_PRV'])
+
+        messages = [self.secret_content, 'message']
+
+        encrypted_messages = pgpctx.encrypt_messages(messages)
+
+        self.assertEqual([str(pgpctx.gnupg.decrypt(x)) for x in encrypted_messages], messages)
+
+    def test_get_pgp_context(self):
+        pgp_contexts.clear()
+
+        pgpctx = get_pgp_context(helpers.PGPKEYS['VALID_PGP_KEY1_PUB'])
+        self.assertEqual(pgpctx.fingerprint, 'BFB3C82D1B5F6A94BDAC55C6E70460ABF9A4C8C1')
+        self.assertTrue(pgpctx.tempdir.name.startswith(self.state.settings.pgp_path))
+
+        self.assertIs(get_pgp_context(helpers.PGPKEYS['VALID_PGP_KEY1_PUB']), pgpctx)
+        self.assertIsNot(get_pgp_context(helpers.PGPKEYS['VALID_PGP_KEY2_PUB']), pgpctx)
+        self.assertEqual(len(pgp_contexts), 2)
+
     def test_read_expirations(self):
         pgpctx = PGPContext(helpers.PGPKEYS['VALID_PGP_KEY1_PRV'])
 
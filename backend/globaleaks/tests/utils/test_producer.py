@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import deferLater
+
+from globaleaks.tests import helpers
+from globaleaks.utils.producer import ThreadedFileProducer
+
+
+class Consumer(object):
+    def __init__(self):
+        self.producer = None
+        self.written = []
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+
+@inlineCallbacks
+def wait_reads(producer):
+    while producer.reading:
+        yield deferLater(reactor, 0, lambda: None)
+
+
+class TestThreadedFileProducer(helpers.TestGL):
+    data = b'x' * (ThreadedFileProducer.chunk_size * 20 + 1)
+
+    @inlineCallbacks
+    def test_transfer(self):
+        consumer = Consumer()
+
+        yield ThreadedFileProducer(BytesIO(self.data)).beginFileTransfer(consumer)
+
+        self.assertEqual(b''.join(consumer.written), self.data)
+        self.assertEqual(consumer.producer, None)
+
+    @inlineCallbacks
+    def test_read_ahead(self):
+        consumer = Consumer()
+        producer = ThreadedFileProducer(BytesIO(self.data), read_ahead=4)
+
+        # Start the transfer with the consumer already paused
+        producer.pauseProducing()
+        d = producer.beginFileTransfer(consumer)
+
+        yield wait_reads(producer)
+
+        self.assertEqual(len(consumer.written), 0)
+        self.assertEqual(len(producer.chunks), 4)
+
+        producer.resumeProducing()
+
+        yield d
+
+        self.assertEqual(b''.join(consumer.written), self.data)
+
+    @inlineCallbacks
+    def test_stop(self):
+        consumer = Consumer()
+        producer = ThreadedFileProducer(BytesIO(self.data))
+
+        d = producer.beginFileTransfer(consumer)
+        producer.stopProducing()
+
+        # The transfer is interrupted only after the completion of the pending read
+        self.assertFalse(d.called)
+
+        yield self.assertFailure(d, Exception)
+
+        self.assertEqual(len(consumer.written), 0)
@@ -4,7 +4,7 @@ from globaleaks.handlers import admin, public, recipient, user
 from globaleaks.jobs.delivery import Delivery
 from globaleaks.orm import tw
 from globaleaks.tests import helpers
-from globaleaks.utils.templating import Templating, supported_template_types
+from globaleaks.utils.templating import Templating, get_template, templates_cache, supported_template_types
 
 
 class notifTemplateTest(helpers.TestGLWithPopulatedDB):
@@ -40,3 +40,22 @@ class notifTemplateTest(helpers.TestGLWithPopulatedDB):
 
             template = ''.join(supported_template_types[data['type']].keyword_list)
             Templating().format_template(template, data)
+
+    def test_template_rendering(self):
+        data = {
+            'type': 'user_credentials',
+            'role': 'admin',
+            'username': '{Password}',
+            'password': 'secret'
+        }
+
+        raw_template = '{Role}: {Username} {Username} {Unknown} {{Password}}  \n'
+
+        # Keywords are replaced once, unknown keywords are kept and braces in the values are escaped
+        self.assertEqual(Templating().format_template(raw_template, data),
+                         'admin: (Password) (Password) {Unknown} {secret}')
+
+        stats = templates_cache.get_stats()
+        self.assertIs(get_template(raw_template), get_template(raw_template))
+        self.assertEqual(templates_cache.get_stats()['hits'], stats['hits'] + 2)
+
@@ -5,8 +5,10 @@ from io import BytesIO
 from twisted.internet.defer import inlineCallbacks
 from zipfile import ZipFile
 
+from globaleaks.settings import Settings
 from globaleaks.tests import helpers
-from globaleaks.utils.zipstream import ZipStream
+from globaleaks.utils.crypto import GCE
+from globaleaks.utils.zipstream import is_compressed_content, ZipStream, ZIP_DEFLATED, ZIP_STORED
 
 
 class TestZipStream(helpers.TestGL):
@@ -39,3 +41,79 @@ class TestZipStream(helpers.TestGL):
                     self.assertTrue(ff.file_size == len(self.unicode_seq.encode()))
                 else:
                     self.assertTrue(ff.file_size == os.stat(os.path.abspath(__file__)).st_size)
+
+    def test_zipstream_read(self):
+        output = BytesIO()
+
+        zipstream = ZipStream(self.files)
+        while True:
+            data = zipstream.read(1024)
+            if not data:
+                break
+
+            output.write(data)
+
+        zipstream.close()
+
+        with ZipFile(output, 'r') as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual(len(f.infolist()), 3)
+
+    def test_zipstream_decryption_threads(self):
+        prv_key, pub_key = GCE.generate_keypair()
+
+        files = []
+        for i in range(5):
+            path = os.path.join(Settings.tmp_path, 'encrypted-%d' % i)
+            with open(os.path.abspath(__file__), 'rb') as input_fd, \
+                 GCE.streaming_encryption_open('ENCRYPT', pub_key, path) as seo:
+                seo.encrypt_chunk(input_fd.read(), 1)
+
+            files.append({'name': 'file-%d' % i, 'key': prv_key, 'path': path})
+
+        output = BytesIO()
+
+        for data in ZipStream(files, 2):
+            output.write(data)
+
+        with ZipFile(output, 'r') as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual(len(f.infolist()), 5)
+            for i in range(5):
+                with open(os.path.abspath(__file__), 'rb') as input_fd:
+                    self.assertEqual(f.read('file-%d' % i), input_fd.read())
+
+    def test_is_compressed_content(self):
+        self.assertTrue(is_compressed_content('file.bin', 'image/jpeg'))
+        self.assertTrue(is_compressed_content('file.bin', 'video/mp4'))
+        self.assertTrue(is_compressed_content('file.bin', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'))
+        self.assertTrue(is_compressed_content('file.ZIP', ''))
+        self.assertTrue(is_compressed_content('files/file.txt.pgp', 'text/plain'))
+        self.assertFalse(is_compressed_content('file.txt', 'text/plain'))
+        self.assertFalse(is_compressed_content('file.wav', 'audio/wav'))
+
+    def test_zipstream_compression_policy(self):
+        files = [
+          {'name': 'text.txt', 'type': 'text/plain', 'fo': BytesIO(b'text' * 10000)},
+          {'name': 'image.bin', 'type': 'image/jpeg', 'fo': BytesIO(b'image' * 10000)},
+          {'name': 'random.bin', 'type': 'application/octet-stream', 'fo': BytesIO(os.urandom(100000))}
+        ]
+
+        output = BytesIO()
+
+        for data in ZipStream(files):
+            output.write(data)
+
+        with ZipFile(output, 'r') as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual([x.compress_type for x in f.infolist()], [ZIP_DEFLATED, ZIP_STORED, ZIP_STORED])
+
+    def test_zipstream_compression_level_zero(self):
+        output = BytesIO()
+
+        for data in ZipStream(self.files, compression_level=0):
+            output.write(data)
+
+        with ZipFile(output, 'r') as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual([x.compress_type for x in f.infolist()], [ZIP_STORED] * 3)
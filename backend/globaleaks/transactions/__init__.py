@@ -2,8 +2,12 @@
 """
 ORM Transactions definitions.
 """
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread
+
 from globaleaks import models
-from globaleaks.orm import db_add, db_get
+from globaleaks.orm import db_add, db_after_commit, db_get, tw
+from globaleaks.utils.pgp import get_pgp_context
 
 
 def db_get_user(session, tid, user_id):
@@ -21,7 +25,46 @@ def db_get_user(session, tid, user_id):
                    models.User.tid == tid))
 
 
-def db_schedule_email(session, tid, address, subject, body):
+def encrypt_mail_body(pgp_key_public, body):
+    """
+    Encrypt the body of a mail with the PGP key of its recipient
+
+    :param pgp_key_public: The PGP key of the recipient
+    :param body: The body to be encrypted
+    :return: The encrypted body or an empty body if the encryption fails
+    """
+    try:
+        return get_pgp_context(pgp_key_public).encrypt_message(body)
+    except:
+        return ''
+
+
+@inlineCallbacks
+def schedule_encrypted_email(tid, address, subject, body, pgp_key_public):
+    body = yield deferToThread(encrypt_mail_body, pgp_key_public, body)
+
+    yield tw(db_schedule_email, tid, address, subject, body)
+
+
+def db_schedule_email(session, tid, address, subject, body, pgp_key_public=''):
+    """
+    Transaction for scheduling a mail
+
+    When a PGP key is provided the mail is encrypted and scheduled
+    after the commit of the transaction, out of the write lock.
+
+    :param session: An ORM session
+    :param tid: A tenant ID
+    :param address: The address of the recipient
+    :param subject: The subject of the mail
+    :param body: The body of the mail
+    :param pgp_key_public: The PGP key of the recipient
+    :return: The scheduled mail, if not encrypted
+    """
+    if pgp_key_public:
+        db_after_commit(session, schedule_encrypted_email, tid, address, subject, body, pgp_key_public)
+        return
+
     return db_add(session,
                   models.Mail,
                   {
@@ -14,7 +14,8 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import constant_time, hashes
 from cryptography.hazmat.primitives.twofactor.totp import TOTP
 
-from nacl.encoding import Base64Encoder
+from nacl.encoding import Base64Encoder, RawEncoder
+from nacl.hash import blake2b
 from nacl.pwhash import argon2id
 from nacl.public import SealedBox, PrivateKey, PublicKey
 from nacl.secret import SecretBox
@@ -25,7 +26,6 @@ from typing import Any, Optional, Tuple, Union
 
 
 crypto_backend = default_backend()
-lock = threading.Lock()
 
 def _convert_to_bytes(arg: Union[bytes, str]) -> bytes:
     """
@@ -90,30 +90,106 @@ def totpVerify(secret: str, token: str) -> None:
         raise Error
 
 
+class _Argon2Pool(object):
+    """
+    Bounded pool of slots for the execution of the memory hard Argon2 computations
+
+    The number of computations allowed to run concurrently is obtained dividing
+    the memory budget (Settings.argon2_memory_budget) by the memory required by
+    each computation.
+    The computations are executed by the calling threads and libsodium releases
+    the GIL so that concurrent computations effectively run in parallel.
+    """
+    def __init__(self, memory_budget: int = 1 << 29) -> None:
+        self.memory_budget = memory_budget
+        self.condition = threading.Condition()
+        self.running = 0
+        self.queued = 0
+        self.executions = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def size(self) -> int:
+        return max(1, self.memory_budget >> _GCE.options['MEMLIMIT'])
+
+    def run(self, function: Any, *args: Any) -> Any:
+        start = time.monotonic()
+
+        with self.condition:
+            self.queued += 1
+
+            try:
+                if self.running >= self.size:
+                    self.waits += 1
+
+                while self.running >= self.size:
+                    self.condition.wait()
+            finally:
+                self.queued -= 1
+
+            self.running += 1
+
+            wait_time = time.monotonic() - start
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        try:
+            return function(*args)
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.executions += 1
+                self.condition.notify()
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            return {
+                'size': self.size,
+                'running': self.running,
+                'queued': self.queued,
+                'executions': self.executions,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time
+            }
+
+
+argon2_pool = _Argon2Pool()
+
+
 def _kdf_argon2(password: bytes, salt: bytes) -> bytes:
-    lock.acquire()
+    salt = base64.b64decode(salt)
+    return argon2_pool.run(argon2id.kdf, 32, password, salt[0:16],
+                           _GCE.options['OPSLIMIT'] + 1,
+                           1 << _GCE.options['MEMLIMIT'])
 
-    try:
-        salt = base64.b64decode(salt)
-        return argon2id.kdf(32, password, salt[0:16],
-                            opslimit=_GCE.options['OPSLIMIT'] + 1,
-                            memlimit=1 << _GCE.options['MEMLIMIT'])
-    finally:
-        lock.release()
 
+def _hash_key(key: bytes) -> str:
+    """
+    Derive from a key the hash used for authentication
 
-def _hash_argon2(password: bytes, salt: bytes) -> str:
-    lock.acquire()
+    The hash is 33 bytes long so that its base64 representation has the
+    same length of the legacy hashes but, differently from them, no padding.
+    """
+    hash = blake2b(key, digest_size=33, person=b'GLAuthentication', encoder=RawEncoder)
+    return base64.b64encode(hash).decode()
 
-    try:
-        salt = base64.b64decode(salt)
-        hash = argon2id.kdf(32, password, salt[0:16],
-                            opslimit=_GCE.options['OPSLIMIT'],
-                            memlimit=1 << _GCE.options['MEMLIMIT'])
-        return base64.b64encode(hash).decode()
 
-    finally:
-        lock.release()
+def _tip_content_key(tip_prv_key: Union[bytes, str]) -> bytes:
+    """
+    Derive from the private key of a tip the symmetric key protecting its contents
+    """
+    return blake2b(_convert_to_bytes(tip_prv_key), digest_size=32, person=b'GLTipContent', encoder=RawEncoder)
+
+
+def _hash_argon2(password: bytes, salt: bytes) -> str:
+    salt = base64.b64decode(salt)
+    hash = argon2_pool.run(argon2id.kdf, 32, password, salt[0:16],
+                           _GCE.options['OPSLIMIT'],
+                           1 << _GCE.options['MEMLIMIT'])
+    return base64.b64encode(hash).decode()
 
 
 class _StreamingEncryptionObject(object):
@@ -198,6 +274,11 @@ class _GCE(object):
         'MEMLIMIT': 27 # 128MB
     }
 
+    # Prefix of the tip contents encrypted with the symmetric format;
+    # the colon is not part of the base64 alphabet and so the prefix
+    # could not be confused with contents in the legacy format
+    TIP_CONTENT_V2 = b'v2:'
+
     @staticmethod
     def generate_receipt() -> str:
         """
@@ -212,27 +293,82 @@ class _GCE(object):
         """
         return base64.b64encode(os.urandom(16)).decode()
 
+    @staticmethod
+    def is_legacy_hash(hash: str) -> bool:
+        """
+        Return True if the hash has been computed with the legacy scheme
+        based on a separate Argon2 computation for the authentication
+        """
+        return _convert_to_bytes(hash).endswith(b'=')
+
     @staticmethod
     def hash_password(password: str, salt: str) -> str:
         """
         Return the hash a password
         """
+        return _GCE.calculate_hash_and_key(password, salt)[0]
+
+    @staticmethod
+    def legacy_hash_password(password: str, salt: str) -> str:
+        """
+        Return the hash of a password computed with the legacy scheme
+        """
         password = _convert_to_bytes(password)
         salt = _convert_to_bytes(salt)
 
         return _hash_argon2(password, salt)
 
     @staticmethod
-    def check_password(password: str, salt: str, hash: str) -> bool:
+    def calculate_hash_and_key(password: Union[bytes, str], salt: str) -> Tuple[str, bytes]:
         """
-        Perform passowrd check for match with a provided hash
+        Perform a single key derivation from a user password returning
+        the hash used for authentication and the user key
         """
         password = _convert_to_bytes(password)
         salt = _convert_to_bytes(salt)
-        hash = _convert_to_bytes(hash)
-        x = _convert_to_bytes(_hash_argon2(password, salt))
 
-        return constant_time.bytes_eq(x, hash)
+        key = _kdf_argon2(password, salt)
+
+        return _hash_key(key), key
+
+    @staticmethod
+    def check_password(password: str, salt: str, hash: str) -> bool:
+        """
+        Perform passowrd check for match with a provided hash
+        """
+        if _GCE.is_legacy_hash(hash):
+            x = _GCE.legacy_hash_password(password, salt)
+        else:
+            x = _GCE.hash_password(password, salt)
+
+        return constant_time.bytes_eq(_convert_to_bytes(x), _convert_to_bytes(hash))
+
+    @staticmethod
+    def check_password_and_derive_key(password: str, salt: str, hash: str) -> Tuple[bool, bytes, str]:
+        """
+        Perform password check for match with a provided hash and key derivation
+
+        The check of a hash computed with the current scheme requires a single
+        key derivation. The check of a legacy hash requires an additional
+        computation that is performed only in case of a valid password and
+        returns the hash computed with the current scheme for its upgrade.
+
+        :return: A tuple containing the result of the check, the user key
+                 and the hash computed with the current scheme
+        """
+        if _GCE.is_legacy_hash(hash):
+            x = _GCE.legacy_hash_password(password, salt)
+            if not constant_time.bytes_eq(_convert_to_bytes(x), _convert_to_bytes(hash)):
+                return False, b'', hash
+
+            x, key = _GCE.calculate_hash_and_key(password, salt)
+            return True, key, x
+
+        x, key = _GCE.calculate_hash_and_key(password, salt)
+        if not constant_time.bytes_eq(_convert_to_bytes(x), _convert_to_bytes(hash)):
+            return False, b'', hash
+
+        return True, key, x
 
     @staticmethod
     def generate_key() -> bytes:
@@ -304,6 +440,34 @@ class _GCE(object):
         data = _convert_to_bytes(data)
         return SealedBox(prv_key).decrypt(data)
 
+    @staticmethod
+    def is_legacy_tip_content(data: Union[bytes, str]) -> bool:
+        """
+        Return True if the content of a tip has been encrypted with the legacy
+        format based on a separate sealedbox for each field
+        """
+        return not _convert_to_bytes(data).startswith(_GCE.TIP_CONTENT_V2)
+
+    @staticmethod
+    def tip_content_encrypt(tip_prv_key: Union[bytes, str], data: Union[bytes, str]) -> str:
+        """
+        Encrypt the content of a tip with the symmetric key derived from the tip private key
+        """
+        data = _GCE.symmetric_encrypt(_tip_content_key(tip_prv_key), data)
+        return (_GCE.TIP_CONTENT_V2 + Base64Encoder.encode(data)).decode()
+
+    @staticmethod
+    def tip_content_decrypt(tip_prv_key: Union[bytes, str], data: Union[bytes, str]) -> bytes:
+        """
+        Decrypt the content of a tip supporting both the symmetric and the legacy format
+        """
+        data = _convert_to_bytes(data)
+        if not _GCE.is_legacy_tip_content(data):
+            data = Base64Encoder.decode(data[len(_GCE.TIP_CONTENT_V2):])
+            return _GCE.symmetric_decrypt(_tip_content_key(tip_prv_key), data)
+
+        return _GCE.asymmetric_decrypt(tip_prv_key, base64.b64decode(data))
+
     @staticmethod
     def streaming_encryption_open(mode: str, user_key: Union[bytes, str], filepath: str) -> '_StreamingEncryptionObject':
         return _StreamingEncryptionObject(mode, user_key, filepath)
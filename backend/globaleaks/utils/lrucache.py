@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe bounded mapping evicting the least recently used entries
+    and keeping track of the cache hits and misses
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -1,5 +1,6 @@
 # -*- coding: utf-8
 # GlobaLeaks Utility used to handle Mail, format, exception, etc
+from collections import deque
 from io import BytesIO
 
 from email import utils  # pylint: disable=no-name-in-module
@@ -9,7 +10,7 @@ from email.mime.text import MIMEText
 
 from twisted.internet import reactor, defer
 from twisted.internet.endpoints import TCP4ClientEndpoint
-from twisted.mail.smtp import messageid, ESMTPSenderFactory
+from twisted.mail.smtp import messageid, ESMTPSender, ESMTPSenderFactory, SMTPClient, SMTPDeliveryError, SUCCESS
 from twisted.protocols import tls
 
 from globaleaks.utils.socks import SOCKS5ClientEndpoint
@@ -40,7 +41,239 @@ def MIME_mail_build(src_name, src_mail, dest_name, dest_mail, mail_subject, mail
     return BytesIO(multipart.as_bytes())  # pylint: disable=no-member
 
 
-def sendmail(tid, smtp_host, smtp_port, security, authentication, username, password, from_name, from_address, to_address, subject, body, anonymize=True, socks_port=9999):
+class _SMTPSessionSender(ESMTPSender):
+    """
+    ESMTP sender delivering within the same session all the messages
+    made available by the pool of the connection
+    """
+    def getMailFrom(self):
+        self.factory.message = self.factory.pool.get_message()
+        if self.factory.message is None:
+            return None
+
+        return self.factory.message['from_address']
+
+    def getMailTo(self):
+        return [self.factory.message['to_address'].encode()]
+
+    def getMailData(self):
+        return self.factory.message['data']
+
+    def sendError(self, exc):
+        SMTPClient.sendError(self, exc)
+        self.factory.error = exc
+        self.factory.message_done(exc)
+
+    def sentMail(self, code, resp, numOk, addresses, log):
+        if code in SUCCESS:
+            self.factory.message_done()
+        else:
+            self.factory.message_done(SMTPDeliveryError(code, resp, log.str(), addresses))
+
+    def connectionLost(self, reason):
+        ESMTPSender.connectionLost(self, reason)
+        self.factory.session_done(reason)
+
+
+class _SMTPSessionFactory(ESMTPSenderFactory):
+    protocol = _SMTPSessionSender
+
+    def __init__(self, pool, context_factory):
+        self.pool = pool
+        self.message = None
+        self.sent = 0
+        self.error = None
+        self.done = False
+
+        ESMTPSenderFactory.__init__(self,
+                                    pool.username.encode() if pool.authentication else None,
+                                    pool.password.encode() if pool.authentication else None,
+                                    '',
+                                    [],
+                                    None,
+                                    defer.Deferred(),
+                                    retries=0,
+                                    timeout=pool.timeout,
+                                    contextFactory=context_factory,
+                                    requireAuthentication=pool.authentication,
+                                    requireTransportSecurity=(pool.security == 'TLS'))
+
+    def message_done(self, error=None):
+        message, self.message = self.message, None
+
+        if message is None:
+            return
+
+        if error is None:
+            self.sent += 1
+            message['deferred'].callback(True)
+        else:
+            log.err("SMTP connection failed (Exception: %s)", error, tid=self.pool.tid)
+            message['deferred'].callback(False)
+
+    def session_done(self, reason):
+        if self.done:
+            return
+
+        self.done = True
+
+        if self.message is not None or not self.sent and self.error is None and not self.currentProtocol:
+            # The connection has been lost during a delivery or it could not be established
+            self.error = reason.value
+
+        self.message_done(reason.value)
+
+        self.pool.session_closed(self)
+
+
+class SMTPServerPool(object):
+    """
+    Pool of the connections to an SMTP server
+
+    The messages are queued and delivered by up to concurrency connections,
+    each of them delivering the queued messages within the same SMTP session
+    and disconnecting when the queue is empty. When rate_limit is set at
+    most rate_limit messages are delivered every minute.
+    """
+    clock = reactor
+
+    def __init__(self, tid, smtp_host, smtp_port, security, authentication, username, password, anonymize, socks_port):
+        self.tid = tid
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.security = security
+        self.authentication = authentication
+        self.username = username
+        self.password = password
+        self.anonymize = anonymize
+        self.socks_port = socks_port
+
+        self.concurrency = 1
+        self.rate_limit = 0
+        self.timeout = 30
+
+        self.queue = deque()
+        self.sessions = 0
+        self.tokens = 0
+        self.last_refill = None
+        self.wakeup = None
+
+    def configure(self, concurrency, rate_limit, timeout):
+        self.concurrency = max(1, concurrency)
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+
+    def has_token(self):
+        """
+        Refill the bucket of the tokens regulating the rate of the deliveries
+        and return True if a delivery could be performed
+        """
+        if not self.rate_limit:
+            return True
+
+        now = self.clock.seconds()
+
+        if self.last_refill is None:
+            self.tokens = self.concurrency
+        else:
+            self.tokens = min(self.concurrency, self.tokens + (now - self.last_refill) * self.rate_limit / 60.0)
+
+        self.last_refill = now
+
+        if self.tokens >= 1:
+            return True
+
+        if self.wakeup is None:
+            self.wakeup = self.clock.callLater((1 - self.tokens) * 60.0 / self.rate_limit, self.on_wakeup)
+
+        return False
+
+    def on_wakeup(self):
+        self.wakeup = None
+        self.dispatch()
+
+    def get_message(self):
+        if not self.queue or not self.has_token():
+            return None
+
+        if self.rate_limit:
+            self.tokens -= 1
+
+        return self.queue.popleft()
+
+    def sendmail(self, from_address, to_address, data):
+        d = defer.Deferred()
+
+        self.queue.append({
+            'from_address': from_address,
+            'to_address': to_address,
+            'data': data,
+            'deferred': d
+        })
+
+        self.dispatch()
+
+        return d
+
+    def dispatch(self):
+        while self.sessions < min(self.concurrency, len(self.queue)) and self.has_token():
+            self.sessions += 1
+            self.connect(_SMTPSessionFactory(self, TLSClientContextFactory()))
+
+    def connect(self, factory):
+        protocol_factory = factory
+
+        if self.security == "SSL":
+            protocol_factory = tls.TLSMemoryBIOFactory(factory._contextFactory, True, factory)
+
+        if self.anonymize:
+            socksProxy = TCP4ClientEndpoint(reactor, "127.0.0.1", self.socks_port, timeout=self.timeout)
+            endpoint = SOCKS5ClientEndpoint(self.smtp_host.encode('utf-8'), self.smtp_port, socksProxy)
+        else:
+            endpoint = TCP4ClientEndpoint(reactor, self.smtp_host, self.smtp_port, timeout=self.timeout)
+
+        endpoint.connect(protocol_factory).addErrback(factory.session_done)
+
+    def session_closed(self, factory):
+        self.sessions -= 1
+
+        if factory.error is not None and not factory.sent and not self.sessions:
+            # The server is unreachable; the messages queued are failed
+            while self.queue:
+                self.queue.popleft()['deferred'].callback(False)
+        else:
+            self.dispatch()
+
+        if not self.queue and not self.sessions:
+            SMTPPools.release(self)
+
+
+class _SMTPPools(object):
+    """
+    Registry of the SMTP connection pools identified by tenant and server configuration
+    """
+    def __init__(self):
+        self.pools = {}
+
+    def get(self, *args):
+        if args not in self.pools:
+            self.pools[args] = SMTPServerPool(*args)
+
+        return self.pools[args]
+
+    def release(self, pool):
+        for key, value in list(self.pools.items()):
+            if value is pool:
+                del self.pools[key]
+
+    def clear(self):
+        self.pools.clear()
+
+
+SMTPPools = _SMTPPools()
+
+
+def sendmail(tid, smtp_host, smtp_port, security, authentication, username, password, from_name, from_address, to_address, subject, body, anonymize=True, socks_port=9999, concurrency=1, rate_limit=0, timeout=30):
     """
     Send an email using SMTPS/SMTP+TLS and maybe torify the connection.
 
@@ -58,11 +291,12 @@ def sendmail(tid, smtp_host, smtp_port, security, authentication, username, pass
     :param body: A mail body
     :param anonymize: A boolean to enable anonymous mail connection
     :param socks_port: A socks port to be used for the mail connection
-    :return: A deferred resource resolving at the end of the connection
+    :param concurrency: The maximum number of connections to the SMTP server
+    :param rate_limit: The maximum number of mails sent every minute; 0 disables the limit
+    :param timeout: The timeout in seconds of the connections and of the SMTP commands
+    :return: A deferred resource resolving to True if the mail has been sent
     """
     try:
-        timeout = 30
-
         message = MIME_mail_build(from_name,
                                   from_address,
                                   to_address,
@@ -77,51 +311,10 @@ def sendmail(tid, smtp_host, smtp_port, security, authentication, username, pass
                   security,
                   tid=tid)
 
-        context_factory = TLSClientContextFactory()
-
-        smtp_deferred = defer.Deferred()
-
-        factory = ESMTPSenderFactory(
-            username.encode() if authentication else None,
-            password.encode() if authentication else None,
-            from_address,
-            to_address,
-            message,
-            smtp_deferred,
-            contextFactory=context_factory,
-            requireAuthentication=authentication,
-            requireTransportSecurity=(security == 'TLS'),
-            retries=0,
-            timeout=timeout)
-
-        if security == "SSL":
-            factory = tls.TLSMemoryBIOFactory(context_factory, True, factory)
-
-        if anonymize:
-            socksProxy = TCP4ClientEndpoint(reactor, "127.0.0.1", socks_port, timeout=timeout)
-            endpoint = SOCKS5ClientEndpoint(smtp_host.encode('utf-8'), smtp_port, socksProxy)
-        else:
-            endpoint = TCP4ClientEndpoint(reactor, smtp_host, smtp_port, timeout=timeout)
-
-        conn_deferred = endpoint.connect(factory)
-
-        final = defer.DeferredList([conn_deferred, smtp_deferred], fireOnOneErrback=True, consumeErrors=True)
-
-        def failure_cb(failure):
-            """
-            :param failure {Failure {twisted.internet.FirstError {Failure}}}
-            """
-            log.err("SMTP connection failed (Exception: %s)",
-                    failure.value.subFailure.value, tid=tid)
-            return False
-
-        def success_cb(results):
-            """
-            :param results {list of (success, return_val) tuples}
-            """
-            return True
+        pool = SMTPPools.get(tid, smtp_host, smtp_port, security, authentication, username, password, anonymize, socks_port)
+        pool.configure(concurrency, rate_limit, timeout)
 
-        return final.addCallbacks(success_cb, failure_cb)
+        return pool.sendmail(from_address, to_address, message)
 
     except Exception as e:
         # avoids raising an exception inside email logic to avoid chained errors
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import subprocess
+import threading
 
 from datetime import datetime
 
@@ -8,18 +10,109 @@ from tempfile import TemporaryDirectory
 from gnupg import GPG
 
 from globaleaks.rest import errors
+from globaleaks.utils.crypto import sha256
 from globaleaks.utils.log import log
+from globaleaks.utils.lrucache import LRUCache
+
+
+class _PGPEncryptionStream(object):
+    """
+    File object streaming the output of a gpg process encrypting an input file
+
+    The input file is fed to the process by a separate thread so that
+    neither the input nor the output need to be stored.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, context, input_file):
+        # The context holds the keyring used by the process
+        self.context = context
+        self.input_file = input_file
+
+        self.process = context.encryption_process(subprocess.PIPE)
+
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+
+    def feed(self):
+        try:
+            while True:
+                chunk = self.input_file.read(self.chunk_size)
+                if not chunk:
+                    break
+
+                self.process.stdin.write(chunk)
+        except Exception:
+            # The process has been terminated before the end of the input
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except Exception:
+                pass
+
+            self.input_file.close()
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+
+        if not data and self.process.wait() != 0:
+            raise errors.InputValidationError
+
+        return data
+
+    def close(self):
+        """
+        Terminate the process and wait for it and for the feeding thread
+
+        The function blocks and is intended to be executed in a worker thread.
+        """
+        if self.process.poll() is None:
+            self.process.kill()
+
+        self.process.wait()
+        self.process.stdout.close()
+        self.thread.join()
+
+
+class _PGPFileEncryptor(object):
+    """
+    File object encrypting the data written to it to an output file
+    """
+    def __init__(self, context, output_path):
+        # The context holds the keyring used by the process
+        self.context = context
+
+        with open(output_path, 'wb') as output_file:
+            self.process = context.encryption_process(output_file)
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+        except BrokenPipeError:
+            # The process failed; the error is reported on close
+            pass
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        if self.process.wait() != 0:
+            raise errors.InputValidationError
 
 
 class PGPContext(object):
-    def __init__(self, key):
+    def __init__(self, key, path=None):
         """
         :param key: The PGP key to be loaded
+        :param path: The directory where to create the GnuPG home
         """
         self.fingerprint = ''
         self.expiration = datetime.utcfromtimestamp(0)
 
-        self.tempdir = TemporaryDirectory()
+        self.tempdir = TemporaryDirectory(dir=path)
 
         try:
             self.gnupg = GPG(gnupghome=self.tempdir.name, options=['--trust-model', 'always'])
@@ -60,6 +153,31 @@ class PGPContext(object):
 
         return encrypted_obj, os.stat(output_path).st_size
 
+    def encryption_process(self, stdout):
+        """
+        Start a gpg process encrypting its standard input with the specified PGP key
+        """
+        return subprocess.Popen([self.gnupg.gpgbinary,
+                                 '--homedir', self.tempdir.name,
+                                 '--batch', '--no-tty',
+                                 '--trust-model', 'always',
+                                 '--encrypt', '--recipient', self.fingerprint],
+                                stdin=subprocess.PIPE,
+                                stdout=stdout,
+                                stderr=subprocess.DEVNULL)
+
+    def open_file_encryption(self, output_path):
+        """
+        Return a file object encrypting with the specified PGP key the data written to it
+        """
+        return _PGPFileEncryptor(self, output_path)
+
+    def encrypt_stream(self, input_file):
+        """
+        Return a file object streaming the encryption of a file with the specified PGP key
+        """
+        return _PGPEncryptionStream(self, input_file)
+
     def encrypt_message(self, plaintext):
         """
         Encrypt a text message with the specified key
@@ -70,3 +188,88 @@ class PGPContext(object):
             raise errors.InputValidationError
 
         return str(encrypted_obj)
+
+    def encrypt_messages(self, plaintexts):
+        """
+        Encrypt a list of text messages with the specified key using a single gpg process
+        """
+        if not plaintexts:
+            return []
+
+        with TemporaryDirectory(dir=os.path.dirname(self.tempdir.name)) as tempdir:
+            paths = []
+            for i, plaintext in enumerate(plaintexts):
+                paths.append(os.path.join(tempdir, str(i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(plaintext.encode())
+
+            ret = subprocess.call([self.gnupg.gpgbinary,
+                                   '--homedir', self.tempdir.name,
+                                   '--batch', '--no-tty',
+                                   '--trust-model', 'always',
+                                   '--armor', '--multifile',
+                                   '--encrypt', '--recipient', self.fingerprint] + paths,
+                                  stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+
+            if ret != 0:
+                raise errors.InputValidationError
+
+            ret = []
+            for path in paths:
+                with open(path + '.asc', 'r') as f:
+                    ret.append(f.read())
+
+            return ret
+
+
+class _PGPContextCache(LRUCache):
+    """
+    Cache of the contexts of the PGP keys in use
+
+    The contexts are identified by the digest of their keys and hold a
+    GnuPG home where the key has been already imported so that each key
+    is imported once regardless of the number of the encryptions.
+    The GnuPG home of a context is deleted when the context is evicted
+    and no more referenced.
+    """
+    # The directory where to create the GnuPG homes
+    path = None
+
+    def get_context(self, key):
+        digest = sha256(key)
+
+        context = self.get(digest)
+        if context is None:
+            context = PGPContext(key, self.path)
+            self.set(digest, context)
+
+        return context
+
+
+pgp_contexts = _PGPContextCache(1000)
+
+
+def get_pgp_copy_name(file_id, fingerprint):
+    """
+    Return the name of the copy of a file encrypted with a PGP key
+
+    The fingerprint is part of the name so that a copy is used only while
+    the key of the recipient is unchanged.
+
+    :param file_id: The ID of the file
+    :param fingerprint: The fingerprint of the PGP key
+    :return: The name of the copy
+    """
+    return '%s.%s' % (file_id, fingerprint)
+
+
+def get_pgp_context(key):
+    """
+    Return the context of the specified PGP key reusing it if already in use
+
+    :param key: The PGP key to be loaded
+    :return: A PGPContext
+    """
+    return pgp_contexts.get_context(key)
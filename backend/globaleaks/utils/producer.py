@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Implementation of a producer streaming files read in a worker thread
+from collections import deque
+
+from twisted.internet import abstract, defer, reactor
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from zope.interface import implementer
+
+_THREAD_POOL = None
+
+
+def set_thread_pool(thread_pool):
+    global _THREAD_POOL
+    _THREAD_POOL = thread_pool
+
+
+def get_thread_pool():
+    return _THREAD_POOL if _THREAD_POOL is not None else reactor.getThreadPool()
+
+
+@implementer(IPushProducer)
+class ThreadedFileProducer(object):
+    """
+    Producer streaming a file object to a consumer
+
+    The reads, including the eventual decryption of the chunks, are performed
+    in a worker thread so that the reactor thread is never blocked. Up to
+    read_ahead chunks are read in advance while the consumer is paused and
+    the reading is suspended once the limit is reached.
+    """
+    chunk_size = abstract.FileDescriptor.bufferSize
+
+    def __init__(self, fo, read_ahead=8):
+        self.fo = fo
+        self.read_ahead = read_ahead
+        self.chunks = deque()
+        self.consumer = None
+        self.deferred = None
+        self.reading = False
+        self.paused = False
+        self.stopped = False
+        self.eof = False
+
+    def beginFileTransfer(self, consumer):
+        """
+        Begin the transfer of the file to the consumer
+
+        :param consumer: The consumer to which write the file
+        :return: A deferred firing when the transfer is complete
+        """
+        self.consumer = consumer
+        self.deferred = defer.Deferred()
+        self.consumer.registerProducer(self, True)
+        self.read()
+        return self.deferred
+
+    def read(self):
+        if self.reading or self.eof or self.consumer is None or len(self.chunks) >= self.read_ahead:
+            return
+
+        self.reading = True
+
+        d = deferToThreadPool(reactor, get_thread_pool(), self.fo.read, self.chunk_size)
+        d.addCallbacks(self.on_read, self.on_error)
+
+    def on_read(self, chunk):
+        self.reading = False
+
+        if self.stopped:
+            return self.finish(Failure(Exception("Consumer asked us to stop producing")))
+
+        if chunk:
+            self.chunks.append(chunk)
+        else:
+            self.eof = True
+
+        self.write()
+        self.read()
+
+    def on_error(self, failure):
+        self.reading = False
+        self.finish(failure)
+
+    def write(self):
+        while self.chunks and not self.paused and self.consumer is not None:
+            self.consumer.write(self.chunks.popleft())
+
+        if self.eof and not self.chunks:
+            self.finish()
+
+    def finish(self, failure=None):
+        if self.consumer is None:
+            return
+
+        if not self.stopped:
+            self.consumer.unregisterProducer()
+
+        self.consumer = None
+        self.chunks.clear()
+
+        if failure is None:
+            self.deferred.callback(None)
+        else:
+            self.deferred.errback(failure)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.write()
+        self.read()
+
+    def stopProducing(self):
+        self.stopped = True
+
+        # The file object could be released only when no read is in progress
+        if not self.reading:
+            self.finish(Failure(Exception("Consumer asked us to stop producing")))
@@ -12,7 +12,7 @@ from twisted.internet.abstract import isIPAddress
 
 from globaleaks import __version__
 from globaleaks.rest import errors
-from globaleaks.utils.pgp import PGPContext
+from globaleaks.utils.lrucache import LRUCache
 from globaleaks.utils.utility import datetime_to_pretty_str, \
     datetime_to_day_str, \
     bytes_to_pretty_str, \
@@ -127,6 +127,9 @@ account_activation_keywords = [
 ]
 
 
+keyword_regexp = re.compile(r'({\w+})')
+
+
 def indent(n=1):
     return '  ' * n
 
@@ -149,6 +152,13 @@ class Keyword(object):
 
         self.data = data
 
+    @classmethod
+    def get_keywords(cls):
+        if '_keywords' not in cls.__dict__:
+            cls._keywords = frozenset(cls.keyword_list)
+
+        return cls._keywords
+
 
 class NodeKeyword(Keyword):
     keyword_list = node_keywords
@@ -653,21 +663,60 @@ supported_template_types = {
 }
 
 
+class Template(object):
+    """
+    Template parsed in the sequence of its texts and keywords
+
+    The tokens at the even positions are texts and the ones at the odd
+    positions are keywords; the keywords not supported by the converter
+    used for the rendering are kept as text.
+    """
+    def __init__(self, raw_template):
+        self.text = raw_template.rstrip()
+        self.tokens = keyword_regexp.split(raw_template)
+
+    def render(self, keyword_converter):
+        keywords = keyword_converter.get_keywords()
+        if len(self.tokens) == 1 or not keywords:
+            return self.text
+
+        values = {}
+        output = []
+
+        for i, token in enumerate(self.tokens):
+            if i % 2 and token in keywords:
+                if token not in values:
+                    # {SomeKeyword} is resolved calling keyword_converter.SomeKeyword
+                    value = getattr(keyword_converter, token[1:-1])()
+                    values[token] = value.replace('{', '(').replace('}', ')')
+
+                token = values[token]
+
+            output.append(token)
+
+        return ''.join(output).rstrip()
+
+
+templates_cache = LRUCache(1000)
+
+
+def get_template(raw_template):
+    """
+    Return the parsed version of a template caching it by its content
+    """
+    template = templates_cache.get(raw_template)
+    if template is None:
+        template = Template(raw_template)
+        templates_cache.set(raw_template, template)
+
+    return template
+
+
 class Templating(object):
     def format_template(self, raw_template, data):
         keyword_converter = supported_template_types[data['type']](data)
 
-        for kw in keyword_converter.keyword_list:
-            if raw_template.count(kw):
-                # if {SomeKeyword} matches, call keyword_converter.SomeKeyword function
-                variable_content = getattr(keyword_converter, kw[1:-1])()
-                variable_content = re.sub("{", "(", variable_content)
-                variable_content = re.sub("}", ")", variable_content)
-                raw_template = raw_template.replace(kw, variable_content)
-
-        raw_template = raw_template.rstrip()
-
-        return raw_template
+        return get_template(raw_template).render(keyword_converter)
 
     def get_mail_subject_and_body(self, data):
         subject_template = ''
@@ -688,10 +737,4 @@ class Templating(object):
         subject = self.format_template(subject_template, data)
         body = self.format_template(body_template, data)
 
-        if 'user' in data and data['user']['pgp_key_public']:
-            try:
-                body = PGPContext(data['user']['pgp_key_public']).encrypt_message(body)
-            except:
-                body = ""
-
         return subject, body
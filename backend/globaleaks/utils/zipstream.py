@@ -8,20 +8,63 @@
 # our purpose (that's the reason why is not in third party)
 import binascii
 import os
+import queue
 import struct
+import threading
 import time
 import zlib
 
-from twisted.internet import abstract
-from twisted.internet.defer import Deferred
+from concurrent.futures import ThreadPoolExecutor
 
 from globaleaks.utils.crypto import GCE
 
 __all__ = ["ZipStream"]
 
 ZIP64_LIMIT = (1 << 31) - 1
+ZIP_STORED = 0
 ZIP_DEFLATED = 8
 
+# Contents that are already compressed and are stored without compression
+COMPRESSED_MIME_TYPES = {
+    'application/epub+zip',
+    'application/gzip',
+    'application/pdf',
+    'application/vnd.rar',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-rar-compressed',
+    'application/x-xz',
+    'application/zip',
+    'audio/aac',
+    'audio/flac',
+    'audio/mp4',
+    'audio/mpeg',
+    'audio/ogg',
+    'audio/opus',
+    'audio/webm',
+    'image/gif',
+    'image/heic',
+    'image/jpeg',
+    'image/png',
+    'image/webp'
+}
+
+COMPRESSED_MIME_TYPES_PREFIXES = (
+    'application/vnd.oasis.opendocument.',
+    'application/vnd.openxmlformats-officedocument.',
+    'video/'
+)
+
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.avi', '.bz2', '.docx', '.epub', '.flac', '.gif', '.gpg',
+    '.gz', '.heic', '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4',
+    '.odp', '.ods', '.odt', '.ogg', '.opus', '.pdf', '.pgp', '.png', '.pptx',
+    '.rar', '.webm', '.webp', '.xlsx', '.xz', '.zip'
+}
+
+# Entries whose first chunk does not deflate below this ratio are stored
+SAMPLE_COMPRESSION_RATIO = 0.9
+
 # Here are some struct module formats for reading headers
 structEndArchive = b"<4s4H2lH"     # 9 items, end of archive, 22 bytes
 stringEndArchive = b"PK\005\006"   # magic number for end of archive record
@@ -141,15 +184,103 @@ class ZipInfo(object):
         return header + filename + extra
 
 
+class _DecryptionReader(object):
+    """
+    File object returning the chunks of an encrypted file decrypted by a worker thread
+
+    At most queue_size decrypted chunks are kept in memory waiting to be read
+    so that the decryption is suspended until the consumer catches up.
+    """
+    queue_size = 4
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self.queue = queue.Queue(self.queue_size)
+        self.cancelled = threading.Event()
+        self.eof = False
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def decrypt(self):
+        try:
+            with GCE.streaming_encryption_open('DECRYPT', self.key, self.path) as fo:
+                while True:
+                    chunk = fo.read(-1)
+                    if not chunk:
+                        break
+
+                    if not self.put(chunk):
+                        return
+
+            self.put(b'')
+        except Exception as e:
+            self.put(e)
+
+    def read(self, size=-1):
+        if self.eof:
+            return b''
+
+        item = self.queue.get()
+
+        if isinstance(item, Exception):
+            self.eof = True
+            raise item
+
+        if not item:
+            self.eof = True
+
+        return item
+
+    def close(self):
+        self.cancelled.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_compressed_content(arcname, content_type=''):
+    """
+    Return True if the MIME type or the extension of a file identify an already compressed content
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+
+    if content_type in COMPRESSED_MIME_TYPES or content_type.startswith(COMPRESSED_MIME_TYPES_PREFIXES):
+        return True
+
+    return os.path.splitext(arcname)[1].lower() in COMPRESSED_EXTENSIONS
+
+
 class ZipStream(object):
-    def __init__(self, files):
+    def __init__(self, files, decryption_threads=0, compression_level=zlib.Z_DEFAULT_COMPRESSION):
+        """
+        :param files: The list of the files to be archived
+        :param decryption_threads: The number of threads used to decrypt in advance
+                                   the encrypted files following the one being archived
+        :param compression_level: The deflate level; 0 stores all the files without compression
+        """
         self.files = files
+        self.decryption_threads = decryption_threads
+        self.compression_level = compression_level
 
         self.filelist = []  # List of ZipInfo instances for archive
         self.data_ptr = 0   # Keep track of location inside archive
 
         self.time = time.gmtime()[0:6]  # Security: Forced Time
 
+        self.iterator = None
+
     def update_data_ptr(self, data):
         """
         As data is added to the archive, update a pointer so we can determine
@@ -162,11 +293,25 @@ class ZipStream(object):
         self.data_ptr += len(data)
         return data
 
-    def zipinfo_open(self, arcname):
-        zinfo = ZipInfo(arcname, self.time, ZIP_DEFLATED)
+    def get_compression(self, arcname, content_type, sample):
+        """
+        Return the compression method to be used for a file given its first chunk
+        """
+        if self.compression_level == 0 or is_compressed_content(arcname, content_type):
+            return ZIP_STORED
+
+        if sample and len(zlib.compress(sample, 1)) > len(sample) * SAMPLE_COMPRESSION_RATIO:
+            return ZIP_STORED
+
+        return ZIP_DEFLATED
+
+    def zipinfo_open(self, arcname, compression=ZIP_DEFLATED):
+        zinfo = ZipInfo(arcname, self.time, compression)
         zinfo.header_offset = self.data_ptr
 
-        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        cmpr = None
+        if compression == ZIP_DEFLATED:
+            cmpr = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15)
 
         header = zinfo.FileHeader()
 
@@ -180,7 +325,9 @@ class ZipStream(object):
         zinfo.file_size += len(chunk)
         zinfo.CRC = binascii.crc32(chunk, zinfo.CRC) & 0xffffffff
 
-        chunk = cmpr.compress(chunk)
+        if cmpr is not None:
+            chunk = cmpr.compress(chunk)
+
         zinfo.compress_size += len(chunk)
 
         self.update_data_ptr(chunk)
@@ -188,7 +335,7 @@ class ZipStream(object):
         return chunk
 
     def zipinfo_close(self, zinfo, cmpr):
-        buf = cmpr.flush()
+        buf = cmpr.flush() if cmpr is not None else b''
         zinfo.compress_size += len(buf)
         self.update_data_ptr(buf)
 
@@ -197,17 +344,16 @@ class ZipStream(object):
 
         return buf + trailer
 
-    def zip_fo(self, fo, arcname):
-        zipinfo, cmpr, header = self.zipinfo_open(arcname)
+    def zip_fo(self, fo, arcname, content_type=''):
+        buf = fo.read(8 * 1024)
 
-        yield header
+        zipinfo, cmpr, header = self.zipinfo_open(arcname, self.get_compression(arcname, content_type, buf))
 
-        while True:
-             buf = fo.read(8 * 1024)
-             if not buf:
-               break
+        yield header
 
-             yield self.zipinfo_update(zipinfo, cmpr, buf)
+        while buf:
+            yield self.zipinfo_update(zipinfo, cmpr, buf)
+            buf = fo.read(8 * 1024)
 
         yield self.zipinfo_close(zipinfo, cmpr)
 
@@ -299,64 +445,70 @@ class ZipStream(object):
 
         return b''.join(data)
 
-    def __iter__(self):
-        for f in self.files:
-            try:
-                if 'key' in f:
-                    with GCE.streaming_encryption_open('DECRYPT', f['key'], f['path']) as fo:
-                        for data in self.zip_fo(fo, f['name']):
-                            yield data
-                elif 'fo' in f:
-                    with f['fo']:
-                        for data in self.zip_fo(f['fo'], f['name']):
-                            yield data
-                else:
-                    with open(f['path'], "rb") as fo:
-                        for data in self.zip_fo(fo, f['name']):
-                            yield data
-            except:
-                pass
-
-        yield self.archive_footer()
+    def open_file(self, f, readers):
+        if 'key' in f:
+            if id(f) in readers:
+                return readers.pop(id(f))
 
+            return GCE.streaming_encryption_open('DECRYPT', f['key'], f['path'])
+        elif 'fo' in f:
+            return f['fo']
+        else:
+            return open(f['path'], "rb")
 
-class ZipStreamProducer(object):
-    """Streaming producter for ZipStream"""
-
-    def __init__(self, handler, zipstreamObject):
-        self.finish = Deferred()
-        self.handler = handler
-        self.zipstreamObject = zipstreamObject
-
-    def start(self):
-        self.handler.request.registerProducer(self, False)
-        return self.finish
+    def __iter__(self):
+        executor = None
+        readers = {}
+
+        if self.decryption_threads:
+            executor = ThreadPoolExecutor(self.decryption_threads)
+
+        try:
+            for i, f in enumerate(self.files):
+                if executor is not None:
+                    # The decryption of the following files is started in
+                    # order so that at most decryption_threads files are
+                    # pending and each of them is assigned to a thread
+                    for x in self.files[i:i + self.decryption_threads]:
+                        if 'key' in x and id(x) not in readers:
+                            readers[id(x)] = _DecryptionReader(x['key'], x['path'])
+                            executor.submit(readers[id(x)].decrypt)
+
+                try:
+                    with self.open_file(f, readers) as fo:
+                        for data in self.zip_fo(fo, f['name'], f.get('type', '')):
+                            yield data
+                except:
+                    pass
 
-    def resumeProducing(self):
-        if not self.handler:
-            return
+            yield self.archive_footer()
+        finally:
+            if executor is not None:
+                for reader in readers.values():
+                    reader.close()
 
-        data = self.zip_chunk()
-        if data:
-            self.handler.request.write(data)
-        else:
-            self.stopProducing()
+                executor.shutdown(wait=False)
 
-    def stopProducing(self):
-        self.handler.request.unregisterProducer()
-        self.handler.request.finish()
-        self.handler = None
-        self.finish.callback(None)
+    def read(self, size=-1):
+        """
+        Read the archive as a file object returning chunks of at least size bytes
+        """
+        if self.iterator is None:
+            self.iterator = iter(self)
 
-    def zip_chunk(self):
         chunk = []
         chunk_size = 0
 
-        for data in self.zipstreamObject:
+        for data in self.iterator:
             if data:
                 chunk_size += len(data)
                 chunk.append(data)
-                if chunk_size >= abstract.FileDescriptor.bufferSize:
-                    return b''.join(chunk)
+                if 0 <= size <= chunk_size:
+                    break
 
         return b''.join(chunk)
+
+    def close(self):
+        if self.iterator is not None:
+            self.iterator.close()
+            self.iterator = None